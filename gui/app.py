@@ -112,6 +112,7 @@ class App:
         settings.add_section("code_completion")
         settings.set("main", "save-before-build", "True")
         settings.set("main", "ptp-debug", "False")
+        settings.set("main", "binary-protocol", "False")
         settings.set("code_completion","enable_highlight_current_line","True")
         settings.set("code_completion", "enable_show_line_numbers", "True")
         settings.set("code_completion", "tab_width", "4")
@@ -575,6 +576,8 @@ class App:
 
     def new_simulation(self):
         simulation = Simulation()
+        simulation.use_binary_protocol = \
+            self.settings.getboolean("main", "binary-protocol")
         simulation.set_callback("error", lambda line: self.console_write(line, "error"))
         simulation.set_callback("command-failed",
             lambda sequence, command:
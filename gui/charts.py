@@ -20,6 +20,7 @@
 
 import gtk
 import os
+import numpy as np
 import paths
 import utils
 import events as evt
@@ -127,6 +128,9 @@ class LineConfig:
         elif isinstance(line, mpl_Container):
             for child in line.get_children():
                 self.__set_visible(visible, child)
+        elif isinstance(line, list): # e.g. patches of a histogram
+            for child in line:
+                self.__set_visible(visible, child)
 
 class DrawLinesConfig:
 
@@ -170,6 +174,50 @@ class DrawLinesConfig:
             else:
                 change.set_mpl_line2('create_new')
 
+class IntervalsLevelOfDetail:
+    ''' Intervals of one row of a chart, they are provided merged with
+    respect to the current view; intervals (and gaps) shorter than one pixel
+    are not visible, so neighbouring intervals closer than one pixel are
+    merged into one. '''
+
+    def __init__(self, intervals):
+        if getattr(intervals, "dtype", None) is not None and intervals.dtype.names:
+            start_name, duration_name = intervals.dtype.names[:2]
+            starts = np.ma.filled(intervals[start_name], 0).astype(float)
+            durations = np.ma.filled(intervals[duration_name], 0).astype(float)
+        else:
+            data = np.asarray(intervals, dtype=float).reshape(-1, 2)
+            starts, durations = data[:, 0], data[:, 1]
+
+        order = np.argsort(starts, kind="mergesort")
+        self.starts = starts[order]
+        self.ends = self.starts + durations[order]
+        # the running maximum of ends is sorted, so the intervals that end
+        # before the view can be found by a binary search
+        self.max_ends = np.maximum.accumulate(self.ends)
+
+    def get_range(self):
+        if not len(self.starts):
+            return 0, 0
+        return self.starts[0], self.max_ends[-1]
+
+    def get_intervals(self, xmin, xmax, gap):
+        ''' Return pairs (start, duration) of merged intervals that
+        intersect the range <xmin, xmax>, intervals separated by a gap
+        smaller than 'gap' are merged. '''
+        first = np.searchsorted(self.max_ends, xmin, side="left")
+        last = np.searchsorted(self.starts, xmax, side="right")
+        if first >= last:
+            return np.zeros((0, 2))
+        starts = self.starts[first:last]
+        ends = self.ends[first:last]
+        max_ends = np.maximum.accumulate(ends)
+        breaks = np.flatnonzero(starts[1:] > max_ends[:-1] + gap) + 1
+        index = np.concatenate(([0], breaks))
+        starts = starts[index]
+        return np.column_stack((starts, np.maximum.reduceat(ends, index) - starts))
+
+
 class BasicChart(mpl_Axes, evt.EventSource):
 
     name = 'basic_chart'
@@ -211,6 +259,9 @@ class BasicChart(mpl_Axes, evt.EventSource):
         self.cross_bg = None
         self.rect_bg = None
 
+        # rows drawn by broken_barh_lod: (intervals, collection, yrange)
+        self.lod_rows = []
+
         # coonect standard features, for Kaira graphs
 
         # updade background after change window
@@ -236,6 +287,42 @@ class BasicChart(mpl_Axes, evt.EventSource):
         fig.canvas.mpl_connect("key_release_event", self._switch_ylock_action)
         # register event which stop is drawing cross if it's cursorn over legend
         fig.canvas.mpl_connect("motion_notify_event", self._mouse_over_legend)
+        # recompute level of detail after zooming, moving and resizing
+        self.callbacks.connect("xlim_changed", self._update_level_of_detail)
+        fig.canvas.mpl_connect("resize_event", self._update_level_of_detail)
+
+    def broken_barh_lod(self, xranges, yrange, **kwargs):
+        ''' The same as broken_barh, but only intervals visible in
+        the current view are drawn and intervals closer than one pixel
+        are merged. Bars are recomputed whenever the view changes. '''
+        intervals = IntervalsLevelOfDetail(xranges)
+        xmin, xmax = intervals.get_range()
+        collection = self.broken_barh(
+            intervals.get_intervals(xmin, xmax, self._get_pixel_width(xmin, xmax)),
+            yrange, **kwargs)
+        self.lod_rows.append((intervals, collection, yrange))
+        return collection
+
+    def _get_pixel_width(self, xmin, xmax):
+        return abs(xmax - xmin) / max(self.bbox.width, 1.0)
+
+    def _update_level_of_detail(self, *args):
+        if not self.lod_rows:
+            return
+        xmin, xmax = self.get_xlim()
+        if xmin > xmax:
+            xmin, xmax = xmax, xmin
+        gap = self._get_pixel_width(xmin, xmax)
+        for intervals, collection, (y, ywidth) in self.lod_rows:
+            bars = intervals.get_intervals(xmin, xmax, gap)
+            x1 = bars[:, 0]
+            x2 = x1 + bars[:, 1]
+            verts = np.empty((len(bars), 4, 2))
+            verts[:, 0, 0] = verts[:, 1, 0] = x1
+            verts[:, 2, 0] = verts[:, 3, 0] = x2
+            verts[:, 0, 1] = verts[:, 3, 1] = y
+            verts[:, 1, 1] = verts[:, 2, 1] = y + ywidth
+            collection.set_verts(verts)
 
     def __convert_axes_to_data(self, x, y):
         xdisplay, ydisplay = self.transAxes.transform((x,y))
@@ -785,7 +872,7 @@ def _register_histogram_pick_legend(ax, legend, lines_config):
 
     lined = dict()
 
-    for legline, line_config in zip(legend.get_lines(), lines_config):
+    for legline, line_config in zip(legend.get_patches(), lines_config):
         legline.set_picker(5)
         lined[legline] = line_config
         line_config.set_mpl_legline(legline)
@@ -796,7 +883,9 @@ def _register_histogram_pick_legend(ax, legend, lines_config):
         line_config = lined[legline]
         dlc.change_lines_config(line_config, change_legline_fn)
         if line_config.get_mpl_line2() == 'create_new':
-            bar = ax.bar(line_config.get_x_values(), line_config.get_y_values(),
+            # x values are edges of bins, y values are cached counts
+            edges = line_config.get_x_values()
+            bar = ax.bar(edges[:-1], line_config.get_y_values(), np.diff(edges),
                     color=line_config.get_color(), alpha=0.6)
             line_config.set_mpl_line2(bar)
             line_config.set_mpl_line2_visible(True)
@@ -804,9 +893,12 @@ def _register_histogram_pick_legend(ax, legend, lines_config):
 
     ax.figure.canvas.mpl_connect('pick_event', on_pick)
 
-def histogram(names, values, title="", xlabel="", ylabel=""):
+def bins_histogram(names, edges, counts, title="", xlabel="", ylabel=""):
+    ''' Histogram drawn from precomputed counts, all series share the bin
+    edges 'edges' and counts[i] contains counts of the i-th series.
+    Drawing and toggling series through the legend costs O(bins). '''
 
-    if not names or not values:
+    if not names or not counts:
         return _empty_chart(title, xlabel, ylabel)
 
     figure = mpl_Figure()
@@ -815,15 +907,23 @@ def histogram(names, values, title="", xlabel="", ylabel=""):
 
     ax = figure.add_subplot(111, projection=BasicChart.name)
 
-    colors = [cm.hsv(float(i)/len(values)) for i in xrange(len(values))]
+    colors = [cm.hsv(float(i)/len(counts)) for i in xrange(len(counts))]
+    # every bin is represented by its left edge weighted by its count
     n, bins, patches = ax.hist(
-        values, 10, normed=0, histtype="bar", label=names, color=colors)
+        [edges[:-1]] * len(counts), edges,
+        weights=[np.asarray(c, dtype=float) for c in counts],
+        normed=0, histtype="bar", label=names, color=colors)
+    if len(counts) == 1:
+        patches = [patches]
 
     for label in ax.xaxis.get_ticklabels():
         label.set_rotation(-35)
         label.set_horizontalalignment('left')
 
     ax.plegend = ax.legend(loc="upper right", fancybox=True, shadow=True)
+    lines_config = [LineConfig(p, edges, c, color)
+                    for p, c, color in zip(patches, counts, colors)]
+    _register_histogram_pick_legend(ax, ax.plegend, lines_config)
 
     ax.xaxis.set_major_formatter(mpl_FuncFormatter(
         lambda time, pos: utils.time_to_string(time)[:-7]))
@@ -857,14 +957,14 @@ def utilization_chart(names,
     if idles is not None:
         for i, lidle in enumerate(idles):
             y = ((i+1) * ywidth) + (i+1)
-            ax.broken_barh(
+            ax.broken_barh_lod(
                 lidle, (y, ywidth),
                 edgecolor='face', facecolor='#EAA769')
 
     for i, ldata in enumerate(values):
         y = (ywidth+1) * (i+ 1)
         yticks.append(y + ywidth/2)
-        ax.broken_barh(
+        ax.broken_barh_lod(
             ldata, (y, ywidth),
             edgecolor='face', facecolor='green')
 
@@ -37,6 +37,7 @@ sys.path.append(paths.PTP_DIR)
 import loader
 import os
 import tracelog
+import exportri
 
 
 def export(filename, directory, trace, lib):
@@ -56,23 +57,43 @@ def export(filename, directory, trace, lib):
         build_config.directory = os.path.dirname(filename)
     p.export(build_config)
 
-def check_tracelog(filename):
-    t = tracelog.TraceLog(filename)
+def check_tracelog(filename, decode_processes):
+    t = tracelog.TraceLog(filename, decode_processes=decode_processes)
     print t.get_runinstances_count()
 
+def export_tracelog(filename, output):
+    """ Export all data from the tracelog into a CSV file or into a binary
+    table (see exportri.BinaryTableWriter), rows are streamed into the file """
+    t = tracelog.TraceLog(filename, index=False)
+    if output.endswith(".csv"):
+        writer_class = exportri.CsvTableWriter
+    else:
+        writer_class = exportri.BinaryTableWriter
+    ri = exportri.ExportRunInstance(
+        t,
+        *exportri.get_default_export_settings(t),
+        create_writer=lambda columns: writer_class(output, columns))
+    t.execute_streamed_events(ri)
+    ri.close()
+
 def main():
     parser = argparse.ArgumentParser(description='Kaira gui command line controller')
     parser.add_argument('--export', metavar='filename', type=str)
     parser.add_argument('--output', metavar='directory', type=str)
     parser.add_argument("--trace", action='store_true')
     parser.add_argument('--tracelog', metavar='filename', type=str)
+    parser.add_argument('--decode-processes', metavar='count', type=int, default=1)
+    parser.add_argument('--export-table', metavar='filename', type=str)
     parser.add_argument("--lib", action='store_true')
     args = parser.parse_args()
     if args.export:
         export(os.path.abspath(args.export), args.output, args.trace, args.lib)
         return
+    if args.tracelog and args.export_table:
+        export_tracelog(args.tracelog, args.export_table)
+        return
     if args.tracelog:
-        check_tracelog(args.tracelog)
+        check_tracelog(args.tracelog, args.decode_processes)
 
 if __name__ == "__main__":
     main()
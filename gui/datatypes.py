@@ -27,6 +27,7 @@ import runview
 import numpy as np
 from tracelog import TraceLog
 from table import Table
+from exportri import load_binary_table
 
 """Supported types for extensions."""
 
@@ -279,6 +280,10 @@ def store_csv(table, filename, app, settings):
 
 t_table.register_store_function("csv", store_csv)
 
+def load_ktb(filename, app, settings):
+    return (app._catch_io_error(lambda: load_binary_table(filename)), settings)
+t_table.register_load_function("ktb", load_ktb)
+
 def csv_view(table, app):
     colnames = [(title, str) for title in table.header]
 
@@ -19,15 +19,29 @@
 #
 
 import settingswindow
+import csv
+import os
+import numpy as np
 from runinstance import RunInstance
-from table import  Table
+from table import  Table, TableBuilder, rows_to_array
 from gtk import RESPONSE_APPLY
 
 class ExportRunInstance(RunInstance):
 
     basic_header = ["Event", "Time", "Duration", "Process", "ID"]
 
-    def __init__(self, tracelog, transitions, place_functions, columns):
+    def __init__(self,
+                 tracelog,
+                 transitions,
+                 place_functions,
+                 columns,
+                 create_writer=None):
+        """ Arguments:
+        create_writer -- a function that gets a list of columns (pairs of name
+        and type) and returns a writer (see CsvTableWriter); rows are then
+        streamed into the writer instead of the table and tokens in places
+        are not stored
+        """
         RunInstance.__init__(self,
                              tracelog.project,
                              tracelog.process_count)
@@ -51,13 +65,17 @@ class ExportRunInstance(RunInstance):
         self.column_value = bool(place_functions)
         self.column_tokens = bool(self.traced_places)
 
-        self.table = self._create_table()
+        self.streaming = create_writer is not None
+        if self.streaming:
+            self.output = create_writer(self._create_columns())
+        else:
+            self.output = TableBuilder(self._create_columns())
 
         self.idles = [None] * self.process_count
         self.tokens_counters = [[0] * len(self.traced_places)
                                 for p in range(tracelog.process_count)]
 
-    def _create_table(self):
+    def _create_columns(self):
         header = []
         types = [];
         if self.column_event:
@@ -93,7 +111,7 @@ class ExportRunInstance(RunInstance):
                 header.append(col_name)
                 types.append('<i4')
 
-        return Table(zip(header, types), 100)
+        return zip(header, types)
 
     def add_row(self, event, time, duration, process, id, (col_name, value)):
         row = []
@@ -118,11 +136,15 @@ class ExportRunInstance(RunInstance):
                 self.tokens_counters[process][couter_index] += value
             row += self.tokens_counters[process]
 
-        self.table.add_row(row)
+        self.output.add_row(row)
 
     def get_table(self):
-        self.table.trim()
-        return self.table
+        return self.output.build()
+
+    def close(self):
+        """ Flush remaining rows into the writer """
+        if self.streaming:
+            self.output.close()
 
     # Collected events
     def transition_finished(self, process_id, time):
@@ -165,12 +187,14 @@ class ExportRunInstance(RunInstance):
                          place_id,
                          (place_value_name(place, f_index),
                           token_value[f_index]))
-        RunInstance.add_token(
-            self, place_id, token_pointer, token_value, send_time)
+        if not self.streaming:
+            RunInstance.add_token(
+                self, place_id, token_pointer, token_value, send_time)
 
     def remove_token(self, place_id, token_pointer):
         self._change_place_counter(place_id, -1)
-        RunInstance.remove_token(self, place_id, token_pointer)
+        if not self.streaming:
+            RunInstance.remove_token(self, place_id, token_pointer)
 
     def _change_place_counter(self, place_id, change):
         if place_id in self.traced_places:
@@ -183,6 +207,109 @@ class ExportRunInstance(RunInstance):
                          (place_counter_name(place), change))
 
 
+class CsvTableWriter:
+    """ Writes rows into a CSV file by chunks of a fixed size. The format is
+    the same as the format of tables stored by the GUI. """
+
+    def __init__(self,
+                 filename,
+                 columns,
+                 chunk_size=10000,
+                 delimiter=",",
+                 quotechar="\"",
+                 header=True,
+                 types=True):
+        self.file = open(filename, "w")
+        self.writer = csv.writer(
+            self.file, delimiter=delimiter, quotechar=quotechar)
+        if types:
+            self.writer.writerow([ t for name, t in columns ])
+        if header:
+            self.writer.writerow([ name for name, t in columns ])
+        self.chunk_size = chunk_size
+        self.rows = []
+
+    def add_row(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        self.writer.writerows(self.rows)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class BinaryTableWriter:
+    """ Writes rows into a binary file by chunks of a fixed size.
+
+    The file starts with an empty NumPy array that describes columns. Then
+    each chunk is stored by columns; each column as two NumPy arrays: values
+    and mask of missing values. The file can be read by load_binary_table.
+    """
+
+    def __init__(self, filename, columns, chunk_size=10000):
+        self.file = open(filename, "wb")
+        self.columns = columns
+        self.chunk_size = chunk_size
+        np.save(self.file, np.zeros(0, dtype=columns))
+        self.rows = []
+
+    def add_row(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        data = rows_to_array(self.rows, self.columns)
+        mask = np.ma.getmaskarray(data)
+        for name, t in self.columns:
+            np.save(self.file, data.data[name])
+            np.save(self.file, mask[name])
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+def load_binary_table(filename):
+    """ Load a table stored by BinaryTableWriter """
+    with open(filename, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        dtype = np.load(f).dtype
+        mask_dtype = np.ma.make_mask_descr(dtype)
+        chunks = []
+        while f.tell() < size:
+            columns = [ (name, np.load(f), np.load(f)) for name in dtype.names ]
+            data = np.zeros(len(columns[0][1]), dtype=dtype)
+            mask = np.zeros(len(columns[0][1]), dtype=mask_dtype)
+            for name, values, missing in columns:
+                data[name] = values
+                mask[name] = missing
+            chunks.append(np.ma.array(data, mask=mask))
+    if chunks:
+        data = np.ma.concatenate(chunks)
+    else:
+        data = np.ma.zeros(0, dtype=dtype)
+    return Table.create_from_data(data)
+
+def get_default_export_settings(tracelog):
+    """ Return arguments for ExportRunInstance that export all traced
+    transitions, all place functions and all columns """
+    net = tracelog.project.nets[0]
+    return ([ t for t in net.transitions() if t.trace_fire ],
+            [ (p, i) for p in net.places()
+                     for i, tracing in enumerate(p.trace_tokens_functions)
+                     if tracing.return_numpy_type != 'O' ],
+            ExportRunInstance.basic_header +
+            [ place_counter_name(p) for p in net.places() if p.trace_tokens ])
+
 def place_value_name(place, f_index):
     return "V: ({0}/{1})".format(place.get_name_or_id(),
                                  place.trace_tokens_functions[f_index].name)
@@ -19,6 +19,7 @@
 
 import settingswindow
 import utils
+import operator
 from functools import partial
 from extensions import Parameter, Source, Operation, add_operation
 from datatypes import t_table
@@ -75,10 +76,10 @@ class Filter(Operation):
                                                      table.types[col_idx]))
                 s_widget.add_radiobuttons("cmp_fn{0}".format(col_idx),
                                           "Compare",
-                                          [("Equal", lambda x, y: x == y),
-                                           ("Not equal", lambda x, y: x != y),
-                                           ("Less than", lambda x, y: x < y),
-                                           ("Greater than", lambda x, y: x > y)],
+                                          [("Equal", operator.eq),
+                                           ("Not equal", operator.ne),
+                                           ("Less than", operator.lt),
+                                           ("Greater than", operator.gt)],
                                           ncols=2)
             return s_widget
 
@@ -98,6 +99,10 @@ class Filter(Operation):
             value = assistant.get_setting("filter_value{0}".format(col_idx))
             value = utils.convert_to_type(table.types[col_idx], value)
             filters.append((table.header[col_idx], cmp_function, value))
+            # a column filtered again is indexed, the index is cached
+            # in the table and next filters reuse it
+            if table.header[col_idx] in table.filtered_columns:
+                table.create_index(col_idx)
 
         filtered = table.select(selected_columns, filters)
         t = Table.create_from_data(filtered)
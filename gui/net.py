@@ -36,6 +36,7 @@ class Net:
         self.project = project
         self.name = name
         self.items = []
+        self.items_by_id = {}
         self.change_callback = lambda n: None
         self.change_item_callback = None
         self.undo_manager = undo.UndoManager()
@@ -59,6 +60,7 @@ class Net:
         if item.id is None:
             item.id = self.new_id()
         self.items.append(item)
+        self.items_by_id[item.id] = item
         self.changed()
 
     def set_name(self, name):
@@ -109,10 +111,7 @@ class Net:
         return load_net(xml, self.project, NewIdLoader(self.project))
 
     def get_item(self, id):
-        for i in self.items:
-            if i.get_id() == id:
-                return i
-        return None
+        return self.items_by_id.get(id)
 
     def places(self):
         return [ item for item in self.items if item.is_place() ]
@@ -146,16 +145,15 @@ class Net:
         return e
 
     def item_by_id(self, id):
-        for item in self.items:
-            if item.id == id:
-                return item
-        return None
+        return self.items_by_id.get(id)
 
     def contains(self, item):
-        return item in self.items
+        return self.items_by_id.get(item.id) is item
 
     def delete_item(self, item):
         self.items.remove(item)
+        if self.items_by_id.get(item.id) is item:
+            del self.items_by_id[item.id]
         self.changed()
 
     def edges_from(self, item, postprocess=False):
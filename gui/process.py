@@ -19,10 +19,114 @@
 
 import gtk
 import socket
+import struct
+import xml.etree.ElementTree as xml
 from subprocess import Popen, PIPE, STDOUT
 from threading import Thread, Lock
 
 
+# Binary protocol, it has to be in sync with libs/cailie/listener.h
+# and libs/cailie/output.cpp
+
+BINARY_COMMANDS = {
+    "QUIT": 1,
+    "DETACH": 2,
+    "REPORTS": 3,
+    "DELTA-REPORTS": 4,
+    "FIRE": 5,
+    "FINISH": 6,
+    "RECEIVE": 7,
+    "BATCH": 8,
+}
+
+BINARY_NAMES = [
+    "report", "delta", "process", "place", "token", "value", "source",
+    "id", "enabled", "enabled-list", "activation", "inactive",
+    "process-id", "binding", "transition-id", "blocked", "packet",
+    "origin-id", "target-id", "size", "edge-id", "queue", "net-id",
+    "processes", "quit", "full" ]
+
+OUTPUT_CHILD = 1
+OUTPUT_BACK = 2
+OUTPUT_STRING = 3
+OUTPUT_INT = 4
+OUTPUT_TEXT = 5
+
+FRAME_STATUS = "S"
+FRAME_REPORT = "R"
+
+unpack_int = struct.Struct(">i").unpack_from
+
+def encode_command(command):
+    """ Encodes a text command into a frame of the binary protocol,
+        BATCH is followed by its commands on the next lines """
+    data = "".join(encode_command_line(line) for line in command.split("\n"))
+    return struct.pack(">I", len(data)) + data
+
+def encode_command_line(line):
+    words = line.split()
+    params = [ int(word) for word in words[1:] ]
+    return struct.pack(">B" + "i" * len(params), BINARY_COMMANDS[words[0]], *params)
+
+def read_frame(stream):
+    """ Reads a frame of the binary protocol, returns a status line
+        (with the trailing new line) or a decoded report. An empty string
+        is returned at the end of the stream. """
+    header = stream.read(4)
+    if len(header) < 4:
+        return ""
+    data = stream.read(struct.unpack(">I", header)[0])
+    if data[0] == FRAME_STATUS:
+        return data[1:] + "\n"
+    return decode_element(data, 1)
+
+def decode_element(data, pos=0):
+    """ Decodes an element written by the binary form of ca::Output
+        into xml.etree.ElementTree.Element. Integer attributes are decoded
+        as integers. """
+    def read_string(pos):
+        size = ord(data[pos])
+        pos += 1
+        if size == 255:
+            size = unpack_int(data, pos)[0]
+            pos += 4
+        return data[pos:pos + size], pos + size
+
+    def read_name(pos):
+        index = ord(data[pos])
+        if index:
+            return BINARY_NAMES[index - 1], pos + 1
+        return read_string(pos + 1)
+
+    stack = []
+    while True:
+        code = ord(data[pos])
+        if code == OUTPUT_CHILD:
+            name, pos = read_name(pos + 1)
+            element = xml.Element(name)
+            if stack:
+                stack[-1].append(element)
+            stack.append(element)
+        elif code == OUTPUT_BACK:
+            pos += 1
+            element = stack.pop()
+            if not stack:
+                return element
+        elif code == OUTPUT_STRING:
+            name, pos = read_name(pos + 1)
+            stack[-1].attrib[name], pos = read_string(pos)
+        elif code == OUTPUT_INT:
+            name, pos = read_name(pos + 1)
+            stack[-1].attrib[name] = unpack_int(data, pos)[0]
+            pos += 4
+        elif code == OUTPUT_TEXT:
+            text, pos = read_string(pos + 1)
+            stack[-1].text = (stack[-1].text or "") + text
+        else:
+            raise Exception("Invalid binary data")
+
+
+
 class ReadLineThread(Thread):
     def __init__(self, stream):
         Thread.__init__(self)
@@ -30,13 +134,14 @@ class ReadLineThread(Thread):
         self.lock = Lock()
         self.exit_flag = False
         self.daemon = True
+        self.read_message = self.readline
 
     def start(self):
         Thread.start(self)
 
     def run(self):
         while True:
-            line = self.stream.readline()
+            line = self.read_message()
             if line == "":
                 self.on_exit()
                 return
@@ -49,6 +154,9 @@ class ReadLineThread(Thread):
     def readline(self):
         return self.stream.readline()
 
+    def read_frame(self):
+        return read_frame(self.stream)
+
     def safe_call(self, callback, *params):
         if callback is None:
             return
@@ -167,7 +275,7 @@ class Connection:
         self.thread.start()
 
     def write(self, text):
-        self.thread.sock.send(text)
+        self.thread.sock.sendall(text)
 
 class CommandWrapper:
 
@@ -175,6 +283,7 @@ class CommandWrapper:
         self.backend = backend
         self.callbacks = []
         self.lock = Lock()
+        self.binary = False
 
     def start(self, *params):
         self.backend.line_callback = self._line_callback
@@ -187,7 +296,27 @@ class CommandWrapper:
                 self.callbacks.append((callback, lines))
 
         if command is not None:
-            self.backend.write(command + "\n")
+            if self.binary:
+                self.backend.write(encode_command(command))
+            else:
+                self.backend.write(command + "\n")
+
+    def switch_to_binary_protocol(self, callback=None):
+        """ Switches to the binary protocol, the backend has to support it.
+            Replies are then status lines or already decoded reports.
+            If the backend refuses it, the text protocol is kept. Callback
+            gets True if the protocol was switched, no other commands should
+            be sent before it is called. """
+        def reply(line):
+            if line == "Ok\n":
+                thread = self.backend.thread
+                thread.read_message = thread.read_frame
+            else:
+                self.binary = False
+            if callback:
+                callback(self.binary)
+        self.run_command("BINARY", reply)
+        self.binary = True
 
     def run_command_expect_ok(self,
                               command,
@@ -215,7 +344,7 @@ class CommandWrapper:
         return self.backend.readline()
 
     def _line_callback(self, line, stream):
-        if line.startswith("ERROR:"):
+        if isinstance(line, str) and line.startswith("ERROR:"):
             print line
             return False
 
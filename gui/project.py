@@ -43,6 +43,7 @@ class Project(EventSource):
         self.id_counter = 100
         self.set_filename(file_name)
         self.nets = []
+        self.nets_by_id = {}
         self.parameters = []
         self.sequences = []
         self.simconfig = SimConfig()
@@ -131,6 +132,7 @@ class Project(EventSource):
 
     def add_net(self, net):
         self.nets.append(net)
+        self.nets_by_id[net.id] = net
         net.set_change_callback(self._net_changed)
         self.emit_event("netlist_changed")
 
@@ -143,12 +145,12 @@ class Project(EventSource):
         self.emit_event("sequences_changed")
 
     def find_net(self, id):
-        for net in self.nets:
-            if net.id == id:
-                return net
+        return self.nets_by_id.get(id)
 
     def remove_net(self, net):
         self.nets.remove(net)
+        if self.nets_by_id.get(net.id) is net:
+            del self.nets_by_id[net.id]
         if self.build_net == net:
             self.build_net = self.nets[0]
         self.emit_event("netlist_changed")
@@ -192,6 +194,7 @@ class Project(EventSource):
         self.changed("error_messages")
 
     def get_item(self, id):
+        # each net has its own id -> item dictionary
         for net in self.nets:
             item = net.get_item(id)
             if item is not None:
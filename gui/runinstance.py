@@ -19,6 +19,7 @@
 
 import utils
 from copy import copy
+from collections import deque
 
 
 class Packet:
@@ -29,6 +30,63 @@ class Packet:
         self.edge_id = edge_id
 
 
+class PacketQueue(object):
+    """ A queue of packets between two processes. Packets of each edge are
+    also kept in a separate queue together with a total size, so
+    information about packets of an edge is obtained without a scan. """
+
+    def __init__(self):
+        self.packets = deque()
+        self.edges = {} # edge_id -> deque of packets
+        self.sizes = {} # edge_id -> total size of packets
+
+    def __len__(self):
+        return len(self.packets)
+
+    def __iter__(self):
+        return iter(self.packets)
+
+    def __copy__(self):
+        queue = PacketQueue()
+        queue.packets = copy(self.packets)
+        queue.edges = dict((edge_id, copy(packets))
+                           for edge_id, packets in self.edges.iteritems())
+        queue.sizes = self.sizes.copy()
+        return queue
+
+    def first(self):
+        return self.packets[0]
+
+    def append(self, packet):
+        self.packets.append(packet)
+        packets = self.edges.get(packet.edge_id)
+        if packets is None:
+            self.edges[packet.edge_id] = deque((packet,))
+            self.sizes[packet.edge_id] = packet.size
+        else:
+            packets.append(packet)
+            self.sizes[packet.edge_id] += packet.size
+
+    def popleft(self):
+        packet = self.packets.popleft()
+        packets = self.edges[packet.edge_id]
+        packets.popleft()
+        if packets:
+            self.sizes[packet.edge_id] -= packet.size
+        else:
+            del self.edges[packet.edge_id]
+            del self.sizes[packet.edge_id]
+        return packet
+
+    def get_edge_info(self, edge_id):
+        """ Returns (first packet, number of packets, total size) of the
+        edge or None if there is no packet of the edge """
+        packets = self.edges.get(edge_id)
+        if packets is None:
+            return None
+        return packets[0], len(packets), self.sizes[edge_id]
+
+
 class RunInstance:
 
     def __init__(self, project, process_count):
@@ -41,9 +99,15 @@ class RunInstance:
         self.last_event_activity = None
         self.last_event_instance = None
         self.last_event_time = None
-        self.packets = [ [] for i in xrange(self.process_count * self.process_count)]
-        self.debt_receives = [[] for i in xrange(self.process_count * self.process_count)]
+        # Non-empty queues of packets and debt receives; the key is
+        # target_id * process_count + origin_id
+        self.packets = {}
+        self.debt_receives = {}
         self.missed_receives = 0
+        # Activities and queues that are not shared with a copy
+        self.owned_activities = set()
+        self.owned_packets = set()
+        self.owned_debts = set()
 
     def add_token(self, place_id, token_pointer, token_value, send_time=None):
         self.last_event_instance.add_token(place_id, token_pointer, token_value, send_time)
@@ -60,6 +124,7 @@ class RunInstance:
 
     def set_activity(self, process_id, activity):
         self.activites[process_id] = activity
+        self.owned_activities.add(process_id)
         self.last_event_activity = activity
 
     def pre_event(self):
@@ -91,7 +156,7 @@ class RunInstance:
         if self.last_event_activity is not None:
             # None can occur when we are logging
             # "quit" but not transition fire
-            self.last_event_activity.quit = True
+            self._get_own_activity(process_id).quit = True
         self.last_event_instance = self.net_instances[process_id]
 
     def event_idle(self, process_id, time):
@@ -102,13 +167,14 @@ class RunInstance:
         self.last_event_instance = self.net_instances[process_id]
 
     def event_send(self, process_id, time, target_id, size, edge_id):
-        debts = self.debt_receives[target_id * self.process_count + process_id]
-        if debts:
-            del debts[0]
+        index = target_id * self.process_count + process_id
+        if index in self.debt_receives:
+            self._pop_first(self.debt_receives, self.owned_debts, index)
             self.missed_receives += 1
         else:
             packet = Packet(time, size, edge_id)
-            self.packets[target_id * self.process_count + process_id].append(packet)
+            self._get_own_queue(
+                self.packets, self.owned_packets, index, PacketQueue).append(packet)
 
     def event_end(self, process_id, time):
         pass
@@ -117,18 +183,18 @@ class RunInstance:
         self.last_event = "receive"
         self.last_event_process = process_id
         self.last_event_time = time
-        packets = self.packets[process_id * self.process_count + origin_id]
-        if packets:
-            packet = packets[0]
-            del packets[0]
+        index = process_id * self.process_count + origin_id
+        if index in self.packets:
+            packet = self._pop_first(self.packets, self.owned_packets, index)
             self.last_event_instance = self.net_instances[process_id]
             self.set_activity(process_id,
                               Receive(time, process_id, origin_id))
             return time - packet.time
         else:
             # receive on debt
-            idx = process_id * self.process_count + origin_id
-            self.debt_receives[idx].append(Receive(time, process_id, origin_id))
+            self._get_own_queue(
+                self.debt_receives, self.owned_debts, index, deque).append(
+                    Receive(time, process_id, origin_id))
 
     def transition_fired(self, process_id, time, transition_id, values):
         self.last_event = "fire"
@@ -140,9 +206,10 @@ class RunInstance:
             TransitionFire(time, process_id, transition, values)
         if transition.has_code() or transition.collective:
             self.activites[process_id] = self.last_event_activity
+            self.owned_activities.add(process_id)
 
     def transition_blocked(self, process_id):
-        self.activites[process_id].blocked = True
+        self._get_own_activity(process_id).blocked = True
 
     def transition_finished(self, process_id, time):
         self.last_event = "finish"
@@ -155,13 +222,89 @@ class RunInstance:
     def copy(self):
         runinstance = RunInstance(self.project,
                                   self.process_count)
+        runinstance.net = self.net
         for i in self.net_instances:
             n = self.net_instances[i].copy()
             runinstance.net_instances[i] = n
 
+        # Activities and queues are shared with the copy; an instance copies
+        # an activity or a queue when it changes it for the first time
         runinstance.activites = self.activites[:]
+        runinstance.packets = self.packets.copy()
+        runinstance.debt_receives = self.debt_receives.copy()
+        runinstance.missed_receives = self.missed_receives
+        self.owned_activities = set()
+        self.owned_packets = set()
+        self.owned_debts = set()
         return runinstance
 
+    def share_unchanged(self, runinstance):
+        """ Replace parts that are equal to parts of the given runinstance
+        by references to them. It is used for snapshots created
+        independently (e.g. reports of the simulation). """
+        if self.process_count != runinstance.process_count:
+            return
+        for i, net_instance in self.net_instances.items():
+            other = runinstance.net_instances.get(i)
+            if other is not None:
+                net_instance.share_unchanged(other)
+
+        for i, activity in enumerate(self.activites):
+            other = runinstance.activites[i]
+            if activity is not other and activity is not None \
+                    and other is not None \
+                    and activity.__class__ is other.__class__ \
+                    and activity.__dict__ == other.__dict__:
+                self.activites[i] = other
+                self.owned_activities.discard(i)
+                runinstance.owned_activities.discard(i)
+
+        for queues, owned, other_queues, other_owned in (
+                (self.packets, self.owned_packets,
+                 runinstance.packets, runinstance.owned_packets),
+                (self.debt_receives, self.owned_debts,
+                 runinstance.debt_receives, runinstance.owned_debts)):
+            for index, queue in queues.items():
+                other = other_queues.get(index)
+                if other is not None and other is not queue \
+                        and len(other) == len(queue) \
+                        and all(a.__dict__ == b.__dict__
+                                for a, b in zip(queue, other)):
+                    queues[index] = other
+                    owned.discard(index)
+                    other_owned.discard(index)
+
+    def _get_own_activity(self, process_id):
+        activity = self.activites[process_id]
+        if process_id not in self.owned_activities:
+            new_activity = copy(activity)
+            if self.last_event_activity is activity:
+                self.last_event_activity = new_activity
+            activity = new_activity
+            self.activites[process_id] = activity
+            self.owned_activities.add(process_id)
+        return activity
+
+    def _get_own_queue(self, queues, owned, index, create=None):
+        queue = queues.get(index)
+        if queue is None:
+            queue = create()
+        elif index in owned:
+            return queue
+        else:
+            queue = copy(queue)
+        queues[index] = queue
+        owned.add(index)
+        return queue
+
+    def _pop_first(self, queues, owned, index):
+        queue = self._get_own_queue(queues, owned, index)
+        item = queue.popleft()
+        if not queue:
+            del queues[index]
+            owned.discard(index)
+        return item
+
     def get_perspectives(self):
         perspectives = [ Perspective("All", self, self.net_instances) ]
         v = self.net_instances.keys()
@@ -175,18 +318,16 @@ class RunInstance:
     def get_packets_info(self, edge_id, process_id):
         results = []
         for i in xrange(self.process_count):
-            packets = self.packets[process_id * self.process_count + i]
-            ps = [ p for p in packets if p.edge_id == edge_id ]
-            if ps:
-                itr = iter(ps)
-                first = next(itr)
+            packets = self.packets.get(process_id * self.process_count + i)
+            if packets is None:
+                continue
+            info = packets.get_edge_info(edge_id)
+            if info is not None:
+                first, count, size = info
                 text = "{0} -> {1} | {2}".format(i, process_id, first.size)
-                if len(ps) > 1:
-                    size = 0
-                    for p in itr:
-                        size += p.size
-                    text += " ({0}, {1})".format(len(ps) - 1, size)
-                if packets[0].edge_id != edge_id:
+                if count > 1:
+                    text += " ({0}, {1})".format(count - 1, size - first.size)
+                if packets.first().edge_id != edge_id:
                     top = False
                     text += " *"
                 else:
@@ -194,8 +335,13 @@ class RunInstance:
                 results.append((process_id, i, top, text))
         return results
 
+    def clear_packets(self, origin_id, target_id):
+        index = target_id * self.process_count + origin_id
+        if self.packets.pop(index, None) is not None:
+            self.owned_packets.discard(index)
+
     def get_packets_count(self, origin_id, target_id):
-        return len(self.packets[target_id * self.process_count + origin_id])
+        return len(self.packets.get(target_id * self.process_count + origin_id, ()))
 
 
 class ProcessActivity:
@@ -232,6 +378,8 @@ class NetInstance:
         self.enabled_transitions = None
         self.new_tokens = {}
         self.removed_tokens = {}
+        # places whose token stores are not shared with another instance
+        self.owned_places = set()
         if tokens is None:
             self.tokens = {}
         else:
@@ -257,19 +405,19 @@ class NetInstance:
         """
         if self.new_tokens:
             for place_id in self.new_tokens:
-                lst = self.tokens.get(place_id)
-                if lst is None:
-                    lst = []
-                    self.tokens[place_id] = lst
-                lst += self.new_tokens.get(place_id)
+                store = self._get_own_tokens(place_id)
+                if store is None:
+                    store = TokenStore()
+                    self.tokens[place_id] = store
+                    self.owned_places.add(place_id)
+                store.extend(self.new_tokens.get(place_id))
             self.new_tokens = {}
 
         if self.removed_tokens:
             self.removed_tokens = {}
 
     def remove_token(self, place_id, token_pointer):
-        lst = self.tokens.get(place_id)
-        if lst is None:
+        if self.tokens.get(place_id) is None:
             return
 
         removed_lst = self.removed_tokens.get(place_id)
@@ -277,11 +425,21 @@ class NetInstance:
             removed_lst = []
             self.removed_tokens[place_id] = removed_lst
 
-        for i in xrange(len(lst)):
-            if lst[i][0] == token_pointer:
-                removed_lst.append(lst[i])
-                del lst[i]
-                return
+        token = self._get_own_tokens(place_id).remove(token_pointer)
+        if token is not None:
+            removed_lst.append(token)
+
+    def set_tokens(self, place_id, tokens):
+        """ Replace tokens of the place by the list of tokens
+        (pointer, value, send time) """
+        if tokens:
+            store = TokenStore()
+            store.extend(tokens)
+            self.tokens[place_id] = store
+            self.owned_places.add(place_id)
+        else:
+            self.tokens.pop(place_id, None)
+            self.owned_places.discard(place_id)
 
     def remove_all_tokens(self, place_id):
         self.removed_tokens[place_id] = self.tokens.get(place_id)
@@ -293,10 +451,109 @@ class NetInstance:
         self.enabled_transitions.append(transition_id)
 
     def copy(self):
-        netinstance = NetInstance(self.process_id, copy(self.tokens))
+        # Token stores are shared by both instances, a store is copied when
+        # one of the instances changes it for the first time
+        self.owned_places = set()
+        netinstance = NetInstance(self.process_id, dict(self.tokens))
         netinstance.enabled_transitions = copy(self.enabled_transitions)
+        # Tokens of the last event are moved into stores by the next pre_event,
+        # so they are a part of the state of the copy
+        netinstance.new_tokens = dict(
+            (place_id, lst[:]) for place_id, lst in self.new_tokens.items())
+        netinstance.removed_tokens = dict(
+            (place_id, lst[:] if isinstance(lst, list) else lst)
+            for place_id, lst in self.removed_tokens.items())
         return netinstance
 
+    def share_unchanged(self, netinstance):
+        for place_id, store in self.tokens.items():
+            other = netinstance.tokens.get(place_id)
+            if store is not None and other is not None and store is not other \
+                    and len(store) == len(other) and list(store) == list(other):
+                self.tokens[place_id] = other
+                self.owned_places.discard(place_id)
+                netinstance.owned_places.discard(place_id)
+
+    def _get_own_tokens(self, place_id):
+        store = self.tokens.get(place_id)
+        if store is not None and place_id not in self.owned_places:
+            store = store.copy()
+            self.tokens[place_id] = store
+            self.owned_places.add(place_id)
+        return store
+
+
+class TokenStore(object):
+    """ Tokens (pointer, value, send time) of a place in the order of their
+    insertion. A token is found by its pointer in O(1). Removed tokens leave
+    holes in the list; the list is compacted when holes prevail. """
+
+    def __init__(self):
+        self.tokens = []
+        self.positions = {} # pointer -> position
+        self.duplicates = {} # pointer -> positions of tokens after the first
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for token in self.tokens:
+            if token is not None:
+                yield token
+
+    def append(self, token):
+        pointer = token[0]
+        if pointer in self.positions:
+            self.duplicates.setdefault(pointer, []).append(len(self.tokens))
+        else:
+            self.positions[pointer] = len(self.tokens)
+        self.tokens.append(token)
+        self.size += 1
+
+    def extend(self, tokens):
+        for token in tokens:
+            self.append(token)
+
+    def remove(self, pointer):
+        """ Remove the first inserted token with the pointer and return it,
+        None is returned if there is no such token. """
+        position = self.positions.get(pointer)
+        if position is None:
+            return None
+        duplicates = self.duplicates.get(pointer)
+        if duplicates:
+            self.positions[pointer] = duplicates.pop(0)
+            if not duplicates:
+                del self.duplicates[pointer]
+        else:
+            del self.positions[pointer]
+
+        token = self.tokens[position]
+        self.tokens[position] = None
+        self.size -= 1
+        if self.size * 2 < len(self.tokens):
+            self._compact()
+        return token
+
+    def copy(self):
+        store = TokenStore()
+        store.tokens = self.tokens[:]
+        store.positions = self.positions.copy()
+        store.duplicates = dict((pointer, positions[:])
+                                for pointer, positions
+                                in self.duplicates.iteritems())
+        store.size = self.size
+        return store
+
+    def _compact(self):
+        tokens = [ token for token in self.tokens if token is not None ]
+        self.tokens = []
+        self.positions = {}
+        self.duplicates = {}
+        self.size = 0
+        self.extend(tokens)
+
 
 class Perspective(utils.EqMixin):
 
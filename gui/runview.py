@@ -20,6 +20,9 @@
 
 
 import gtk
+import operator
+import numpy as np
+from threading import Thread
 import charts
 import utils
 import netview
@@ -40,25 +43,43 @@ class RunView(gtk.VBox):
             netview.NetViewCanvasConfig(self.netinstance_view))
         self.netinstance_view.set_runinstance(tracelog.first_runinstance)
 
-        table = tracelog.data
-
         net = tracelog.project.nets[0]
         processes = range(tracelog.process_count)
         transitions = [ t for t in net.transitions() if t.trace_fire ]
         places = [ p for p in net.places() if p.trace_tokens ]
 
+        def chart(function, *args):
+            def compute(cancelled):
+                # the table is created by the first chart that needs it
+                table = tracelog.get_data(cancelled)
+                if table is None:
+                    raise ChartCancelled()
+                if "Event" in table.header:
+                    # all charts filter by the type of events
+                    table.create_index("Event")
+                return function(table, *args)
+            return LazyChart(compute)
+
+        # charts are created when they are shown for the first time
         self.views = [ ("Replay", self.netinstance_view) ]
-        self.views.append(process_utilization(table, processes))
-        self.views.append(transition_utilization(table, processes, transitions))
-        self.views.append(tet_per_processes_and_transitions_histogram(
-            table, processes, transitions))
-        self.views.append(tet_per_processes_histogram(table, processes))
-        self.views.append(tet_per_transitions_histogram(table, transitions))
-        self.views.append(tokens_count(table, processes, places))
+        self.views.append(("Utilization of processes",
+                           chart(process_utilization, processes)))
+        self.views.append(("Utilization of transitions",
+                           chart(transition_utilization, processes, transitions)))
+        self.views.append(("Transition execution times (TETs)",
+                           chart(tet_per_processes_and_transitions_histogram,
+                                 processes, transitions)))
+        self.views.append(("TETs (grouped by processes)",
+                           chart(tet_per_processes_histogram, processes)))
+        self.views.append(("TETs (grouped by transitions)",
+                           chart(tet_per_transitions_histogram, transitions)))
+        self.views.append(("Number of tokens",
+                           chart(tokens_count, processes, places)))
 
         self.pack_start(self._controlls(), False, False)
         for name, item in self.views:
             self.pack_start(item)
+        self.connect("destroy", lambda w: self._cancel_charts())
 
     def _controlls(self):
         self.scale = gtk.HScale(gtk.Adjustment(value=0, lower=0,
@@ -114,11 +135,17 @@ class RunView(gtk.VBox):
         for name, item in self.views:
             if name == text:
                 item.show_all()
-                if isinstance(item, charts.ChartWidget):
-                    # set focus on graph canvas
-                    item.get_figure().canvas.grab_focus()
+                if isinstance(item, LazyChart):
+                    item.start()
             else:
                 item.hide()
+                if isinstance(item, LazyChart):
+                    item.cancel()
+
+    def _cancel_charts(self):
+        for name, item in self.views:
+            if isinstance(item, LazyChart):
+                item.cancel()
 
     def save_as_svg(self, filename):
         self.netinstance_view.save_as_svg(filename)
@@ -143,6 +170,104 @@ class RunView(gtk.VBox):
             time)
         self.info_label.set_markup(text)
 
+class ChartCancelled(Exception):
+    """ Raised by a computation of a chart when it was cancelled """
+    pass
+
+
+class LazyChart(gtk.VBox):
+    """ A placeholder of a chart. Data of the chart are computed in
+    a background thread when the placeholder is shown for the first time,
+    then the chart is created and kept. If the placeholder is hidden before
+    data are computed, the computation is stopped at the next check of
+    cancellation and it is started again when the placeholder is shown.
+    Data computed before the cancellation was noticed are kept, so the chart
+    is created immediately the next time. """
+
+    def __init__(self, compute):
+        """
+        Arguments:
+        compute -- a function that gets a function returning True when the
+        computation is cancelled; it computes data of the chart and returns
+        a function creating the widget of the chart (or None if the chart
+        cannot be created), it raises ChartCancelled when it was cancelled
+        """
+        gtk.VBox.__init__(self)
+        self.compute = compute
+        self.create_chart = None
+        self.thread = None
+        self.chart = None
+        self.label = gtk.Label("Preparing the chart ...")
+        self.pack_start(self.label)
+
+    def start(self):
+        if self.chart is not None:
+            return
+        if self.thread is not None:
+            # the computation is still running
+            self.thread.cancelled = False
+        elif self.create_chart is not None:
+            self._show_chart()
+        else:
+            self.thread = ChartThread(self)
+            self.thread.start()
+
+    def cancel(self):
+        if self.thread is not None:
+            self.thread.cancelled = True
+
+    def _set_create_chart(self, create_chart):
+        cancelled = self.thread.cancelled
+        self.thread = None
+        if create_chart is None:
+            # the computation was stopped, but the chart may be shown again
+            # before the thread finished
+            if not cancelled:
+                self.start()
+            return
+        self.create_chart = create_chart
+        if not cancelled:
+            self._show_chart()
+
+    def _show_chart(self):
+        self.remove(self.label)
+        self.chart = self.create_chart()
+        self.pack_start(self.chart)
+        self.chart.show_all()
+        if isinstance(self.chart, charts.ChartWidget):
+            # set focus on graph canvas
+            self.chart.get_figure().canvas.grab_focus()
+
+
+class ChartThread(Thread):
+    """ Computes data of a lazy chart, the computation checks the flag
+    'cancelled'. The chart is created (in gtk lock) only if the thread was
+    not cancelled meanwhile. """
+
+    def __init__(self, lazy_chart):
+        Thread.__init__(self)
+        self.lazy_chart = lazy_chart
+        self.cancelled = False
+        self.daemon = True
+
+    def run(self):
+        try:
+            create_chart = self.lazy_chart.compute(lambda: self.cancelled)
+            if create_chart is None:
+                create_chart = lambda: gtk.Label("There are no data for the chart")
+        except ChartCancelled:
+            create_chart = None
+        except Exception, e:
+            message = "The chart cannot be created: {0}".format(e)
+            create_chart = lambda: gtk.Label(message)
+
+        gtk.gdk.threads_enter()
+        try:
+            self.lazy_chart._set_create_chart(create_chart)
+        finally:
+            gtk.gdk.threads_leave()
+
+
 def process_utilization(table, processes):
     required = ["Event", "Process", "Time", "Duration"]
     header = table.header
@@ -150,30 +275,25 @@ def process_utilization(table, processes):
     if not all(item in header for item in required):
         return
 
-    f_eq = lambda x, y: x == y
-
     columns = ["Time", "Duration"]
+    groups = table.group_by(["Event", "Process"])
     # collect idles
-    filters = [("Event", f_eq, 'I')]
     idles = []
     for p in processes:
-        idles.append(table.select(columns, filters + [("Process", f_eq, p)]))
+        idles.append(groups.get(('I', p), columns))
 
     # collect TETs
-    filters = [("Event", f_eq, 'T')]
     names, values = [], []
     for p in processes:
         names.append(str(p))
-        values.append(table.select(columns, filters + [("Process", f_eq, p)]))
+        values.append(groups.get(('T', p), columns))
 
     names.reverse()
     values.reverse()
     if idles is not None:
         idles.reverse()
-    return ("Utilization of processes",
-            charts.utilization_chart(
-                names, values,
-                "Utilization of processes", "Time", "Process", idles))
+    return lambda: charts.utilization_chart(
+        names, values, "Utilization of processes", "Time", "Process", idles)
 
 def transition_utilization(table, processes, transitions):
     required = ["Event", "ID", "Time", "Duration"]
@@ -182,18 +302,17 @@ def transition_utilization(table, processes, transitions):
     if not all(item in header for item in required):
         return
 
-    f_eq = lambda x, y: x == y
+    f_eq = operator.eq
     columns = ["Time", "Duration"]
     filters = [("Event", f_eq, 'T')]
     if "Process" in header:
+        groups = table.group_by(["ID", "Process"], filters)
         names, values = [], []
         for p in processes:
             pnames, pvalues = [], []
             for t in transitions:
                 pnames.append("{0} {1}".format(t.get_name_or_id(), p))
-                pvalues.append(table.select(
-                    columns,
-                    filters + [("ID", f_eq, t.id), ("Process", f_eq, p)]))
+                pvalues.append(groups.get((t.id, p), columns))
             names.append(pnames)
             values.append(pvalues)
 
@@ -205,16 +324,14 @@ def transition_utilization(table, processes, transitions):
         values = reduce(f_concate, values, [])
         names = reduce(f_concate, names, [])
     else:
+        groups = table.group_by(["ID"], filters)
         names, values = [], []
         for t in transitions:
             names.append(t.get_name_or_id())
-            values.append(table.select(
-                columns, filters + [("ID", f_eq, t.id)]))
+            values.append(groups.get(t.id, columns))
 
-    return ("Utilization of transitions",
-            charts.utilization_chart(
-                names, values,
-                "Utilization of transitions", "Time", "Transition"))
+    return lambda: charts.utilization_chart(
+        names, values, "Utilization of transitions", "Time", "Transition")
 
 def tet_per_processes_and_transitions_histogram(table, processes, transitions):
     required = ["Event", "Process", "Duration", "ID"]
@@ -223,24 +340,21 @@ def tet_per_processes_and_transitions_histogram(table, processes, transitions):
     if not all(item in header for item in required):
        return
 
-    f_eq = lambda x, y: x == y
-    columns = ["Duration"]
+    f_eq = operator.eq
     filters = [("Event", f_eq, 'T')]
+    groups = table.group_by(["ID", "Process"], filters)
+    # bins are counted once for all groups, charts are drawn from counts
+    edges, counts = groups.histogram("Duration")
+    empty = np.zeros(len(edges) - 1, dtype=int)
     names, values = [], []
     for tran in transitions:
-        f = filters + [("ID", f_eq, tran.id)]
         for p in processes:
             names.append("{0}`{1}".format(tran.get_name_or_id(), p))
-            tets = table.select(columns, f + [("Process", f_eq, p)])
-
-            if len(tets) == 0: # tets is a numpy array
-                tets = [0] # data for a histogram chart must not be empty
-            values.append(tets)
+            values.append(counts.get((tran.id, p), empty))
 
-    return ("Transition execution times (TETs)",
-            charts.histogram(
-                names, values, "Histogram of transition execution times",
-                "Duration [ms]", "Count"))
+    return lambda: charts.bins_histogram(
+        names, edges, values, "Histogram of transition execution times",
+        "Duration [ms]", "Count")
 
 def tet_per_processes_histogram(table, processes):
     required = ["Event", "Process", "Duration"]
@@ -249,22 +363,19 @@ def tet_per_processes_histogram(table, processes):
     if not all(item in header for item in required):
        return
 
-    f_eq = lambda x, y: x == y
-    columns = ["Duration"]
+    f_eq = operator.eq
     filters = [("Event", f_eq, 'T')]
+    groups = table.group_by(["Process"], filters)
+    edges, counts = groups.histogram("Duration")
+    empty = np.zeros(len(edges) - 1, dtype=int)
     names, values = [], []
     for p in processes:
         names.append("Process {0}".format(p))
-        tets = table.select(columns, filters + [("Process", f_eq, p)])
+        values.append(counts.get(p, empty))
 
-        if len(tets) == 0:
-            tets = [0]
-        values.append(tets)
-
-    return ("TETs (grouped by processes)",
-            charts.histogram(
-                names, values, "Histogram of transition execution times grouped by processes",
-                "Duration [ms]", "Count"))
+    return lambda: charts.bins_histogram(
+        names, edges, values, "Histogram of transition execution times grouped by processes",
+        "Duration [ms]", "Count")
 
 def tet_per_transitions_histogram(table, transitions):
     required = ["Event", "Duration", "ID"]
@@ -273,22 +384,19 @@ def tet_per_transitions_histogram(table, transitions):
     if not all(item in header for item in required):
        return
 
-    f_eq = lambda x, y: x == y
-    columns = ["Duration"]
+    f_eq = operator.eq
     filters = [("Event", f_eq, 'T')]
+    groups = table.group_by(["ID"], filters)
+    edges, counts = groups.histogram("Duration")
+    empty = np.zeros(len(edges) - 1, dtype=int)
     names, values = [], []
     for t in transitions:
         names.append(t.get_name_or_id())
-        tets = table.select(columns, filters + [("ID", f_eq, t.id)])
-
-        if len(tets) == 0:
-            tets = [0]
-        values.append(tets)
+        values.append(counts.get(t.id, empty))
 
-    return ("TETs (grouped by transitions)",
-            charts.histogram(
-                names, values, "Histogram of transition execution times grouped by transitions",
-                "Duration [ms]", "Count"))
+    return lambda: charts.bins_histogram(
+        names, edges, values, "Histogram of transition execution times grouped by transitions",
+        "Duration [ms]", "Count")
 
 def tokens_count(table, processes, places, collapse=True):
     required = ["Event", "Process", "Time"] + \
@@ -298,19 +406,19 @@ def tokens_count(table, processes, places, collapse=True):
     if not all(item in header for item in required):
         return
 
-    f_eq = lambda x, y: x == y
+    f_eq = operator.eq
     filters = [("Event", f_eq, 'C')]
+    groups = table.group_by(["Process"], filters)
     names, values = [], []
     for place in places:
         columns = ["Time", place_counter_name(place)]
         for p in processes:
             names.append("{0}@{1}".format(place.get_name_or_id(), p))
-            counts = table.select(columns, filters + [("Process", f_eq, p)])
+            counts = groups.get(p, columns)
             values.append((counts[columns[0]], counts[columns[1]]))
 
-    return ("Number of tokens",
-            charts.place_chart(
-                names, values, "Number of tokens in places", "Time", "Count"))
+    return lambda: charts.place_chart(
+        names, values, "Number of tokens in places", "Time", "Count")
 
 
 
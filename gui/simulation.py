@@ -40,6 +40,9 @@ class Simulation(EventSource):
     process_count = None
     quit_on_shutdown = False
     init_control_sequence = None
+    # The binary protocol is used only if it is enabled
+    # and the program supports it
+    use_binary_protocol = False
 
     def __init__(self):
         EventSource.__init__(self)
@@ -48,6 +51,10 @@ class Simulation(EventSource):
         self.runinstance = None
         self.sequence = controlseq.ControlSequence()
         self.history_instances = []
+        self.report_instance = None # a base for the next delta report
+        self.delta_reports = False
+        self.batch_commands = False
+        self.binary_protocol = False
 
     def connect(self, host, port):
         def inited():
@@ -58,7 +65,11 @@ class Simulation(EventSource):
         def connected(stream):
             self.controller = controller
             self.read_header(stream)
-            self.query_reports(inited)
+            if self.binary_protocol and self.use_binary_protocol:
+                controller.switch_to_binary_protocol(
+                    lambda binary: self.query_reports(inited))
+            else:
+                self.query_reports(inited)
         connection = process.Connection(
             host,
             port,
@@ -86,6 +97,9 @@ class Simulation(EventSource):
     def read_header(self, stream):
         header = xml.fromstring(stream.readline())
         self.process_count = utils.xml_int(header, "process-count")
+        self.delta_reports = utils.xml_bool(header, "delta-reports", False)
+        self.batch_commands = utils.xml_bool(header, "batch-commands", False)
+        self.binary_protocol = utils.xml_bool(header, "binary-protocol", False)
         lines_count = utils.xml_int(header, "description-lines")
         project_string = "\n".join((stream.readline() for i in xrange(lines_count)))
         self.project = load_project_from_xml(xml.fromstring(project_string), "")
@@ -95,41 +109,18 @@ class Simulation(EventSource):
 
     def query_reports(self, callback=None):
         def reports_callback(line):
-            root = xml.fromstring(line)
-            net_id = utils.xml_int(root, "net-id")
-            runinstance = RunInstance(self.project, self.process_count)
-            for process_id, e in enumerate(root.findall("process")):
-                runinstance.event_spawn(process_id, 0, net_id)
-                for pe in e.findall("place"):
-                    place_id = utils.xml_int(pe, "id")
-                    for te in pe.findall("token"):
-                        name = te.get("value")
-                        source = te.get("source")
-                        if source is not None:
-                            name = "{{{0}}} {1}".format(source, name)
-                        runinstance.add_token(place_id, 0, name)
-                    runinstance.clear_removed_and_new_tokens()
-
-                for tre in e.findall("enabled"):
-                    runinstance.add_enabled_transition(utils.xml_int(tre, "id"))
-
-            for e in root.findall("activation"):
-                process_id = utils.xml_int(e, "process-id")
-                transition_id = utils.xml_int(e, "transition-id")
-                runinstance.transition_fired(process_id,
-                                             0,
-                                             transition_id, [])
-                if utils.xml_bool(e, "blocked", False):
-                    runinstance.transition_blocked(process_id)
-
-            for e in root.findall("packet"):
-                origin_id = utils.xml_int(e, "origin-id")
-                target_id = utils.xml_int(e, "target-id")
-                size = utils.xml_int(e, "size")
-                edge_id = utils.xml_int(e, "edge-id")
-                runinstance.event_send(origin_id, 0, target_id, size, edge_id)
-
-            runinstance.reset_last_event_info()
+            if isinstance(line, str):
+                root = xml.fromstring(line)
+            else: # a report already decoded by the binary protocol
+                root = line
+            if root.tag == "delta":
+                runinstance = self.apply_delta_reports(root)
+                self.report_instance = runinstance
+            else:
+                runinstance = self.create_runinstance(root)
+                if self.history_instances:
+                    # share unchanged parts with the previous step
+                    runinstance.share_unchanged(self.history_instances[-1])
 
             self.runinstance = runinstance
             self.history_instances.append(runinstance)
@@ -141,7 +132,96 @@ class Simulation(EventSource):
                 callback()
             self.emit_event("changed", True)
 
-        self.controller.run_command("REPORTS", reports_callback)
+        if self.delta_reports:
+            self.controller.run_command("DELTA-REPORTS", reports_callback)
+        else:
+            self.controller.run_command("REPORTS", reports_callback)
+
+    def create_runinstance(self, root):
+        net_id = utils.xml_int(root, "net-id")
+        runinstance = RunInstance(self.project, self.process_count)
+        for process_id, e in enumerate(root.findall("process")):
+            runinstance.event_spawn(process_id, 0, net_id)
+            for pe in e.findall("place"):
+                place_id = utils.xml_int(pe, "id")
+                for te in pe.findall("token"):
+                    runinstance.add_token(place_id, 0, self._token_name(te))
+                runinstance.clear_removed_and_new_tokens()
+
+            for tre in e.findall("enabled"):
+                runinstance.add_enabled_transition(utils.xml_int(tre, "id"))
+
+        for e in root.findall("activation"):
+            self._read_activation(runinstance, e)
+
+        for e in root.findall("packet"):
+            self._read_packet(runinstance, e)
+
+        runinstance.reset_last_event_info()
+        return runinstance
+
+    def apply_delta_reports(self, root):
+        """ Creates a new runinstance from the last reported one and changes
+        reported by a delta report. A full delta contains everything. """
+        if self.report_instance is None or utils.xml_bool(root, "full"):
+            net_id = utils.xml_int(root, "net-id")
+            runinstance = RunInstance(self.project, self.process_count)
+            for process_id in xrange(self.process_count):
+                runinstance.event_spawn(process_id, 0, net_id)
+        else:
+            runinstance = self.report_instance.copy()
+
+        for e in root.findall("process"):
+            net_instance = runinstance.net_instances[utils.xml_int(e, "id")]
+            for pe in e.findall("place"):
+                net_instance.set_tokens(
+                    utils.xml_int(pe, "id"),
+                    [ (0, self._token_name(te), None)
+                      for te in pe.findall("token") ])
+            enabled = e.find("enabled-list")
+            if enabled is not None:
+                net_instance.enabled_transitions = \
+                    [ utils.xml_int(tre, "id")
+                      for tre in enabled.findall("enabled") ] or None
+
+        for e in root.findall("inactive"):
+            runinstance.set_activity(utils.xml_int(e, "process-id"), None)
+
+        for e in root.findall("activation"):
+            runinstance.set_activity(utils.xml_int(e, "process-id"), None)
+            self._read_activation(runinstance, e)
+
+        for e in root.findall("queue"):
+            runinstance.clear_packets(utils.xml_int(e, "origin-id"),
+                                      utils.xml_int(e, "target-id"))
+            for pe in e.findall("packet"):
+                self._read_packet(runinstance, pe)
+
+        runinstance.reset_last_event_info()
+        return runinstance
+
+    def _token_name(self, element):
+        name = element.get("value")
+        source = element.get("source")
+        if source is not None:
+            name = "{{{0}}} {1}".format(source, name)
+        return name
+
+    def _read_activation(self, runinstance, element):
+        process_id = utils.xml_int(element, "process-id")
+        transition_id = utils.xml_int(element, "transition-id")
+        runinstance.transition_fired(process_id,
+                                     0,
+                                     transition_id, [])
+        if utils.xml_bool(element, "blocked", False):
+            runinstance.transition_blocked(process_id)
+
+    def _read_packet(self, runinstance, element):
+        origin_id = utils.xml_int(element, "origin-id")
+        target_id = utils.xml_int(element, "target-id")
+        size = utils.xml_int(element, "size")
+        edge_id = utils.xml_int(element, "edge-id")
+        runinstance.event_send(origin_id, 0, target_id, size, edge_id)
 
     def check_ready(self):
         if self.state == "finished":
@@ -150,20 +230,105 @@ class Simulation(EventSource):
             self.emit_event("error", "Program is terminated\n")
         return self.state == "ready"
 
-    def run_sequence(self, sequence):
+    def run_sequence(self, sequence, batch_size=1000):
+        """ Executes the control sequence. If the traced process supports
+        batches, commands are sent in batches of 'batch_size' commands and
+        a report is queried only at the end (or after a failed command). """
+        if not self.batch_commands or batch_size is None:
+            self._run_sequence_stepwise(sequence)
+            return
+
+        if not self.controller or not self.check_ready():
+            return
+
+        transitions = self._get_sequence_transitions()
+        commands = [] # (command, function recording the command into self.sequence)
+
+        def get_transition(transition):
+            t = transitions.get(transition)
+            if t is None:
+                 raise SimulationException("Transition '{0}' not found".format(transition))
+            return t
+
+        def fire(process_id, transition):
+            t = get_transition(transition)
+            name = utils.sanitize_name(t.get_name_or_id())
+            commands.append(("FIRE {0} {1} 2".format(t.id, process_id),
+                             lambda: self.sequence.add_fire(process_id, name)))
+
+        def start(process_id, transition):
+            t = get_transition(transition)
+            name = utils.sanitize_name(t.get_name_or_id())
+            if t.has_code():
+                record = lambda: self.sequence.add_transition_start(process_id, name)
+            else:
+                record = lambda: self.sequence.add_fire(process_id, name)
+            commands.append(("FIRE {0} {1} 1".format(t.id, process_id), record))
+
+        def finish(process_id):
+            commands.append(("FINISH {0}".format(process_id),
+                             lambda: self.sequence.add_transition_finish(process_id)))
+
+        def receive(process_id, from_process):
+            commands.append(("RECEIVE {0} {1}".format(process_id, from_process),
+                             lambda: self.sequence.add_receive(process_id, from_process)))
+
+        for i in xrange(sequence.get_commands_size()):
+            sequence.execute_command(i, fire, start, finish, receive)
+
+        def run_batch(index):
+            if index >= len(commands):
+                self.query_reports()
+                return
+            batch = commands[index:index + batch_size]
+
+            def callback(line):
+                self.set_state_ready()
+                if line == "Ok\n":
+                    executed = len(batch)
+                elif line.startswith("Failed "):
+                    # Failed <index of command> <message>
+                    executed = int(line.split(" ", 2)[1])
+                else:
+                    self.emit_event("error",
+                        "Command 'BATCH' returns '{0}'\n".format(line.strip()))
+                    executed = 0
+                for command, record in batch[:executed]:
+                    record()
+                if executed < len(batch):
+                    self.query_reports()
+                    self.emit_event("command-failed", sequence, index + executed)
+                else:
+                    run_batch(index + executed)
+
+            self.state = "running"
+            self.controller.run_command(
+                "BATCH {0}\n{1}".format(
+                    len(batch), "\n".join(command for command, record in batch)),
+                callback)
+
+        run_batch(0)
+
+    def _get_sequence_transitions(self):
         transitions = {}
-        command = [0]
         for t in self.runinstance.net.transitions():
             transitions["#{0}".format(t.id)] = t
         for t in self.runinstance.net.transitions():
             transitions[utils.sanitize_name(t.get_name())] = t
+        return transitions
+
+    def _run_sequence_stepwise(self, sequence):
+        transitions = self._get_sequence_transitions()
+        command = [0]
 
         def next_command():
             if command[0] >= sequence.get_commands_size():
                 self.query_reports()
                 return
-            sequence.execute_command(command[0], fire, start, finish, receive)
+            # the index is moved before the execution, the reply of the command
+            # may be processed (and the next command executed) before it returns
             command[0] += 1
+            sequence.execute_command(command[0] - 1, fire, start, finish, receive)
 
         def fail_callback():
             self.emit_event("command-failed", sequence, command[0] - 1)
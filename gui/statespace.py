@@ -63,6 +63,22 @@ class StatespaceConfig(gtk.VBox):
         self.create_dot = gtk.CheckButton("Create 'statespace.dot'")
         vbox.pack_start(self.create_dot, False, False)
 
+        hbox = gtk.HBox()
+        vbox.pack_start(hbox, False, False)
+        hbox.pack_start(gtk.Label("Processes: "), False, False)
+        self.process_count = gtk.SpinButton()
+        self.process_count.set_numeric(True)
+        self.process_count.set_increments(1, 4)
+        self.process_count.set_range(1, 1024)
+        self.process_count.set_value(self.app.project.get_simconfig().process_count)
+        hbox.pack_start(self.process_count, False, False)
+
+        hbox = gtk.HBox()
+        vbox.pack_start(hbox, False, False)
+        hbox.pack_start(gtk.Label("Symmetric processes (e.g. 1-7, 9-12): "), False, False)
+        self.symmetries = gtk.Entry()
+        hbox.pack_start(self.symmetries, False, False)
+
         vbox = gtk.HBox(homogeneous=True)
         self.pack_start(vbox, False, False)
         self.start_button = gtk.Button("Build & Run analysis")
@@ -111,7 +127,9 @@ class StatespaceConfig(gtk.VBox):
                 if not self.app.open_simconfig_dialog():
                     return
 
-            parameters = [ "-r{0}".format(simconfig.process_count) ]
+            process_count = self.process_count.get_value_as_int()
+            simconfig.set_process_count(process_count)
+            parameters = [ "-r{0}".format(process_count) ]
             parameters += [ "-p{0}={1}".format(k, v)
                             for (k, v) in simconfig.parameters_values.items() ]
 
@@ -133,6 +151,16 @@ class StatespaceConfig(gtk.VBox):
             if not self.por.get_active():
                 parameters.append("-Vdisable-por")
 
+            symmetries = [ group.strip()
+                           for group in self.symmetries.get_text().split(",")
+                           if group.strip() ]
+            if symmetries and self.analyze_transition_occurrence.get_active():
+                self.info_label.set_text("Symmetry reduction cannot be used with "
+                                         "the analysis of characteristic vectors")
+                self.start_button.set_sensitive(True)
+                return
+            parameters += [ "-Vsymmetry={0}".format(group) for group in symmetries ]
+
             p.start(parameters)
             self.process = p
             self.stop_button.set_sensitive(True)
@@ -18,6 +18,7 @@
 #
 
 import numpy as np
+import operator
 
 class Table(object):
 
@@ -42,6 +43,8 @@ class Table(object):
             self.data = np.ma.zeros((self.rows_number,), dtype=columns)
 
         self.last_row_index = 0
+        self.indexes = {}
+        self.filtered_columns = set() # columns filtered without an index
 
     @classmethod
     def create_from_data(cls, data):
@@ -92,9 +95,8 @@ class Table(object):
         assert len(row) == self.columns_number, \
                "The row has to have the same length as the table has columns."
 
-        if self.last_row_index >= self.rows_number: # resize
-            self.rows_number *= 2
-            self.data = np.ma.resize(self.data, self.rows_number)
+        self._reserve(self.last_row_index + 1)
+        self.drop_indexes()
 
         for i, item in enumerate(row): # append row
             if item is None: # invalid values
@@ -104,6 +106,63 @@ class Table(object):
                 self.data.data[self.last_row_index][i] = item
         self.last_row_index += 1
 
+    def add_rows(self, rows):
+        """ Append a chunk of rows at once.
+
+        Arguments:
+        rows -- a list of rows (None is an invalid value) or a structured
+        (masked) NumPy array with the same columns as the table
+        """
+        if isinstance(rows, np.ndarray):
+            data = rows
+        else:
+            data = rows_to_array(rows, self.data.dtype)
+        self._append_data(data)
+
+    def add_columns(self, columns, masks=None):
+        """ Append rows given by columns.
+
+        Arguments:
+        columns -- a list of arrays (one array for each column of the table)
+        masks -- a list of boolean arrays (True for invalid values) or None
+        """
+        assert len(columns) == self.columns_number, \
+               "The number of columns has to be the same as the table has."
+        data = np.ma.zeros(len(columns[0]), dtype=self.data.dtype)
+        for i, name in enumerate(self.header):
+            data.data[name] = columns[i]
+            if masks is not None and masks[i] is not None:
+                data.mask[name] = masks[i]
+        self._append_data(data)
+
+    def _append_data(self, data):
+        end = self.last_row_index + len(data)
+        self._reserve(end)
+        self.drop_indexes()
+        self.data[self.last_row_index:end] = data
+        self.last_row_index = end
+
+    def _reserve(self, rows_number):
+        if rows_number > self.rows_number: # resize
+            self.rows_number = max(rows_number, self.rows_number * 2)
+            self.data = np.ma.resize(self.data, self.rows_number)
+
+    def create_index(self, column):
+        """ Create (or return the cached) sorted index of the column. Select
+        and group_by use the index for filters whose compare function is
+        operator.eq, ne, lt, le, gt or ge. Indexes are dropped when rows are
+        appended.
+        """
+        column = self._get_colum_name(column)
+        index = self.indexes.get(column)
+        if index is None:
+            index = ColumnIndex(self.data[:self.last_row_index][column])
+            self.indexes[column] = index
+        return index
+
+    def drop_indexes(self):
+        self.indexes = {}
+
     def trim(self):
         self.data = np.ma.resize(self.data, self.last_row_index)
 
@@ -124,18 +183,62 @@ class Table(object):
                 columns = [columns]
             columns = [self._get_colum_name(column) for column in columns]
 
+        data = self.data[:self.last_row_index][self._filter_rows(filters)]
+        if columns is None:
+            return data
+        elif len(columns) == 1:
+            columns = columns[0]
+        return data[columns]
+
+    def group_by(self, columns, filters=[]):
+        """ Split rows into groups by values of columns. The rows are sorted
+        only once and each group is a slice of the sorted data.
+
+        Arguments:
+        columns -- a list of names or indexes of columns
+        filters -- filters in the same form as in the 'select' method
+        """
+        if not isinstance(columns, list):
+            columns = [columns]
+        columns = [self._get_colum_name(column) for column in columns]
+        data = self.data[:self.last_row_index]
+        if filters:
+            data = data[self._filter_rows(filters)]
+        return GroupBy(data, columns)
+
+    def _filter_rows(self, filters):
+        """ Return sorted indexes of rows that pass all filters. Filters
+        answered by indexes are applied first, the remaining ones are
+        evaluated only on rows that passed them. """
         if not isinstance(filters, list):
             filters = [filters]
 
-        mask = np.ma.ones(self.last_row_index, dtype='bool')
+        data = self.data[:self.last_row_index]
+        rows = None
+        scans = []
         for col, f_cmp, value in filters:
-            mask &= f_cmp(self.data[self._get_colum_name(col)], value)
+            col = self._get_colum_name(col)
+            index = self.indexes.get(col)
+            if index is not None and index.supports(f_cmp):
+                found = np.sort(index.find(f_cmp, value))
+                if rows is None:
+                    rows = found
+                else:
+                    rows = np.intersect1d(rows, found, assume_unique=True)
+            else:
+                scans.append((col, f_cmp, value))
+                self.filtered_columns.add(col)
 
-        if columns is None:
-            return self.data[mask]
-        elif len(columns) == 1:
-            columns = columns[0]
-        return self.data[mask][columns]
+        if rows is None:
+            mask = np.ma.ones(self.last_row_index, dtype='bool')
+            for col, f_cmp, value in scans:
+                mask &= f_cmp(data[col], value)
+            return np.flatnonzero(np.ma.filled(mask, False))
+
+        for col, f_cmp, value in scans:
+            mask = f_cmp(data[col][rows], value)
+            rows = rows[np.ma.filled(mask, False)]
+        return rows
 
     def _get_colum_name(self, column):
         if isinstance(column, int) and 0 <= column < self.columns_number:
@@ -145,3 +248,242 @@ class Table(object):
         else:
             raise Exception("Invalid '{0}' column.".format(column))
 
+
+class ColumnIndex(object):
+    """ A sorted index of one column; masked values are not indexed. """
+
+    def __init__(self, column):
+        valid = np.flatnonzero(~np.ma.getmaskarray(column))
+        values = column.data[valid]
+        order = np.argsort(values, kind="mergesort")
+        self.rows = valid[order]
+        self.values = values[order]
+
+    def supports(self, f_cmp):
+        return f_cmp in _index_compare_functions
+
+    def find(self, f_cmp, value):
+        """ Return indexes of rows that satisfy f_cmp(row, value) """
+        if f_cmp is operator.eq:
+            return self.rows[self._lower(value):self._upper(value)]
+        elif f_cmp is operator.ne:
+            return np.concatenate((self.rows[:self._lower(value)],
+                                   self.rows[self._upper(value):]))
+        elif f_cmp is operator.lt:
+            return self.rows[:self._lower(value)]
+        elif f_cmp is operator.le:
+            return self.rows[:self._upper(value)]
+        elif f_cmp is operator.gt:
+            return self.rows[self._upper(value):]
+        elif f_cmp is operator.ge:
+            return self.rows[self._lower(value):]
+        raise Exception("Unsupported compare function.")
+
+    def _lower(self, value):
+        return np.searchsorted(self.values, value, "left")
+
+    def _upper(self, value):
+        return np.searchsorted(self.values, value, "right")
+
+_index_compare_functions = (operator.eq, operator.ne, operator.lt,
+                            operator.le, operator.gt, operator.ge)
+
+
+class GroupBy(object):
+    """ Rows of a table split into groups by values of key columns. A key of
+    a group is a value (one key column) or a tuple of values, masked values
+    are represented by None. """
+
+    def __init__(self, data, columns):
+        self.columns = columns
+        # masked cells keep arbitrary data, they are filled by the same value
+        # to fall into one group
+        keys = [(np.ma.filled(data[column]), np.ma.getmaskarray(data[column]))
+                for column in columns]
+
+        if len(data):
+            # lexsort is stable, so rows of a group keep the table order
+            sort_keys = []
+            for values, mask in reversed(keys):
+                sort_keys.append(values)
+                sort_keys.append(mask)
+            order = np.lexsort(sort_keys)
+            data = data[order]
+            keys = [(values[order], mask[order]) for values, mask in keys]
+        self.data = data
+
+        size = len(data)
+        changes = np.zeros(size, dtype=bool)
+        if size:
+            changes[0] = True
+        for values, mask in keys:
+            changes[1:] |= values[1:] != values[:-1]
+            changes[1:] |= mask[1:] != mask[:-1]
+        self.starts = np.flatnonzero(changes)
+        self.ends = np.append(self.starts[1:], size).astype(self.starts.dtype)
+
+        key_columns = []
+        for values, mask in keys:
+            column = values[self.starts].tolist()
+            for i in np.flatnonzero(mask[self.starts]):
+                column[i] = None
+            key_columns.append(column)
+        if len(columns) == 1:
+            self.keys = key_columns[0]
+        else:
+            self.keys = zip(*key_columns)
+        self.index = dict((key, i) for i, key in enumerate(self.keys))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def get(self, key, columns=None):
+        """ Return rows of a group; the result is empty for an unknown key.
+
+        Arguments:
+        key -- a key of the group
+        columns -- a list of names of columns or None for all columns
+        """
+        i = self.index.get(key)
+        if i is None:
+            data = self.data[:0]
+        else:
+            data = self.data[self.starts[i]:self.ends[i]]
+        if columns is None:
+            return data
+        if isinstance(columns, list) and len(columns) == 1:
+            columns = columns[0]
+        return data[columns]
+
+    def count(self):
+        """ Return a dictionary: key -> number of rows """
+        return dict(zip(self.keys, (self.ends - self.starts).tolist()))
+
+    def sum(self, column):
+        """ Return a dictionary: key -> sum of valid values of the column """
+        values = self._valid_values(column, 0)
+        if not len(values):
+            return {}
+        return dict(zip(self.keys, np.add.reduceat(values, self.starts).tolist()))
+
+    def min(self, column):
+        """ Return a dictionary: key -> minimum of valid values of the column,
+        None if a group has no valid value """
+        fill = np.ma.minimum_fill_value(self.data[column])
+        return self._reduce(np.minimum, column, fill)
+
+    def max(self, column):
+        """ Return a dictionary: key -> maximum of valid values of the column,
+        None if a group has no valid value """
+        fill = np.ma.maximum_fill_value(self.data[column])
+        return self._reduce(np.maximum, column, fill)
+
+    def histogram(self, column, bins=10, range=None):
+        """ Compute histograms of the column for all groups at once. All
+        histograms share the same bin edges (computed as in numpy.histogram).
+
+        Returns a couple: (edges, dictionary: key -> counts)
+        """
+        valid = ~np.ma.getmaskarray(self.data[column])
+        values = self.data.data[column][valid].astype(float)
+        if range is None:
+            if len(values):
+                range = (values.min(), values.max())
+            else:
+                range = (0.0, 1.0)
+        low, high = range
+        if low == high:
+            low, high = low - 0.5, high + 0.5
+        edges = np.linspace(low, high, bins + 1)
+
+        groups = np.repeat(np.arange(len(self.keys)),
+                           self.ends - self.starts)[valid]
+        inside = (values >= low) & (values <= high)
+        positions = np.searchsorted(edges, values[inside], "right") - 1
+        positions[positions == bins] = bins - 1 # the last bin is closed
+        counts = np.bincount(groups[inside] * bins + positions,
+                             minlength=len(self.keys) * bins)
+        counts = counts.reshape((len(self.keys), bins))
+        return edges, dict(zip(self.keys, counts))
+
+    def _valid_values(self, column, fill):
+        return np.ma.filled(self.data[column], fill)
+
+    def _reduce(self, function, column, fill):
+        if not len(self.data):
+            return {}
+        values = function.reduceat(
+            self._valid_values(column, fill), self.starts).tolist()
+        valid = np.add.reduceat(
+            ~np.ma.getmaskarray(self.data[column]), self.starts)
+        for i in np.flatnonzero(valid == 0):
+            values[i] = None
+        return dict(zip(self.keys, values))
+
+
+class TableBuilder(object):
+    """ An append-only builder of a table. Rows are collected into chunks of
+    plain NumPy columns and the masked array of the table is created only
+    once by the 'build' method. """
+
+    def __init__(self, columns, chunk_size=10000):
+        """
+        Arguments:
+        columns -- a list of couples (name, data type)
+        chunk_size -- a number of rows that are converted into NumPy arrays
+        at once
+        """
+        self.columns = columns
+        self.dtype = np.dtype(columns)
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self.rows = []
+
+    def add_row(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.chunk_size:
+            self._flush()
+
+    def add_rows(self, rows):
+        self.rows.extend(rows)
+        if len(self.rows) >= self.chunk_size:
+            self._flush()
+
+    def _flush(self):
+        if self.rows:
+            self.chunks.append(rows_to_array(self.rows, self.dtype))
+            self.rows = []
+
+    def build(self):
+        self._flush()
+        if self.chunks:
+            data = np.ma.concatenate(self.chunks)
+        else:
+            data = np.ma.zeros(0, dtype=self.dtype)
+        self.chunks = []
+        table = Table(self.columns, init_data=False)
+        table.data = data
+        table.rows_number = table.last_row_index = len(data)
+        return table
+
+
+def rows_to_array(rows, dtype):
+    """ Convert a list of rows into a masked structured array, None values
+    are masked. The conversion is done by columns. """
+    dtype = np.dtype(dtype)
+    data = np.zeros(len(rows), dtype=dtype)
+    mask = np.zeros(len(rows), dtype=np.ma.make_mask_descr(dtype))
+    if not rows:
+        return np.ma.array(data, mask=mask)
+    for name, values in zip(dtype.names, zip(*rows)):
+        if None in values:
+            invalid = np.array([ value is None for value in values ])
+            mask[name] = invalid
+            data[name][~invalid] = [ value for value in values
+                                     if value is not None ]
+        else:
+            data[name] = values
+    return np.ma.array(data, mask=mask)
@@ -22,19 +22,82 @@ import xml.etree.ElementTree as xml
 import utils
 import loader
 import struct
+import heapq
+import mmap
+import os
+import multiprocessing
+import threading
+import copy
+import cPickle
+import cStringIO
 import controlseq
+import numpy as np
 
 from table import Table
 from runinstance import RunInstance
-from exportri import ExportRunInstance, place_counter_name
+from exportri import ExportRunInstance, get_default_export_settings
 
 zero_char = chr(0)
 
+timeline_columns = [("process", "<i4"), ("pointer", "<i8")]
+
+# Columns of decoded traces (see Trace.decode)
+events_columns = [("type", "|S1"),
+                  ("time", "<u8"),
+                  ("id", "<i4"),
+                  ("pointer", "<i8")]
+sends_columns = [("event", "<i4"),
+                 ("target", "<i4")]
+
+# A number of events replayed between two checks of cancellation
+# of the export (see TraceLog.get_data)
+EXPORT_STEP = 10000
+
+# Version of the format of .kti files, it has to be increased when
+# the content of the index cache changes
+INDEX_CACHE_VERSION = 4
+
 class TraceLog:
 
-    def __init__(self, filename, export_data=False):
+    def __init__(self,
+                 filename,
+                 export_data=False,
+                 checkpoint_interval=1000,
+                 use_mmap=True,
+                 use_cache=True,
+                 decode_processes=1,
+                 index=True):
+        """ Arguments:
+        filename -- a name of .kth file
+        export_data -- provide a table with exported data (see get_data)
+        checkpoint_interval -- a number of visible events between two
+        snapshots of a run instance; snapshots are created when the tracelog
+        is indexed (and stored in the index cache), random access to an event
+        then replays at most this number of events
+        use_mmap -- map .ktt files into memory instead of reading them, traces
+        are then read directly from the page cache
+        use_cache -- store indexes of the tracelog into a .kti file next to
+        the .kth file and reuse them when the tracelog is opened again
+        decode_processes -- a number of worker processes that decode traces
+        in parallel; decoding is the main part of indexing, timelines are
+        then merged from decoded columns; 1 decodes traces in this process,
+        None uses all CPUs
+        index -- decode traces and build timelines; a tracelog without indexes
+        can be only processed sequentially by execute_streamed_events
+        """
         self.filename = filename
         self.export_data = export_data
+        self.checkpoint_interval = checkpoint_interval
+        self.use_mmap = use_mmap
+        self.use_cache = use_cache
+        self.decode_processes = decode_processes
+        self.checkpoints = []
+        if export_data:
+            # The table is created by the first get_data
+            self.data = None
+        else:
+            self.data = Table([], 0)
+        self.data_lock = threading.Lock()
         self._read_header()
 
         self.traces = [None] * self.process_count
@@ -42,8 +105,32 @@ class TraceLog:
             self._read_trace(process_id)
 
         self.first_runinstance = RunInstance(self.project, self.process_count)
+        self._set_time_offsets()
+
+        if not index:
+            return
 
-        self._preprocess()
+        if not self.use_cache or not self._load_index_cache():
+            self._decode_traces()
+            self._preprocess()
+            if self.use_cache:
+                self._save_index_cache()
+
+    def get_data(self, cancelled=None):
+        """ Return the table with exported data (see ExportRunInstance).
+
+        The table is created by a replay of all events when it is requested
+        for the first time and it is then stored in the index cache.
+        'cancelled' is a function that is checked during the replay; when it
+        returns True, the replay is stopped and None is returned.
+        It may be called from a background thread.
+        """
+        with self.data_lock:
+            if self.data is None:
+                self.data = self._export_data(cancelled)
+                if self.data is not None and self.use_cache:
+                    self._save_index_cache()
+            return self.data
 
     def execute_visible_events(self, ri, from_event=0, to_event=None):
         if to_event is None:
@@ -65,9 +152,47 @@ class TraceLog:
             trace.process_event(ri)
         return ri
 
+    def execute_streamed_events(self, ri):
+        """ Execute all events in the order of time without indexes. Memory
+        consumption does not depend on the length of the tracelog. """
+        for trace in merge_traces(self.traces):
+            trace.process_event(ri)
+        return ri
+
+    def iterate_events(self):
+        """ Generator that yields traces in the order of time of their next
+        events. It merges events of all processes by a priority queue.
+
+        The pointer of the yielded trace is set at the next event. The consumer
+        may process this event but it is not required.
+        """
+        indices = [0] * self.process_count
+        heap = [ (trace.get_event_time(0), trace.process_id)
+                 for trace in self.traces if len(trace.events) > 0 ]
+        heapq.heapify(heap)
+        while heap:
+            process_id = heap[0][1]
+            trace = self.traces[process_id]
+            index = indices[process_id]
+            trace.pointer = int(trace.events[index]["pointer"])
+            yield trace
+            index += 1
+            indices[process_id] = index
+            if index == len(trace.events):
+                heapq.heappop(heap)
+            else:
+                heapq.heapreplace(heap, (trace.get_event_time(index), process_id))
+
     def get_event_runinstance(self, index):
+        if index == 0:
+            return self.first_runinstance.copy()
+        # The nearest checkpoint strictly before index is used, hence at least
+        # one event is executed and the information about the last event is set
+        checkpoint = (index - 1) // self.checkpoint_interval
         return self.execute_visible_events(
-            self.first_runinstance.copy(), 0, index)
+            self.checkpoints[checkpoint].copy(),
+            checkpoint * self.checkpoint_interval,
+            index)
 
     def get_event_process(self, index):
         if index == 0:
@@ -128,69 +253,293 @@ class TraceLog:
             x = xml.fromstring(f.read())
             self.project = loader.load_project_from_xml(x, "")
 
-    def _read_trace(self, process_id):
-        filename = "{0}-{1}-0.ktt".format(
+    def _get_trace_filename(self, process_id):
+        return "{0}-{1}-0.ktt".format(
             utils.trim_filename_suffix(self.filename),
             process_id)
-        with open(filename, "rb") as f:
-            trace = Trace(f.read(), process_id, self.pointer_size)
-            self.traces[process_id] = trace
 
-    def _preprocess(self):
-        # Set time offsets
-        starttime = min([ trace.get_init_time() for trace in self.traces ])
-        for trace in self.traces:
-            trace.time_offset = trace.get_init_time() - starttime
-        trace_times = [ trace.get_next_event_time() for trace in self.traces ]
-
-        if self.export_data:
-            place_counters = [place_counter_name(p)
-                              for p in self.project.nets[0].places()
-                              if p.trace_tokens]
-
-            ri = ExportRunInstance(
-                self,
-                [ t for t in self.project.nets[0].transitions() if t.trace_fire ],
-                [ (p, i) for p in self.project.nets[0].places()
-                         for i, tracing in enumerate(p.trace_tokens_functions)
-                         if tracing.return_numpy_type != 'O' ],
-                ExportRunInstance.basic_header + place_counters)
+    def _get_index_cache_filename(self):
+        return utils.trim_filename_suffix(self.filename) + ".kti"
+
+    def _get_index_cache_key(self):
+        """ Return a string that identifies the version of the cache and
+        the content of the tracelog files """
+        filenames = [ self.filename ] + \
+                    [ self._get_trace_filename(process_id)
+                      for process_id in xrange(self.process_count) ]
+        stats = [ os.stat(filename) for filename in filenames ]
+        return "{0} {1}".format(
+            INDEX_CACHE_VERSION,
+            " ".join("{0}:{1!r}".format(stat.st_size, stat.st_mtime)
+                     for stat in stats))
+
+    def _load_index_cache(self):
+        """ Load indexes from the cache, return False if the cache does not
+        exist or it is not valid for the tracelog """
+        try:
+            with open(self._get_index_cache_filename(), "rb") as f:
+                cache = np.load(f)
+                if str(cache["key"]) != self._get_index_cache_key():
+                    return False
+                arrays = dict((name, cache[name]) for name in cache.files)
+        except (IOError, OSError, ValueError, KeyError):
+            return False
+
+        for trace, time_offset in zip(self.traces, arrays["time_offsets"]):
+            trace.time_offset = int(time_offset)
+            trace.events = arrays["events-{0}".format(trace.process_id)]
+            trace.sends = arrays["sends-{0}".format(trace.process_id)]
+        self.timeline = Table.create_from_data(np.ma.array(arrays["timeline"]))
+        self.full_timeline = Table.create_from_data(
+            np.ma.array(arrays["full_timeline"]))
+        self.missed_receives = int(arrays["missed_receives"])
+        if self.export_data and "data" in arrays:
+            self.data = Table.create_from_data(
+                np.ma.array(arrays["data"], mask=arrays["data_mask"]))
+        if int(arrays["checkpoint_interval"]) == self.checkpoint_interval:
+            self.checkpoints = self._load_checkpoints(arrays["checkpoints"])
         else:
-            ri = RunInstance(
-                self.project, self.process_count)
-
-        index = 0
-        timeline = Table([("process", "<i4"), ("pointer", "<i4")], 100)
-        full_timeline = Table([("process", "<i4"), ("pointer", "<i4")], 100)
-        while True:
-
-            # Searching for trace with minimal event time
-            minimal_time_index = utils.index_of_minimal_value(trace_times)
-            if minimal_time_index is None:
-                break
-
-            trace = self.traces[minimal_time_index]
+            # Indexes are valid, only checkpoints are created again
+            self._make_checkpoints()
+            self._save_index_cache()
+        return True
+
+    def _save_index_cache(self):
+        arrays = {
+            "key" : np.array(self._get_index_cache_key()),
+            "time_offsets" : np.array([ trace.time_offset
+                                        for trace in self.traces ]),
+            "timeline" : self.timeline.data.data,
+            "full_timeline" : self.full_timeline.data.data,
+            "missed_receives" : np.array(self.missed_receives),
+            "checkpoint_interval" : np.array(self.checkpoint_interval),
+            "checkpoints" : self._dump_checkpoints(),
+        }
+        for trace in self.traces:
+            arrays["events-{0}".format(trace.process_id)] = trace.events
+            arrays["sends-{0}".format(trace.process_id)] = trace.sends
+        if self.export_data and self.data is not None:
+            arrays["data"] = self.data.data.data
+            arrays["data_mask"] = np.ma.getmaskarray(self.data.data)
+
+        filename = self._get_index_cache_filename()
+        tmp_filename = filename + ".tmp"
+        try:
+            with open(tmp_filename, "wb") as f:
+                np.savez(f, **arrays)
+            os.rename(tmp_filename, filename)
+        except (IOError, OSError):
+            # The cache is only an optimization, e.g. the directory may be
+            # read-only
+            pass
 
-            full_timeline.add_row((minimal_time_index, trace.pointer))
+    def _read_trace(self, process_id):
+        self.traces[process_id] = Trace(
+            read_trace_data(self._get_trace_filename(process_id), self.use_mmap),
+            process_id,
+            self.pointer_size)
+
+    def _decode_traces(self):
+        if self.decode_processes == 1 or self.process_count == 1:
+            for trace in self.traces:
+                trace.events, trace.sends = trace.decode()
+            return
 
-            # Timeline update
-            if trace.is_next_event_visible():
-                timeline.add_row(full_timeline[index])
+        # Workers read traces by themselves, only columns are sent back
+        pool = multiprocessing.Pool(self.decode_processes)
+        try:
+            columns = pool.map(
+                decode_trace_file,
+                [ (self._get_trace_filename(trace.process_id),
+                   trace.process_id,
+                   self.pointer_size,
+                   self.use_mmap) for trace in self.traces ],
+                chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        for trace, (events, sends) in zip(self.traces, columns):
+            trace.events, trace.sends = events, sends
+
+    def _merge_events(self):
+        """ Returns the order of all events by time. Events are numbered
+        through all traces, i.e. the event i of trace p has the number
+        sum(len(trace.events) for traces before p) + i """
+        starts = np.cumsum([ 0 ] + [ len(trace.events) for trace in self.traces ])
+        times = [ trace.events["time"] + np.uint64(trace.time_offset)
+                  for trace in self.traces ]
+        if not all(np.all(t[1:] >= t[:-1]) for t in times):
+            # Times are not monotonic, merge has to follow the order in traces
+            indices = [ 0 ] * self.process_count
+            order = []
+            for trace in self.iterate_events():
+                order.append(starts[trace.process_id] + indices[trace.process_id])
+                indices[trace.process_id] += 1
+            return np.array(order, dtype=np.int64)
+
+        processes = np.concatenate(
+            [ np.repeat(trace.process_id, len(trace.events))
+              for trace in self.traces ])
+        return np.lexsort((np.arange(starts[-1]), processes, np.concatenate(times)))
+
+    def _set_time_offsets(self):
+        starttime = min([ trace.get_init_time() for trace in self.traces ])
+        for trace in self.traces:
+            trace.time_offset = trace.get_init_time() - starttime
 
+    def _preprocess(self):
+        order = self._merge_events()
+        processes = np.concatenate(
+            [ np.repeat(trace.process_id, len(trace.events))
+              for trace in self.traces ])
+        types = np.concatenate([ trace.events["type"] for trace in self.traces ])
+        events = np.zeros(len(order), dtype=timeline_columns)
+        events["process"] = processes[order]
+        events["pointer"] = np.concatenate(
+            [ trace.events["pointer"] for trace in self.traces ])[order]
+        types = types[order]
+        visible = (types != "I") & (types != "M") & (types != "N")
+
+        self.timeline = Table.create_from_data(np.ma.array(events[visible]))
+        self.full_timeline = Table.create_from_data(np.ma.array(events))
+        self.missed_receives = self._count_missed_receives(order)
+        self._make_checkpoints()
+
+    def _make_checkpoints(self):
+        """ Replay all visible events once and store a snapshot of the run
+        instance before each checkpoint_interval-th event """
+        ri = self.first_runinstance.copy()
+        self.checkpoints = [ ri.copy() ]
+        for start in xrange(self.checkpoint_interval,
+                            len(self.timeline),
+                            self.checkpoint_interval):
+            self.execute_visible_events(
+                ri, start - self.checkpoint_interval, start)
+            self.checkpoints.append(ri.copy())
+
+    def _get_project_ids(self):
+        """ Return a dictionary that maps Python ids of the project and its
+        nets and items to keys that are stored instead of them """
+        ids = { id(self.project) : ("project",) }
+        for net in self.project.nets:
+            ids[id(net)] = ("net", net.id)
+            for item in net.items:
+                ids[id(item)] = ("item", net.id, item.id)
+        return ids
+
+    def _dump_checkpoints(self):
+        """ Pickle checkpoints into an array of bytes. Parts shared by
+        checkpoints are stored only once, the project is stored as ids. """
+        ids = self._get_project_ids()
+        f = cStringIO.StringIO()
+        pickler = cPickle.Pickler(f, cPickle.HIGHEST_PROTOCOL)
+        pickler.persistent_id = lambda obj: ids.get(id(obj))
+        pickler.dump(self.checkpoints)
+        return np.frombuffer(f.getvalue(), dtype=np.uint8)
+
+    def _load_checkpoints(self, data):
+        def persistent_load(key):
+            if key[0] == "project":
+                return self.project
+            net = self.project.find_net(key[1])
+            if key[0] == "net":
+                return net
+            return net.item_by_id(key[2])
+        unpickler = cPickle.Unpickler(cStringIO.StringIO(data.tostring()))
+        unpickler.persistent_load = persistent_load
+        return unpickler.load()
+
+    def _export_data(self, cancelled):
+        ri = ExportRunInstance(self, *get_default_export_settings(self))
+        # The replay may run in a background thread, it uses own copies
+        # of traces, so pointers of self.traces are not moved
+        traces = [ trace.copy() for trace in self.traces ]
+        for i in xrange(len(self.full_timeline)):
+            if i % EXPORT_STEP == 0 and cancelled is not None and cancelled():
+                return None
+            event_pointer = self.full_timeline[i]
+            trace = traces[event_pointer["process"]]
+            trace.pointer = event_pointer["pointer"]
             trace.process_event(ri)
-            trace_times[minimal_time_index] = trace.get_next_event_time()
-
-            index += 1
-
-        self.data = Table([], 0)
-        if self.export_data:
-            self.data = ri.get_table()
+        return ri.get_table()
+
+    def _count_missed_receives(self, order):
+        """ Count receives that have no matching send before them
+        (see RunInstance.event_send). It is computed from decoded columns
+        without a replay of events. """
+        starts = np.cumsum([ 0 ] + [ len(trace.events) for trace in self.traces ])
+        # Positions of events in the full timeline
+        positions = np.empty(len(order), dtype=np.int64)
+        positions[order] = np.arange(len(order))
+
+        queues, times, changes = [], [], []
+        for trace, start in zip(self.traces, starts):
+            # Sent messages are added into queues (target, sender)
+            queues.append(trace.sends["target"] * self.process_count +
+                          trace.process_id)
+            times.append(positions[start + trace.sends["event"]])
+            changes.append(np.ones(len(trace.sends), dtype=np.int64))
+            # Received messages are taken from queues (receiver, origin)
+            receives = np.flatnonzero(trace.events["type"] == "R")
+            queues.append(trace.process_id * self.process_count +
+                          trace.events["id"][receives])
+            times.append(positions[start + receives])
+            changes.append(-np.ones(len(receives), dtype=np.int64))
+
+        queues = np.concatenate(queues)
+        if len(queues) == 0:
+            return 0
+        changes = np.concatenate(changes)
+        # A receive is processed before sends of its own event
+        ordered = np.lexsort((changes, np.concatenate(times), queues))
+        queues = queues[ordered]
+        changes = changes[ordered]
+
+        # The number of packets minus the number of debt receives in a queue
+        # before each change; a send into a queue with debts is a missed receive
+        balance = np.cumsum(changes) - changes
+        first = np.flatnonzero(np.r_[True, queues[1:] != queues[:-1]])
+        group_sizes = np.diff(np.r_[first, len(queues)])
+        balance -= np.repeat(balance[first], group_sizes)
+        return int(np.sum((changes > 0) & (balance < 0)))
+
+
+def merge_traces(traces):
+    """ Generator that yields traces in the order of time of their next
+    events. Traces do not have to be decoded, events are merged directly
+    from data.
+
+    The pointer of the yielded trace is set at the next event and the
+    consumer has to process this event (i.e. move the pointer behind the
+    event) before the next trace is requested.
+    """
+    for trace in traces:
+        trace.pointer = trace.first_event_pointer
+    heap = [ (trace.get_next_event_time(), i)
+             for i, trace in enumerate(traces) if not trace.is_pointer_at_end() ]
+    heapq.heapify(heap)
+    while heap:
+        i = heap[0][1]
+        trace = traces[i]
+        yield trace
+        time = trace.get_next_event_time()
+        if time is None:
+            heapq.heappop(heap)
+        else:
+            heapq.heapreplace(heap, (time, i))
 
-        timeline.trim()
-        full_timeline.trim()
-        self.timeline, self.full_timeline = timeline, full_timeline
+def read_trace_data(filename, use_mmap):
+    with open(filename, "rb") as f:
+        if use_mmap:
+            # The mapping stays valid after the file is closed
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            return f.read()
 
-        self.missed_receives = ri.missed_receives
+def decode_trace_file((filename, process_id, pointer_size, use_mmap)):
+    """ Decode a trace in a worker process of TraceLog._decode_traces """
+    trace = Trace(read_trace_data(filename, use_mmap), process_id, pointer_size)
+    return trace.decode()
 
 
 class Trace:
@@ -207,6 +556,14 @@ class Trace:
     struct_int = struct.Struct("<i")
     struct_double = struct.Struct("<d")
 
+    # Sizes of fixed parts of events (without the type)
+    event_sizes = { "T" : struct_transition_fired.size,
+                    "F" : struct_basic.size,
+                    "R" : struct_receive.size,
+                    "S" : struct_spawn.size,
+                    "I" : struct_basic.size,
+                    "Q" : struct_basic.size }
+
     def __init__(self, data, process_id, pointer_size):
         self.data = data
         self.pointer = 0
@@ -219,6 +576,137 @@ class Trace:
         else:
             Exception("Invalid pointer size")
         self.info = self._read_header()
+        self.first_event_pointer = self.pointer
+
+    def copy(self):
+        """ Return a trace over the same data with its own pointer """
+        return copy.copy(self)
+
+    def get_event_time(self, index):
+        """ Return time of the index-th event (a decoded trace is required) """
+        return int(self.events[index]["time"]) + self.time_offset
+
+    def decode(self):
+        """ Scan the whole trace once and return its content as columns.
+
+        Returns a pair of NumPy structured arrays (events, sends).
+        'events' contains a row for each event: type, time (without the time
+        offset), id (of fired transition, spawned net or origin process of
+        received message; -1 otherwise) and pointer (the offset of the event
+        in data). 'sends' contains a row for each target of a sent message:
+        event (an index into events) and target.
+
+        The scan only finds offsets of events and messages, their fixed-layout
+        fields are then read by NumPy for all offsets at once. Columns are
+        used for indexing (timelines and missed receives); a replay of events
+        reads records from data (see process_event), so token records and
+        values are only skipped.
+        """
+        data = self.data
+        size = len(data)
+        find = data.find
+        unpack_int = self.struct_int.unpack_from
+        event_sizes = self.event_sizes
+        token_size = self.struct_token.size + 1
+        send_size = self.struct_send.size + 1
+        basic_size = self.struct_basic.size + 1
+
+        events = []
+        sends = []
+        send_events = []
+        send_counts = []
+        pointer = self.first_event_pointer
+        while pointer < size:
+            t = data[pointer]
+            if t not in event_sizes:
+                raise Exception("Invalid event type '{0}/{1}' (pointer={2}, process={3})"
+                                    .format(t, ord(t), hex(pointer), self.process_id))
+            index = len(events)
+            events.append(pointer)
+            pointer += event_sizes[t] + 1
+            if t == "I" or t == "Q":
+                continue
+
+            if t == "T":
+                # Removed tokens and values of trace functions
+                while pointer < size:
+                    r = data[pointer]
+                    if r == "r":
+                        pointer += token_size
+                    elif r == "i":
+                        pointer += 5
+                    elif r == "d":
+                        pointer += 9
+                    elif r == "s":
+                        pointer = find(zero_char, pointer + 1) + 1
+                    else:
+                        break
+
+            if (t == "T" or t == "F") and pointer < size and data[pointer] == "Q":
+                pointer += basic_size
+
+            # Added tokens with their values and sent messages
+            while pointer < size:
+                r = data[pointer]
+                if r == "t":
+                    pointer += token_size
+                elif r == "i":
+                    pointer += 5
+                elif r == "d":
+                    pointer += 9
+                elif r == "s":
+                    pointer = find(zero_char, pointer + 1) + 1
+                elif r == "M":
+                    count = unpack_int(data, pointer + send_size - 4)[0]
+                    sends.append(pointer)
+                    send_events.append(index)
+                    send_counts.append(count)
+                    pointer += send_size + 4 * count
+                else:
+                    break
+
+            if t != "S" and pointer < size and data[pointer] == "X":
+                pointer += basic_size
+
+        return (self._decode_events(events),
+                self._decode_sends(sends, send_events, send_counts))
+
+    def _gather(self, pointers, dtype):
+        """ Read a record of the given dtype at each pointer """
+        dtype = np.dtype(dtype)
+        data = np.frombuffer(self.data, dtype=np.uint8)
+        offsets = np.asarray(pointers, dtype=np.int64)[:, np.newaxis] + \
+                  np.arange(dtype.itemsize)
+        # Fields that are not present in a short record at the end of data
+        # are read from the last byte, they are ignored by callers
+        np.minimum(offsets, len(data) - 1, out=offsets)
+        return data[offsets].view(dtype).reshape(len(offsets))
+
+    def _decode_events(self, pointers):
+        header = self._gather(pointers, [("type", "|S1"),
+                                         ("time", "<u8"),
+                                         ("id", "<i4")])
+        events = np.zeros(len(pointers), dtype=events_columns)
+        events["type"] = header["type"]
+        events["time"] = header["time"]
+        types = header["type"]
+        has_id = (types == "T") | (types == "R") | (types == "S")
+        events["id"] = np.where(has_id, header["id"], -1)
+        events["pointer"] = pointers
+        return events
+
+    def _decode_sends(self, pointers, send_events, counts):
+        counts = np.asarray(counts, dtype=np.int64)
+        # Targets of a message follow its fixed part
+        starts = np.asarray(pointers, dtype=np.int64) + self.struct_send.size + 1
+        positions = np.arange(counts.sum()) - \
+                    np.repeat(np.cumsum(counts) - counts, counts)
+        targets = self._gather(np.repeat(starts, counts) + 4 * positions,
+                               [("target", "<i4")])
+        sends = np.zeros(len(targets), dtype=sends_columns)
+        sends["event"] = np.repeat(np.asarray(send_events, dtype=np.int32), counts)
+        sends["target"] = targets["target"]
+        return sends
 
     def get_init_time(self):
         s = self.info.get("inittime")
@@ -318,10 +806,9 @@ class Trace:
                 self.pointer += 1
                 token_pointer, place_id = self._read_struct_token()
                 runinstance.remove_token(place_id, token_pointer)
-            elif t == "M":
-                self.pointer += 1
-                self._process_event_send(runinstance)
             else:
+                # Messages are sent after tokens are removed, they are
+                # processed with added tokens
                 break
 
     def get_next_event_time(self):
@@ -377,6 +377,9 @@ void ca::write_header(FILE *out, int process_count)
 	output.set("pointer-size", (int) sizeof(void*));
 	output.set("process-count", process_count);
 	output.set("description-lines", lines);
+	output.set("delta-reports", true);
+	output.set("batch-commands", true);
+	output.set("binary-protocol", true);
 	output.back();
 	fputs("\n", out);
 	fputs(project_description_string, out);
@@ -42,12 +42,12 @@ static int init_listen_socket(int port)
 	return sock;
 }
 
-void write_status(FILE *out, bool status)
+static const char * status_string(bool status)
 {
 	if (status) {
-		fprintf(out, "Ok\n");
+		return "Ok";
 	} else {
-		fprintf(out, "No\n");
+		return "No";
 	}
 }
 
@@ -160,25 +160,30 @@ static bool check_prefix(const char *s, const char *prefix)
 }
 
 #define LINE_LENGTH_LIMIT 4096
+static void read_line(FILE *comm_in, char *line)
+{
+	char *s = fgets(line, LINE_LENGTH_LIMIT, comm_in);
+	if (s == NULL) {
+		exit(0);
+	}
+	size_t t = strlen(s);
+	if (t == 0) {
+		exit(0);
+	}
+	// remove \r and \n from the end
+	t--;
+	while(t > 0 && (s[t] == '\n' || s[t] == '\r')) {
+		s[t] = 0;
+		t--;
+	}
+}
+
 void Listener::process_commands(FILE *comm_in, FILE *comm_out)
 {
 	char line[LINE_LENGTH_LIMIT];
 	for(;;) {
 		fflush(comm_out);
-		char *s = fgets(line, LINE_LENGTH_LIMIT, comm_in);
-		if (s == NULL) {
-			exit(0);
-		}
-		size_t t = strlen(s);
-		if (t == 0) {
-			exit(0);
-		}
-		// remove \r and \n from the end
-		t--;
-		while(t > 0 && (s[t] == '\n' || s[t] == '\r')) {
-			s[t] = 0;
-			t--;
-		}
+		read_line(comm_in, line);
 
 		if (!strcmp(line, "QUIT")) {
 			exit(0);
@@ -189,6 +194,14 @@ void Listener::process_commands(FILE *comm_in, FILE *comm_out)
 			return;
 		}
 
+		if (!strcmp(line, "BINARY")) {
+			fprintf(comm_out, "Ok\n");
+			/* Cached parts of reports are in the text form */
+			reported = false;
+			process_binary_commands(comm_in, comm_out);
+			return;
+		}
+
 		if (!strcmp(line, "REPORTS")) {
 			state->write_reports(comm_out);
 			fprintf(comm_out, "\n");
@@ -196,82 +209,275 @@ void Listener::process_commands(FILE *comm_in, FILE *comm_out)
 			continue;
 		}
 
-		if (check_prefix(line, "FIRE")) {
-			if (processes[0]->quit_flag) {
-				fprintf(comm_out, "Process is terminated\n");
-				continue;
-			}
-			int transition_id;
-			int process_id;
-			int phases;
-			if (3 != sscanf(line, "FIRE %i %i %i", &transition_id, &process_id, &phases)) {
+		if (!strcmp(line, "DELTA-REPORTS")) {
+			write_delta_reports(comm_out);
+			fprintf(comm_out, "\n");
+			fflush(stdout);
+			continue;
+		}
+
+		if (check_prefix(line, "BATCH")) {
+			int count;
+			if (1 != sscanf(line, "BATCH %i", &count) || count < 0) {
 				fprintf(comm_out, "Invalid parameters\n");
 				continue;
 			}
-			if (process_id < 0 || process_id >= process_count) {
-				fprintf(comm_out, "There is no such process\n");
-				continue;
-			}
-			TransitionDef *transition_def = state->get_net_def()->get_transition_def(transition_id);
-			if (transition_def == NULL) {
-				fprintf(comm_out, "Invalid transition\n");
-				continue;
+			/* All commands of the batch are read, but commands after
+			   a failed one are not executed */
+			const char *result = NULL;
+			int failed = -1;
+			for (int i = 0; i < count; i++) {
+				read_line(comm_in, line);
+				if (failed == -1) {
+					result = execute_command(line);
+					if (strcmp(result, "Ok")) {
+						failed = i;
+					}
+				}
 			}
-
-			bool result;
-			if (phases == 1) {
-				result = state->fire_transition_phase1(process_id, transition_def);
+			if (failed == -1) {
+				fprintf(comm_out, "Ok\n");
 			} else {
-				result = state->fire_transition_full(process_id, transition_def);
+				fprintf(comm_out, "Failed %i %s\n", failed, result);
 			}
-			write_status(comm_out, result);
 			continue;
 		}
 
-		if (check_prefix(line, "FINISH")) {
-			if (processes[0]->quit_flag) {
-				fprintf(comm_out, "Process is terminated\n");
-				continue;
+		fprintf(comm_out, "%s\n", execute_command(line));
+	}
+}
+
+static void read_frame(FILE *comm_in, std::vector<char> &frame)
+{
+	unsigned char header[4];
+	if (fread(header, 1, 4, comm_in) != 4) {
+		exit(0);
+	}
+	size_t size = (header[0] << 24) | (header[1] << 16) | (header[2] << 8) | header[3];
+	frame.resize(size);
+	if (size > 0 && fread(&frame[0], 1, size, comm_in) != size) {
+		exit(0);
+	}
+}
+
+static void write_frame(FILE *out, BinaryFrame type, const char *data, size_t size)
+{
+	uint32_t length = size + 1;
+	fputc(length >> 24, out);
+	fputc((length >> 16) & 0xff, out);
+	fputc((length >> 8) & 0xff, out);
+	fputc(length & 0xff, out);
+	fputc(type, out);
+	fwrite(data, 1, size, out);
+}
+
+static void write_status_frame(FILE *out, const char *status)
+{
+	write_frame(out, FRAME_STATUS, status, strlen(status));
+}
+
+static bool read_frame_int(const std::vector<char> &frame, size_t &pos, int &value)
+{
+	if (pos + 4 > frame.size()) {
+		return false;
+	}
+	const unsigned char *data = (const unsigned char*) &frame[pos];
+	value = (int32_t) ((data[0] << 24) | (data[1] << 16) | (data[2] << 8) | data[3]);
+	pos += 4;
+	return true;
+}
+
+static FILE * open_string_stream(char **buffer, size_t *size)
+{
+	FILE *file = open_memstream(buffer, size);
+	if (file == NULL) {
+		perror("open_memstream");
+		exit(-1);
+	}
+	return file;
+}
+
+static std::string close_string_stream(FILE *file, char **buffer, size_t *size)
+{
+	fclose(file);
+	std::string s(*buffer, *size);
+	free(*buffer);
+	return s;
+}
+
+void Listener::process_binary_commands(FILE *comm_in, FILE *comm_out)
+{
+	std::vector<char> frame;
+	for(;;) {
+		fflush(comm_out);
+		read_frame(comm_in, frame);
+		if (frame.empty()) {
+			write_status_frame(comm_out, "Unknown command");
+			continue;
+		}
+
+		switch (frame[0]) {
+			case COMMAND_QUIT:
+				exit(0);
+				return;
+			case COMMAND_DETACH:
+				return;
+			case COMMAND_REPORTS:
+			case COMMAND_DELTA_REPORTS: {
+				char *buffer;
+				size_t size;
+				FILE *file = open_string_stream(&buffer, &size);
+				if (frame[0] == COMMAND_REPORTS) {
+					state->write_reports(file, true);
+				} else {
+					write_delta_reports(file, true);
+				}
+				std::string report = close_string_stream(file, &buffer, &size);
+				write_frame(comm_out, FRAME_REPORT, report.data(), report.size());
+				break;
 			}
-			int process_id;
-			if (1 != sscanf(line, "FINISH %i", &process_id)) {
-				fprintf(comm_out, "Invalid parameters\n");
-				continue;
+			case COMMAND_BATCH: {
+				size_t pos = 1;
+				int count;
+				if (!read_frame_int(frame, pos, count) || count < 0) {
+					write_status_frame(comm_out, "Invalid parameters");
+					break;
+				}
+				/* Commands after a failed one are not executed */
+				const char *result = "Ok";
+				int i;
+				for (i = 0; i < count; i++) {
+					result = execute_binary_command(frame, pos);
+					if (strcmp(result, "Ok")) {
+						break;
+					}
+				}
+				if (i == count) {
+					write_status_frame(comm_out, "Ok");
+				} else {
+					char status[LINE_LENGTH_LIMIT];
+					snprintf(status, LINE_LENGTH_LIMIT, "Failed %i %s", i, result);
+					write_status_frame(comm_out, status);
+				}
+				break;
 			}
-			if (process_id < 0 || process_id >= process_count) {
-				fprintf(comm_out, "There is no such process\n");
-				continue;
+			default: {
+				size_t pos = 0;
+				write_status_frame(comm_out, execute_binary_command(frame, pos));
 			}
+		}
+	}
+}
 
-			if (!state->is_process_busy(process_id)) {
-				fprintf(comm_out, "There is no running transition on the given process\n");
-				continue;
-			}
+const char * Listener::execute_command(const char *line)
+{
+	if (check_prefix(line, "FIRE")) {
+		int transition_id;
+		int process_id;
+		int phases;
+		if (3 != sscanf(line, "FIRE %i %i %i", &transition_id, &process_id, &phases)) {
+			return "Invalid parameters";
+		}
+		return fire(transition_id, process_id, phases);
+	}
 
-			Activation *a = state->get_activations()[process_id];
-			if (a->transition_def->is_blocked(a->binding)) {
-				fprintf(comm_out, "Transition waits for synchronization of collective transition\n");
-				continue;
-			}
-			state->finish_transition(process_id);
-			write_status(comm_out, true);
-			continue;
+	if (check_prefix(line, "FINISH")) {
+		int process_id;
+		if (1 != sscanf(line, "FINISH %i", &process_id)) {
+			return "Invalid parameters";
 		}
+		return finish(process_id);
+	}
 
-		if (check_prefix(line, "RECEIVE") > 0) {
-			int process_id;
-			int origin_id;
-			if (2 != sscanf(line, "RECEIVE %i %i", &process_id, &origin_id)) {
-				fprintf(comm_out, "Invalid parameters\n");
-				continue;
-			}
-			bool result = state->receive(process_id, origin_id);
-			write_status(comm_out, result);
-			continue;
+	if (check_prefix(line, "RECEIVE") > 0) {
+		int process_id;
+		int origin_id;
+		if (2 != sscanf(line, "RECEIVE %i %i", &process_id, &origin_id)) {
+			return "Invalid parameters";
 		}
+		return receive(process_id, origin_id);
+	}
+
+	return "Unknown command";
+}
+
+const char * Listener::execute_binary_command(const std::vector<char> &frame, size_t &pos)
+{
+	if (pos >= frame.size()) {
+		return "Invalid parameters";
+	}
+	int command = frame[pos++];
+	int a, b, c;
+	switch (command) {
+		case COMMAND_FIRE:
+			if (!read_frame_int(frame, pos, a) ||
+				!read_frame_int(frame, pos, b) ||
+				!read_frame_int(frame, pos, c)) {
+				return "Invalid parameters";
+			}
+			return fire(a, b, c);
+		case COMMAND_FINISH:
+			if (!read_frame_int(frame, pos, a)) {
+				return "Invalid parameters";
+			}
+			return finish(a);
+		case COMMAND_RECEIVE:
+			if (!read_frame_int(frame, pos, a) || !read_frame_int(frame, pos, b)) {
+				return "Invalid parameters";
+			}
+			return receive(a, b);
+		default:
+			return "Unknown command";
+	}
+}
 
-		fprintf(comm_out, "Unknown command\n");
+const char * Listener::fire(int transition_id, int process_id, int phases)
+{
+	if (processes[0]->quit_flag) {
+		return "Process is terminated";
+	}
+	if (process_id < 0 || process_id >= process_count) {
+		return "There is no such process";
+	}
+	TransitionDef *transition_def = state->get_net_def()->get_transition_def(transition_id);
+	if (transition_def == NULL) {
+		return "Invalid transition";
+	}
+
+	bool result;
+	if (phases == 1) {
+		result = state->fire_transition_phase1(process_id, transition_def);
+	} else {
+		result = state->fire_transition_full(process_id, transition_def);
+	}
+	return status_string(result);
+}
+
+const char * Listener::finish(int process_id)
+{
+	if (processes[0]->quit_flag) {
+		return "Process is terminated";
+	}
+	if (process_id < 0 || process_id >= process_count) {
+		return "There is no such process";
 	}
+
+	if (!state->is_process_busy(process_id)) {
+		return "There is no running transition on the given process";
+	}
+
+	Activation *a = state->get_activations()[process_id];
+	if (a->transition_def->is_blocked(a->binding)) {
+		return "Transition waits for synchronization of collective transition";
+	}
+	state->finish_transition(process_id);
+	return status_string(true);
+}
+
+const char * Listener::receive(int process_id, int origin_id)
+{
+	bool result = state->receive(process_id, origin_id);
+	return status_string(result);
 }
 
 void Listener::prepare_state()
@@ -292,6 +498,118 @@ void Listener::prepare_state()
 		nets.push_back(processes[i]->get_net());
 	}
 	state = new State(processes[0]->get_net()->get_def(), nets);
+	reported = false;
+}
+
+void Listener::write_delta_reports(FILE *out, bool binary)
+{
+	char *buffer;
+	size_t size;
+
+	bool full = !reported;
+	if (full) {
+		reported_processes.assign(process_count, ProcessReport());
+		reported_activations.assign(process_count, std::string());
+		reported_packets.assign(process_count * process_count, std::string());
+	}
+
+	Output output(out, binary);
+	output.child("delta");
+	output.set("net-id", state->get_net_def()->get_id());
+	output.set("processes", process_count);
+	output.set("quit", state->get_quit_flag());
+	output.set("full", full);
+
+	for (int i = 0; i < process_count; i++) {
+		FILE *file = open_string_stream(&buffer, &size);
+		Output process_output(file, binary);
+		state->write_process_report(process_output, i);
+		std::vector<std::string> children;
+		output.split_children(close_string_stream(file, &buffer, &size), children);
+
+		ProcessReport report;
+		for (size_t t = 0; t < children.size(); t++) {
+			if (output.element_name(children[t]) == "place") {
+				report.places.push_back(children[t]);
+			} else {
+				report.enabled += children[t];
+			}
+		}
+
+		ProcessReport &last = reported_processes[i];
+		bool opened = false;
+		for (size_t t = 0; t < report.places.size(); t++) {
+			if (!full && t < last.places.size() && last.places[t] == report.places[t]) {
+				continue;
+			}
+			if (!opened) {
+				output.child("process");
+				output.set("id", i);
+				opened = true;
+			}
+			output.raw(report.places[t]);
+		}
+		if (full || last.enabled != report.enabled) {
+			if (!opened) {
+				output.child("process");
+				output.set("id", i);
+				opened = true;
+			}
+			output.child("enabled-list");
+			output.raw(report.enabled);
+			output.back();
+		}
+		if (opened) {
+			output.back();
+		}
+		last.places.swap(report.places);
+		last.enabled.swap(report.enabled);
+	}
+
+	for (int i = 0; i < process_count; i++) {
+		if (state->get_activations()[i] == NULL && reported_activations[i].empty()) {
+			continue;
+		}
+		FILE *file = open_string_stream(&buffer, &size);
+		Output activation_output(file, binary);
+		state->write_activation_report(activation_output, i);
+		std::string activation = close_string_stream(file, &buffer, &size);
+		if (activation == reported_activations[i] && !(full && !activation.empty())) {
+			continue;
+		}
+		if (activation.empty()) {
+			output.child("inactive");
+			output.set("process-id", i);
+			output.back();
+		} else {
+			output.raw(activation);
+		}
+		reported_activations[i].swap(activation);
+	}
+
+	for (int i = 0; i < process_count; i++) {
+		for (int j = 0; j < process_count; j++) {
+			std::string &last = reported_packets[i * process_count + j];
+			if (state->get_packets(i, j).empty() && last.empty()) {
+				continue;
+			}
+			FILE *file = open_string_stream(&buffer, &size);
+			Output packets_output(file, binary);
+			state->write_packets_report(packets_output, i, j);
+			std::string packets = close_string_stream(file, &buffer, &size);
+			if (packets == last && !(full && !packets.empty())) {
+				continue;
+			}
+			output.child("queue");
+			output.set("target-id", i);
+			output.set("origin-id", j);
+			output.raw(packets);
+			output.back();
+			last.swap(packets);
+		}
+	}
+	output.back();
+	reported = true;
 }
 
 void Listener::cleanup_state()
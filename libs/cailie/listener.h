@@ -11,10 +11,29 @@ namespace ca {
 
 class Process;
 
+/* Commands of the binary protocol; a command is its code followed by
+   its parameters as 32-bit big-endian integers */
+enum BinaryCommand {
+	COMMAND_QUIT = 1,
+	COMMAND_DETACH = 2,
+	COMMAND_REPORTS = 3,
+	COMMAND_DELTA_REPORTS = 4,
+	COMMAND_FIRE = 5, // transition_id process_id phases
+	COMMAND_FINISH = 6, // process_id
+	COMMAND_RECEIVE = 7, // process_id origin_id
+	COMMAND_BATCH = 8 // count, followed by "count" commands
+};
+
+/* The first byte of a frame sent by the binary protocol */
+enum BinaryFrame {
+	FRAME_STATUS = 'S',
+	FRAME_REPORT = 'R'
+};
+
 class Listener {
 	public:
 		Listener() : process_count(0), processes(NULL), listen_socket(0),
-			thread(0), start_barrier(NULL), state(NULL){}
+			thread(0), start_barrier(NULL), state(NULL), reported(false) {}
 		~Listener() {
 			cleanup_state();
 		}
@@ -25,6 +44,9 @@ class Listener {
 		void start();
 		void main();
 		void process_commands(FILE *comm_in, FILE *comm_out);
+		void process_binary_commands(FILE *comm_in, FILE *comm_out);
+		const char * execute_command(const char *line);
+		const char * execute_binary_command(const std::vector<char> &frame, size_t &pos);
 
 		void set_processes(int process_count, Process **processes) {
 			this->process_count = process_count;
@@ -39,6 +61,15 @@ class Listener {
 
 		void prepare_state();
 		void cleanup_state();
+		void write_delta_reports(FILE *out, bool binary = false);
+		const char * fire(int transition_id, int process_id, int phases);
+		const char * finish(int process_id);
+		const char * receive(int process_id, int origin_id);
+
+		struct ProcessReport {
+			std::vector<std::string> places;
+			std::string enabled;
+		};
 
 		int process_count;
 		Process **processes;
@@ -47,6 +78,13 @@ class Listener {
 		pthread_barrier_t *start_barrier;
 		State *state;
 		std::vector<std::string> sequence;
+
+		/* Parts of the last report, delta reports contain only parts
+		   that differ from them */
+		bool reported;
+		std::vector<ProcessReport> reported_processes;
+		std::vector<std::string> reported_activations;
+		std::vector<std::string> reported_packets;
 };
 
 }
@@ -1,16 +1,70 @@
 
 #include "output.h"
 #include <stdio.h>
+#include <string.h>
+#include <limits.h>
 #include <assert.h>
 
 using namespace ca;
 
-Output::Output(FILE *file) : file(file), open_tag(false)
+/* Names that are written as one byte in the binary form,
+   the table has to be the same as BINARY_NAMES in gui/process.py */
+static const char *binary_names[] = {
+	"report", "delta", "process", "place", "token", "value", "source",
+	"id", "enabled", "enabled-list", "activation", "inactive",
+	"process-id", "binding", "transition-id", "blocked", "packet",
+	"origin-id", "target-id", "size", "edge-id", "queue", "net-id",
+	"processes", "quit", "full", NULL
+};
+
+Output::Output(FILE *file, bool binary) : file(file), binary(binary), open_tag(false)
+{
+}
+
+void Output::write_code(char code)
+{
+	fputc(code, file);
+}
+
+void Output::write_int(int32_t i)
+{
+	uint32_t v = i;
+	fputc(v >> 24, file);
+	fputc((v >> 16) & 0xff, file);
+	fputc((v >> 8) & 0xff, file);
+	fputc(v & 0xff, file);
+}
+
+void Output::write_string(const std::string &s)
+{
+	if (s.size() < 255) {
+		fputc(s.size(), file);
+	} else {
+		fputc(255, file);
+		write_int(s.size());
+	}
+	fwrite(s.data(), 1, s.size(), file);
+}
+
+void Output::write_name(const std::string &name)
 {
+	for (int i = 0; binary_names[i] != NULL; i++) {
+		if (name == binary_names[i]) {
+			fputc(i + 1, file);
+			return;
+		}
+	}
+	fputc(0, file);
+	write_string(name);
 }
 
 void Output::child(const std::string & name)
 {
+	if (binary) {
+		write_code(OUTPUT_CHILD);
+		write_name(name);
+		return;
+	}
 	if (open_tag) {
 		fprintf(file, ">");
 	}
@@ -21,6 +75,10 @@ void Output::child(const std::string & name)
 
 void Output::back()
 {
+	if (binary) {
+		write_code(OUTPUT_BACK);
+		return;
+	}
 	if (open_tag) {
 		open_tag = false;
 		fprintf(file, " />");
@@ -50,6 +108,13 @@ static void sanitize_string(std::string &s)
 void Output::set(const std::string & name, const std::string & value)
 {
 	std::string v = value;
+	if (binary) {
+		find_and_replace(v, '\n', "\\n");
+		find_and_replace(v, '\t', "\\t");
+		find_and_replace(v, '\r', "\\r");
+		_set(name, v);
+		return;
+	}
 	sanitize_string(v);
 	find_and_replace(v, '\n', "\\n");
 	find_and_replace(v, '\t', "\\t");
@@ -60,6 +125,11 @@ void Output::set(const std::string & name, const std::string & value)
 
 void Output::text(const std::string &text)
 {
+	if (binary) {
+		write_code(OUTPUT_TEXT);
+		write_string(text);
+		return;
+	}
 	if (open_tag) {
 		fprintf(file, ">");
 		open_tag = false;
@@ -71,6 +141,12 @@ void Output::text(const std::string &text)
 
 void Output::_set(const std::string & name, const std::string & value)
 {
+	if (binary) {
+		write_code(OUTPUT_STRING);
+		write_name(name);
+		write_string(value);
+		return;
+	}
 	fprintf(file, " %s='%s'", name.c_str(), value.c_str());
 }
 
@@ -85,15 +161,155 @@ void Output::set(const std::string & name, const bool value)
 
 void Output::set(const std::string & name, const int value)
 {
+	if (binary) {
+		write_code(OUTPUT_INT);
+		write_name(name);
+		write_int(value);
+		return;
+	}
 	fprintf(file, " %s='%i'", name.c_str(), value);
 }
 
 void Output::set(const std::string & name, void *p)
 {
+	if (binary) {
+		char s[32];
+		snprintf(s, sizeof(s), "%p", p);
+		_set(name, s);
+		return;
+	}
 	fprintf(file, " %s='%p'", name.c_str(), p);
 }
 
 void Output::set(const std::string & name, const size_t value)
 {
+	if (binary) {
+		if (value <= INT_MAX) {
+			set(name, (int) value);
+		} else {
+			char s[32];
+			snprintf(s, sizeof(s), "%llu", (unsigned long long) value);
+			_set(name, s);
+		}
+		return;
+	}
 	fprintf(file, " %s='%llu'", name.c_str(), (unsigned long long) value);
 }
+
+void Output::raw(const std::string &data)
+{
+	if (open_tag) {
+		fprintf(file, ">");
+		open_tag = false;
+	}
+	fwrite(data.data(), 1, data.size(), file);
+}
+
+static size_t read_binary_int(const std::string &data, size_t pos)
+{
+	return ((unsigned char) data[pos] << 24) |
+		((unsigned char) data[pos + 1] << 16) |
+		((unsigned char) data[pos + 2] << 8) |
+		(unsigned char) data[pos + 3];
+}
+
+/* Returns the position after a string that starts at pos */
+static size_t skip_binary_string(const std::string &data, size_t pos)
+{
+	size_t size = (unsigned char) data[pos];
+	if (size < 255) {
+		return pos + 1 + size;
+	}
+	return pos + 5 + read_binary_int(data, pos + 1);
+}
+
+/* Returns the position after a name that starts at pos */
+static size_t skip_binary_name(const std::string &data, size_t pos)
+{
+	if (data[pos] != 0) {
+		return pos + 1;
+	}
+	return skip_binary_string(data, pos + 1);
+}
+
+std::string Output::element_name(const std::string &element) const
+{
+	if (binary) {
+		int index = (unsigned char) element[1];
+		if (index != 0) {
+			return binary_names[index - 1];
+		}
+		size_t end = skip_binary_string(element, 2);
+		size_t size = (unsigned char) element[2];
+		if (size < 255) {
+			return element.substr(3, size);
+		}
+		return element.substr(7, end - 7);
+	}
+	size_t end = element.find_first_of(" />", 1);
+	return element.substr(1, end - 1);
+}
+
+/* Output escapes '<' and '>' in values, so they occur only in tags
+   of the XML form */
+void Output::split_children(const std::string &element,
+	std::vector<std::string> &children) const
+{
+	int depth = 0;
+	size_t start = 0;
+	if (binary) {
+		size_t pos = 0;
+		while (pos < element.size()) {
+			switch (element[pos]) {
+				case OUTPUT_CHILD:
+					if (depth == 1) {
+						start = pos;
+					}
+					depth++;
+					pos = skip_binary_name(element, pos + 1);
+					break;
+				case OUTPUT_BACK:
+					depth--;
+					pos++;
+					if (depth == 1) {
+						children.push_back(element.substr(start, pos - start));
+					}
+					break;
+				case OUTPUT_STRING:
+					pos = skip_binary_name(element, pos + 1);
+					pos = skip_binary_string(element, pos);
+					break;
+				case OUTPUT_INT:
+					pos = skip_binary_name(element, pos + 1) + 4;
+					break;
+				case OUTPUT_TEXT:
+					pos = skip_binary_string(element, pos + 1);
+					break;
+				default:
+					assert(0);
+			}
+		}
+		return;
+	}
+
+	size_t pos = element.find('<');
+	while (pos != std::string::npos) {
+		size_t end = element.find('>', pos);
+		if (element[pos + 1] == '/') {
+			depth--;
+			if (depth == 1) {
+				children.push_back(element.substr(start, end + 1 - start));
+			}
+		} else if (element[end - 1] == '/') {
+			if (depth == 1) {
+				children.push_back(element.substr(pos, end + 1 - pos));
+			}
+		} else {
+			if (depth == 1) {
+				start = pos;
+			}
+			depth++;
+		}
+		pos = element.find('<', end + 1);
+	}
+}
@@ -10,9 +10,27 @@
 
 namespace ca {
 
+/* Codes of the binary form of Output (see Output::Output) */
+enum OutputCode {
+	OUTPUT_CHILD = 1,
+	OUTPUT_BACK = 2,
+	OUTPUT_STRING = 3,
+	OUTPUT_INT = 4,
+	OUTPUT_TEXT = 5
+};
+
 class Output {
 	public:
-		Output(FILE *file);
+		/* When binary is true, elements are written in a compact binary
+		   form instead of XML. Every element starts by OUTPUT_CHILD and
+		   a name and ends by OUTPUT_BACK, attributes are OUTPUT_STRING
+		   or OUTPUT_INT followed by a name and a value, text is OUTPUT_TEXT
+		   followed by a string. A name is a byte with an index into
+		   the table of common names (starting from 1) or 0 followed by
+		   a string. A string is its length (a byte, or 255 and a 32-bit
+		   big-endian length) followed by its characters and an integer
+		   is a 32-bit big-endian number. */
+		Output(FILE *file, bool binary = false);
 
 		void child(const std::string &name);
 		void back();
@@ -27,9 +45,28 @@ class Output {
 
 		void text(const std::string &text);
 
+		/* Writes data that were written by another Output
+		   of the same form as a content of the current element */
+		void raw(const std::string &data);
+
+		bool is_binary() const {
+			return binary;
+		}
+
+		/* Functions for elements that were written by an Output
+		   of the same form */
+		std::string element_name(const std::string &element) const;
+		void split_children(const std::string &element,
+			std::vector<std::string> &children) const;
+
 	protected:
 		void _set(const std::string &name, const std::string &s);
+		void write_code(char code);
+		void write_name(const std::string &name);
+		void write_string(const std::string &s);
+		void write_int(int32_t i);
 		FILE *file;
+		bool binary;
 		std::stack<std::string> stack;
 		bool open_tag;
 };
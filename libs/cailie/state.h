@@ -257,68 +257,80 @@ namespace ca {
 					return &packets[i];
 			}
 
-			void write_reports(FILE *out) {
-				Output output(out);
+			void write_reports(FILE *out, bool binary = false) {
+				Output output(out, binary);
 				output.child("report");
 				output.set("net-id", net_def->get_id());
 				output.set("processes", ca::process_count);
 				output.set("quit", quit);
 
 				for (int i = 0; i < process_count; i++) {
-					output.child("process");
-					StateThread thread(this, i);
-					nets[i]->write_reports(&thread, output);
-
-					if (!is_process_busy(i)) {
-						const std::vector<TransitionDef*>& transitions = \
-							net_def->get_transition_defs();
-						bool enabled = false;
-						for (size_t t = 0; t < transitions.size(); t++) {
-							if (enabled && transitions[t - 1]->get_priority() !=
-									transitions[t]->get_priority()) {
-								break;
-							}
-							if (transitions[t]->is_enable(&thread, nets[i])) {
-								enabled = true;
-								output.child("enabled");
-								output.set("id", transitions[t]->get_id());
-								output.back();
-							}
-						}
-					}
-					output.back();
+					write_process_report(output, i);
 				}
 
 				for (int i = 0; i < process_count; i++) {
-					if (activations[i] == NULL) {
-						continue;
-					}
-					output.child("activation");
-					output.set("process-id", i);
-					output.set("binding", activations[i]->binding);
-					output.set("transition-id", activations[i]->transition_def->get_id());
-					Binding *binding = activations[i]->binding;
-					output.set("blocked", activations[i]->transition_def->is_blocked(binding));
-					output.back();
+					write_activation_report(output, i);
 				}
 
 				for (int i = 0; i < ca::process_count; i++) {
 					for (int j = 0; j < ca::process_count; j++) {
-						PacketQueue& pq = packets[i * ca::process_count + j];
-						typename PacketQueue::iterator it;
-						for (it = pq.begin(); it != pq.end(); it++) {
-							output.child("packet");
-							output.set("origin-id", j);
-							output.set("target-id", i);
-							output.set("size", it->size);
-							Tokens *tokens = (Tokens*) it->data;
-							output.set("edge-id", tokens->edge_id);
+						write_packets_report(output, i, j);
+					}
+				}
+				output.back();
+
+			}
+
+			void write_process_report(Output &output, int process_id) {
+				output.child("process");
+				StateThread thread(this, process_id);
+				nets[process_id]->write_reports(&thread, output);
+
+				if (!is_process_busy(process_id)) {
+					const std::vector<TransitionDef*>& transitions = \
+						net_def->get_transition_defs();
+					bool enabled = false;
+					for (size_t t = 0; t < transitions.size(); t++) {
+						if (enabled && transitions[t - 1]->get_priority() !=
+								transitions[t]->get_priority()) {
+							break;
+						}
+						if (transitions[t]->is_enable(&thread, nets[process_id])) {
+							enabled = true;
+							output.child("enabled");
+							output.set("id", transitions[t]->get_id());
 							output.back();
 						}
 					}
 				}
 				output.back();
+			}
 
+			void write_activation_report(Output &output, int process_id) {
+				if (activations[process_id] == NULL) {
+					return;
+				}
+				output.child("activation");
+				output.set("process-id", process_id);
+				output.set("binding", activations[process_id]->binding);
+				output.set("transition-id", activations[process_id]->transition_def->get_id());
+				Binding *binding = activations[process_id]->binding;
+				output.set("blocked", activations[process_id]->transition_def->is_blocked(binding));
+				output.back();
+			}
+
+			void write_packets_report(Output &output, int target_id, int origin_id) {
+				PacketQueue& pq = packets[target_id * ca::process_count + origin_id];
+				typename PacketQueue::iterator it;
+				for (it = pq.begin(); it != pq.end(); it++) {
+					output.child("packet");
+					output.set("origin-id", origin_id);
+					output.set("target-id", target_id);
+					output.set("size", it->size);
+					Tokens *tokens = (Tokens*) it->data;
+					output.set("edge-id", tokens->edge_id);
+					output.back();
+				}
 			}
 
 			bool fire_transition_phase1(int process_id, TransitionDef *transition_def)
@@ -337,7 +349,7 @@ namespace ca {
 				return true;
 			}
 
-			bool fire_transition_full(int process_id, TransitionDef *transition_def)
+			virtual bool fire_transition_full(int process_id, TransitionDef *transition_def)
 			{
 				if (!transition_def->is_collective()) {
 					StateThread thread(this, process_id);
@@ -363,8 +375,8 @@ namespace ca {
 				}
 			}
 
-			bool fire_transition_full_with_binding(int process_id, TransitionDef *transition_def,
-					ca::Packer &packer)
+			virtual bool fire_transition_full_with_binding(int process_id,
+					TransitionDef *transition_def, ca::Packer &packer)
 			{
 				StateThread thread(this, process_id);
 				return transition_def->full_fire_with_binding(&thread, nets[process_id], packer);
@@ -411,7 +423,7 @@ namespace ca {
 			virtual void packet_preprocess(
 				int origin_id, int target_id, PacketT &packet, size_t fake_size) {}
 
-			bool receive(int process_id, int origin_id, bool free_data=true) {
+			virtual bool receive(int process_id, int origin_id, bool free_data=true) {
 				PacketQueue &pq = packets[process_id * ca::process_count + origin_id];
 				if (pq.empty()) {
 					return false;
@@ -17,13 +17,18 @@ bool cfg::analyse_cycle = false;
 bool cfg::partial_order_reduction = true;
 bool cfg::silent = false;
 bool cfg::debug = false;
+int cfg::threads = 1;
+bool cfg::hash_only_states = false;
+bool cfg::hash_cache = true;
+std::string cfg::disk_store;
+std::vector<std::pair<int, int> > cfg::symmetries;
 std::string cfg::project_name;
 
 struct CmpByDistance
 {
 	bool operator()(Node *a, Node *b) const
 	{
-		return a->get_distance() < b->get_distance();
+		return is_closer(a, b);
 	}
 };
 
@@ -59,6 +64,43 @@ static void args_callback(char c, char *optarg, void *data)
 			cfg::partial_order_reduction = false;
 			return;
 		}
+		if (!strncmp(optarg, "threads=", 8)) {
+			cfg::threads = atoi(optarg + 8);
+			if (cfg::threads < 1) {
+				fprintf(stderr, "Invalid number of threads\n");
+				exit(1);
+			}
+			return;
+		}
+		if (!strncmp(optarg, "disk-store=", 11)) {
+			// States of unexpanded nodes are not stored, only nodes are kept in the store
+			cfg::disk_store = optarg + 11;
+			cfg::hash_only_states = true;
+			return;
+		}
+		if (!strncmp(optarg, "symmetry=", 9)) {
+			int first, last;
+			if (sscanf(optarg + 9, "%i-%i", &first, &last) != 2 || first < 0 || first > last) {
+				fprintf(stderr, "Invalid range of symmetric processes\n");
+				exit(1);
+			}
+			for (size_t i = 0; i < cfg::symmetries.size(); i++) {
+				if (first <= cfg::symmetries[i].second && cfg::symmetries[i].first <= last) {
+					fprintf(stderr, "Ranges of symmetric processes overlap\n");
+					exit(1);
+				}
+			}
+			cfg::symmetries.push_back(std::pair<int, int>(first, last));
+			return;
+		}
+		if (!strcmp(optarg, "disable-hash-cache")) {
+			cfg::hash_cache = false;
+			return;
+		}
+		if (!strcmp(optarg, "hash-only")) {
+			cfg::hash_only_states = true;
+			return;
+		}
 		if (!strcmp(optarg, "silent")) {
 			cfg::silent = true;
 			return;
@@ -87,15 +129,15 @@ void Core::run_analysis_final_nodes(ca::Output &report)
 	Node* deadlock_node = NULL;
 	NodeMap final_markings(100, HashDigestHash(MHASH_MD5), HashDigestEq(MHASH_MD5));
 
-	NodeMap::const_iterator it;
+	NodeIndex::const_iterator it;
 	for (it = nodes.begin(); it != nodes.end(); it++)
 	{
-		Node *node = it->second;
+		Node *node = *it;
 		if (node->get_nexts().size() == 0) {
 			if (cfg::analyse_final_marking) {
 				NodeMap::const_iterator n = final_markings.find(node->get_final_marking());
 				if (n != final_markings.end()) {
-					if (n->second->get_distance() > node->get_distance()) {
+					if (is_closer(node, n->second)) {
 						final_markings[node->get_final_marking()] = node;
 					}
 				} else {
@@ -105,8 +147,7 @@ void Core::run_analysis_final_nodes(ca::Output &report)
 			if (cfg::analyse_deadlock) {
 				if (!node->get_quit_flag()) {
 					deadlocks++;
-					if (deadlock_node == NULL ||
-						deadlock_node->get_distance() > node->get_distance()) {
+					if (deadlock_node == NULL || is_closer(node, deadlock_node)) {
 						deadlock_node = node;
 					}
 				}
@@ -205,7 +246,7 @@ void Core::run_analysis_transition_occurrence(ca::Output &report)
 		node = node_queue.front();
 		node_queue.pop();
 		current = (ParikhVector*)(node->get_data());
-		const std::vector<NextNodeInfo> &nexts_nodes = node->get_nexts();
+		NextNodes nexts_nodes = node->get_nexts();
 		for (size_t i = 0; i < nexts_nodes.size(); i++) {
 			next = new ParikhVector(*current);
 			if (nexts_nodes[i].action == ActionFire) {
@@ -239,34 +280,44 @@ void Core::run_analysis_transition_occurrence(ca::Output &report)
 		}
 	}
 
-	NodeMap::const_iterator it;
-	current = NULL;
-	Node *current_node = NULL;
+	NodeIndex::const_iterator it;
+	if (error_node == NULL) {
+		Node *reference = NULL;
+		for (it = nodes.begin(); it != nodes.end(); it++) {
+			Node *node = *it;
+			if (node->get_data() != NULL && node->get_quit_flag() &&
+				(reference == NULL || is_closer(node, reference))) {
+				reference = node;
+			}
+		}
+		Node *witness = NULL;
+		if (reference != NULL) {
+			current = (ParikhVector*) reference->get_data();
+			for (it = nodes.begin(); it != nodes.end(); it++) {
+				Node *node = *it;
+				ParikhVector *v = (ParikhVector*) node->get_data();
+				if (v != NULL && node->get_quit_flag() && *current != *v &&
+					(witness == NULL || is_closer(node, witness))) {
+					witness = node;
+				}
+			}
+		}
+		if (witness != NULL) {
+			error_node = reference;
+			error_node2.push_back(witness);
+		}
+	}
+
 	for (it = nodes.begin(); it != nodes.end(); it++)
 	{
-		Node *node = it->second;
+		Node *node = *it;
 		ParikhVector *v = (ParikhVector*) node->get_data();
 		if (v != NULL) {
-			if (node->get_quit_flag() && error_node == NULL) {
-				if (current == NULL) {
-					current_node = node;
-					current = v;
-					continue;
-				}
-				if (*current != *v) {
-					error_node = current_node;
-					error_node2.push_back(node);
-				}
-			}
 			delete v;
 			node->set_data(NULL);
 		}
 	}
 
-	if (current) {
-		delete current;
-	}
-
 	report.child("analysis");
 	report.set("name", "Analysis of characteristic vectors");
 
@@ -298,7 +349,7 @@ void Core::run_analysis_cycle(ca::Output &report)
 	while (!stack.empty()) {
 		Node *n = stack.top();
 		int tag = n->get_tag();
-		const std::vector<NextNodeInfo> &nexts = n->get_nexts();
+		NextNodes nexts = n->get_nexts();
 		if (tag == static_cast<int>(nexts.size())) {
 			n->set_tag(-2);
 			stack.pop();
@@ -354,11 +405,11 @@ void Core::write_dot_file(const std::string &filename)
 	FILE *f = fopen(filename.c_str(), "w");
 	char *hashstr = (char*) alloca(mhash_get_block_size(MHASH_MD5) * 2 + 1);
 	fprintf(f, "digraph X {\n");
-	NodeMap::const_iterator it;
+	NodeIndex::const_iterator it;
 	for (it = nodes.begin(); it != nodes.end(); it++)
 	{
-		Node *node = it->second;
-		const std::vector<NextNodeInfo> &nexts = node->get_nexts();
+		Node *node = *it;
+		NextNodes nexts = node->get_nexts();
 		hashdigest_to_string(MHASH_MD5, node->get_hash(), hashstr);
 		hashstr[5] = 0; // Take just prefix
 		const char *quit_flag;
@@ -436,11 +487,11 @@ void Core::write_xml_statespace(ca::Output &report)
 {
 	char *hashstr = (char*) alloca(mhash_get_block_size(MHASH_MD5) * 2 + 1);
 	report.child("statespace");
-	NodeMap::const_iterator it;
+	NodeIndex::const_iterator it;
 	for (it = nodes.begin(); it != nodes.end(); it++)
 	{
 		report.child("state");
-		Node *node = it->second;
+		Node *node = *it;
 		hashdigest_to_string(MHASH_MD5, node->get_hash(), hashstr);
 		report.set("hash", hashstr);
 		if (initial_node == node) {
@@ -450,7 +501,7 @@ void Core::write_xml_statespace(ca::Output &report)
 			report.set("quit", true);
 		}
 
-		const std::vector<NextNodeInfo> &nexts = node->get_nexts();
+		NextNodes nexts = node->get_nexts();
 		for (size_t i = 0; i < nexts.size(); i++) {
 			report.child("child");
 			hashdigest_to_string(MHASH_MD5, nexts[i].node->get_hash(), hashstr);
@@ -0,0 +1,119 @@
+#include "diskstore.h"
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+#include <sys/mman.h>
+
+using namespace cass;
+
+static const size_t SEGMENT_SIZE = 64 * 1024 * 1024;
+static const uint32_t BLOOM_BITS = 1 << 30;
+static const size_t BLOOM_HASHES = 4;
+
+DiskStore::DiskStore(const std::string &directory, size_t digest_size)
+	: directory(directory), digest_size(digest_size), position(NULL), available(0)
+{
+	if (digest_size < BLOOM_HASHES * sizeof(uint32_t)) {
+		fprintf(stderr, "Digest is too short for the disk store\n");
+		exit(1);
+	}
+	pthread_mutex_init(&lock, NULL);
+	void *mem = mmap(NULL, BLOOM_BITS / 8, PROT_READ | PROT_WRITE,
+	                 MAP_PRIVATE | MAP_ANONYMOUS | MAP_NORESERVE, -1, 0);
+	if (mem == MAP_FAILED) {
+		perror("DiskStore");
+		exit(1);
+	}
+	bloom = static_cast<uint64_t*>(mem);
+}
+
+DiskStore::~DiskStore()
+{
+	for (size_t i = 0; i < segments.size(); i++) {
+		munmap(segments[i], SEGMENT_SIZE);
+	}
+	munmap(bloom, BLOOM_BITS / 8);
+	pthread_mutex_destroy(&lock);
+}
+
+void * DiskStore::map(size_t size)
+{
+	std::string filename = directory + "/caverif-XXXXXX";
+	std::vector<char> path(filename.begin(), filename.end());
+	path.push_back(0);
+	int fd = mkstemp(&path[0]);
+	if (fd == -1) {
+		perror(filename.c_str());
+		exit(1);
+	}
+	// The file is removed at once, its space is released when the mapping is closed
+	unlink(&path[0]);
+	if (ftruncate(fd, size)) {
+		perror(&path[0]);
+		exit(1);
+	}
+	void *mem = mmap(NULL, size, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+	close(fd);
+	if (mem == MAP_FAILED) {
+		perror(&path[0]);
+		exit(1);
+	}
+	return mem;
+}
+
+void DiskStore::unmap(void *mem, size_t size)
+{
+	munmap(mem, size);
+}
+
+void DiskStore::new_segment()
+{
+	position = static_cast<char*>(map(SEGMENT_SIZE));
+	available = SEGMENT_SIZE;
+	segments.push_back(position);
+}
+
+void * DiskStore::allocate(size_t size)
+{
+	size = (size + 7) & ~static_cast<size_t>(7);
+	pthread_mutex_lock(&lock);
+	if (size > available) {
+		new_segment();
+	}
+	void *mem = position;
+	position += size;
+	available -= size;
+	pthread_mutex_unlock(&lock);
+	return mem;
+}
+
+void * DiskStore::copy_digest(const void *digest)
+{
+	void *mem = allocate(digest_size);
+	memcpy(mem, digest, digest_size);
+	return mem;
+}
+
+bool DiskStore::may_contain(const void *digest) const
+{
+	uint32_t words[BLOOM_HASHES];
+	memcpy(words, digest, sizeof(words));
+	for (size_t i = 0; i < BLOOM_HASHES; i++) {
+		uint32_t bit = words[i] & (BLOOM_BITS - 1);
+		if (!(bloom[bit / 64] & (static_cast<uint64_t>(1) << (bit % 64)))) {
+			return false;
+		}
+	}
+	return true;
+}
+
+void DiskStore::add(const void *digest)
+{
+	uint32_t words[BLOOM_HASHES];
+	memcpy(words, digest, sizeof(words));
+	for (size_t i = 0; i < BLOOM_HASHES; i++) {
+		uint32_t bit = words[i] & (BLOOM_BITS - 1);
+		__sync_fetch_and_or(&bloom[bit / 64], static_cast<uint64_t>(1) << (bit % 64));
+	}
+}
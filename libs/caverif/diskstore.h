@@ -0,0 +1,45 @@
+#ifndef CAVERIF_DISKSTORE_H
+#define CAVERIF_DISKSTORE_H
+
+#include <string>
+#include <vector>
+#include <pthread.h>
+#include <stdint.h>
+
+namespace cass {
+
+	/* Memory placed in memory-mapped files, so the kernel can write pages
+	   of the state space out to disk instead of running out of memory.
+	   Small objects (nodes, digests, successor lists) are allocated
+	   from segments, large tables get their own mapping.
+	   The Bloom filter answers most membership checks of new states
+	   without touching the mapped pages. */
+	class DiskStore
+	{
+		public:
+			DiskStore(const std::string &directory, size_t digest_size);
+			~DiskStore();
+
+			void * allocate(size_t size);
+			void * copy_digest(const void *digest);
+			void * map(size_t size);
+			static void unmap(void *mem, size_t size);
+
+			bool may_contain(const void *digest) const;
+			void add(const void *digest);
+
+		protected:
+			void new_segment();
+
+			std::string directory;
+			size_t digest_size;
+			std::vector<char*> segments;
+			char *position;
+			size_t available;
+			pthread_mutex_t lock;
+			uint64_t *bloom;
+	};
+
+}
+
+#endif // CAVERIF_DISKSTORE_H
@@ -6,6 +6,8 @@
 #include <queue>
 #include <algorithm>
 #include <alloca.h>
+#include <sched.h>
+#include <new>
 
 namespace ca {
 	extern ca::NetDef **defs;
@@ -14,6 +16,29 @@ namespace ca {
 
 using namespace cass;
 
+static const size_t SHARDS_COUNT = 256;
+
+struct WorkerArgs {
+	Core *core;
+	int id;
+};
+
+static void * run_worker(void *data)
+{
+	WorkerArgs *args = static_cast<WorkerArgs*>(data);
+	args->core->generate_worker(args->id);
+	return NULL;
+}
+
+bool cass::is_closer(const Node *node1, const Node *node2)
+{
+	// Ties are broken by hashes, so the choice does not depend on the order of generation
+	if (node1->get_distance() != node2->get_distance()) {
+		return node1->get_distance() < node2->get_distance();
+	}
+	return memcmp(node1->get_hash(), node2->get_hash(), mhash_get_block_size(MHASH_MD5)) < 0;
+}
+
 void State::pack_state(ca::Packer &packer)
 {
 	pack_activations(packer);
@@ -52,36 +77,214 @@ void State::pack_activations(ca::Packer &packer)
 	}
 }
 
-void State::hash_activations(MHASH hash_thread)
+static void finish_sub_digest(MHASH hash_thread, SubDigest &digest)
+{
+	void *hash = mhash_end(hash_thread);
+	memcpy(digest.bytes, hash, sizeof(digest.bytes));
+	free(hash);
+}
+
+static MHASH init_sub_digest()
+{
+	MHASH hash_thread = mhash_init(MHASH_MD5);
+	if (hash_thread == MHASH_FAILED) {
+		fprintf(stderr, "Hash failed\n");
+		exit(1);
+	}
+	return hash_thread;
+}
+
+void State::touch_process(int process_id)
+{
+	dirty_processes[process_id] = true;
+	// Packets sent by the process
+	for (int t = 0; t < ca::process_count; t++) {
+		dirty_queues.push_back(t * ca::process_count + process_id);
+	}
+}
+
+void State::touch_transition(int process_id, ca::TransitionDef *transition_def)
+{
+	if (transition_def->is_collective()) {
+		// A collective transition may finish in all processes
+		all_dirty = true;
+	} else {
+		touch_process(process_id);
+	}
+}
+
+bool State::fire_transition_full(int process_id, ca::TransitionDef *transition_def)
+{
+	touch_transition(process_id, transition_def);
+	return StateBase::fire_transition_full(process_id, transition_def);
+}
+
+bool State::fire_transition_full_with_binding(
+	int process_id, ca::TransitionDef *transition_def, ca::Packer &packer)
+{
+	touch_transition(process_id, transition_def);
+	return StateBase::fire_transition_full_with_binding(process_id, transition_def, packer);
+}
+
+bool State::receive(int process_id, int origin_id, bool free_data)
+{
+	dirty_processes[process_id] = true;
+	dirty_queues.push_back(process_id * ca::process_count + origin_id);
+	return StateBase::receive(process_id, origin_id, free_data);
+}
+
+void State::hash_process(int process_id, ca::Packer &packer, SubDigest &digest)
+{
+	MHASH hash_thread = init_sub_digest();
+	Activation *a = activations[process_id];
+	int id = a == NULL ? -1 : a->transition_def->get_id();
+	mhash(hash_thread, &id, sizeof(int));
+	if (a != NULL) {
+		mhash(hash_thread, a->packed_binding, a->packed_binding_size);
+	}
+	packer.reset();
+	nets[process_id]->pack(packer);
+	mhash(hash_thread, packer.get_buffer(), packer.get_size());
+	finish_sub_digest(hash_thread, digest);
+}
+
+void State::hash_queue(int queue_id, SubDigest &digest)
 {
-	size_t size = get_activate_process_count();
+	MHASH hash_thread = init_sub_digest();
+	PacketQueue &queue = packets[queue_id];
+	size_t size = queue.size();
 	mhash(hash_thread, &size, sizeof(size_t));
-	Activation *a;
-	for (int i = 0; i < ca::process_count; i++) {
-		if (activations[i] == NULL) {
-			continue;
+	for (size_t p = 0; p < queue.size(); p++) {
+		mhash(hash_thread, &queue[p].size, sizeof(queue[p].size));
+		mhash(hash_thread, queue[p].data, queue[p].size);
+	}
+	finish_sub_digest(hash_thread, digest);
+}
+
+void State::update_digests()
+{
+	if (all_dirty || !cfg::hash_cache) {
+		dirty_processes.assign(ca::process_count, true);
+		dirty_queues.clear();
+		queue_digests.clear();
+		for (int pq = 0; pq < ca::process_count * ca::process_count; pq++) {
+			if (!packets[pq].empty()) {
+				hash_queue(pq, queue_digests[pq]);
+			}
+		}
+		all_dirty = false;
+	}
+
+	for (size_t i = 0; i < dirty_queues.size(); i++) {
+		int pq = dirty_queues[i];
+		if (packets[pq].empty()) {
+			queue_digests.erase(pq);
+		} else {
+			hash_queue(pq, queue_digests[pq]);
+		}
+	}
+	dirty_queues.clear();
+
+	ca::Packer packer;
+	for (int p = 0; p < ca::process_count; p++) {
+		if (dirty_processes[p]) {
+			hash_process(p, packer, process_digests[p]);
+			dirty_processes[p] = false;
 		}
-		a = activations[i];
-		int id = a->transition_def->get_id();
-		mhash(hash_thread, &id, sizeof(int));
-		mhash(hash_thread, &i, sizeof(int));
-		mhash(hash_thread, a->packed_binding, a->packed_binding_size);
 	}
+	packer.free();
 }
 
-void State::hash_packets(MHASH hash_thread)
+// Compares cached digests with digests computed from the whole state
+void State::check_digests()
 {
-	for (int pq = 0; pq < ca::process_count * ca::process_count; pq++)
-	{
-		size_t size = packets[pq].size();
-		mhash(hash_thread, &size, sizeof(size_t));
-		for (size_t p = 0; p < packets[pq].size(); p++) {
-			mhash(hash_thread, &packets[pq][p].size, sizeof(packets[pq][p].size));
-			mhash(hash_thread, packets[pq][p].data, packets[pq][p].size);
+	ca::Packer packer;
+	SubDigest digest;
+	for (int p = 0; p < ca::process_count; p++) {
+		hash_process(p, packer, digest);
+		if (memcmp(digest.bytes, process_digests[p].bytes, sizeof(SubDigest))) {
+			fprintf(stderr, "Cached digest of process %i is not valid\n", p);
+			abort();
+		}
+	}
+	packer.free();
+	for (int pq = 0; pq < ca::process_count * ca::process_count; pq++) {
+		std::map<int, SubDigest>::const_iterator it = queue_digests.find(pq);
+		bool valid;
+		if (packets[pq].empty()) {
+			valid = it == queue_digests.end();
+		} else {
+			hash_queue(pq, digest);
+			valid = it != queue_digests.end() &&
+				!memcmp(digest.bytes, it->second.bytes, sizeof(SubDigest));
+		}
+		if (!valid) {
+			fprintf(stderr, "Cached digest of packets %i->%i is not valid\n",
+				pq % ca::process_count, pq / ca::process_count);
+			abort();
 		}
 	}
 }
 
+void State::hash_packets(MHASH hash_thread, const std::vector<int> &order)
+{
+	std::map<int, SubDigest>::const_iterator it;
+	if (cfg::symmetries.empty()) {
+		for (it = queue_digests.begin(); it != queue_digests.end(); it++) {
+			mhash(hash_thread, &it->first, sizeof(int));
+			mhash(hash_thread, it->second.bytes, sizeof(it->second.bytes));
+		}
+		return;
+	}
+
+	// Queues are renumbered by positions of their processes in the canonical order
+	std::vector<int> position(ca::process_count);
+	for (int i = 0; i < ca::process_count; i++) {
+		position[order[i]] = i;
+	}
+	std::vector<std::pair<int, const SubDigest*> > queues;
+	queues.reserve(queue_digests.size());
+	for (it = queue_digests.begin(); it != queue_digests.end(); it++) {
+		int target = position[it->first / ca::process_count];
+		int source = position[it->first % ca::process_count];
+		queues.push_back(std::pair<int, const SubDigest*>(
+			target * ca::process_count + source, &it->second));
+	}
+	std::sort(queues.begin(), queues.end());
+	for (size_t i = 0; i < queues.size(); i++) {
+		mhash(hash_thread, &queues[i].first, sizeof(int));
+		mhash(hash_thread, queues[i].second->bytes, sizeof(queues[i].second->bytes));
+	}
+}
+
+struct ProcessDigestCompare
+{
+	ProcessDigestCompare(const std::vector<SubDigest> &digests) : digests(digests) {}
+
+	bool operator()(int p1, int p2) const {
+		return memcmp(digests[p1].bytes, digests[p2].bytes, sizeof(SubDigest)) < 0;
+	}
+
+	const std::vector<SubDigest> &digests;
+};
+
+std::vector<int> State::canonical_order()
+{
+	std::vector<int> order(ca::process_count);
+	for (int i = 0; i < ca::process_count; i++) {
+		order[i] = i;
+	}
+
+	// Processes of a symmetric group are sorted by digests of their local states,
+	// all parts of the state are then hashed in this order
+	for (size_t g = 0; g < cfg::symmetries.size(); g++) {
+		std::stable_sort(order.begin() + cfg::symmetries[g].first,
+		                 order.begin() + cfg::symmetries[g].second + 1,
+		                 ProcessDigestCompare(process_digests));
+	}
+	return order;
+}
+
 HashDigest State::compute_hash(hashid hash_id)
 {
 	MHASH hash_thread = mhash_init(hash_id);
@@ -89,16 +292,16 @@ HashDigest State::compute_hash(hashid hash_id)
 		fprintf(stderr, "Hash failed\n");
 		exit(1);
 	}
+	update_digests();
+	if (cfg::debug) {
+		check_digests();
+	}
+	std::vector<int> order = canonical_order();
 	mhash(hash_thread, &quit, sizeof(quit));
-	hash_activations(hash_thread);
-	hash_packets(hash_thread);
-	ca::Packer packer;
 	for (int t = 0; t < ca::process_count; t++) {
-		packer.reset();
-		nets[t]->pack(packer);
-		mhash(hash_thread, packer.get_buffer(), packer.get_size());
+		mhash(hash_thread, process_digests[order[t]].bytes, sizeof(SubDigest));
 	}
-	packer.free();
+	hash_packets(hash_thread, order);
 	return mhash_end(hash_thread);
 }
 
@@ -147,7 +350,8 @@ std::string Core::hashdigest_to_string(hashid hash_id, HashDigest hash)
 }
 
 Node::Node(HashDigest hash, State *state, Node *prev)
-	: hash(hash), state(state), prev(prev), quit(false), final_marking(NULL), tag(0), data(NULL)
+	: hash(hash), state(state), nexts(NULL), nexts_count(0), prev(prev), quit(false),
+	  final_marking(NULL), tag(0), data(NULL)
 {
 	if (prev != NULL) {
 		distance = prev->get_distance() + 1;
@@ -158,23 +362,15 @@ Node::Node(HashDigest hash, State *state, Node *prev)
 
 Node::~Node()
 {
-	free(hash);
 	if (final_marking != NULL) {
 		free(final_marking);
 	}
-	for(size_t i = 0; i < nexts.size(); i++) {
+	for(size_t i = 0; i < nexts_count; i++) {
 		if (nexts[i].action == ActionFire && nexts[i].data.fire.binding != NULL) {
 			free(nexts[i].data.fire.binding);
 		}
 	}
-}
-
-void Node::set_prev(Node *node)
-{
-	if (prev != NULL && node->get_distance() + 1 < get_distance()) {
-		prev = node;
-		distance = node->get_distance() + 1;
-	}
+	free(nexts);
 }
 
 ActionSet Node::compute_enable_set(Core *core)
@@ -225,7 +421,7 @@ ActionSet Node::compute_enable_set(Core *core)
 	return enable;
 }
 
-void Node::generate(Core *core)
+void Node::generate(Core *core, Frontier *frontier)
 {
 	if (state->get_quit_flag()) {
 		return;
@@ -240,6 +436,9 @@ void Node::generate(Core *core)
 	}
 
 	State *s;
+	std::vector<NextNodeInfo> successors;
+	std::vector<Node*> created_nodes;
+	bool created;
 
 	ActionSet::iterator it;
 	for (it = ws.begin(); it != ws.end(); it++) {
@@ -249,6 +448,7 @@ void Node::generate(Core *core)
 			s = state;
 		}
 		it--;
+		created = false;
 		switch (it->type) {
 			case ActionFire:
 			{
@@ -258,18 +458,18 @@ void Node::generate(Core *core)
 				} else {
 					s->fire_transition_full(it->process, it->data.fire.transition_def);
 				}
-				Node *n = core->add_state(s, this);
+				Node *n = core->add_state(s, this, created);
 				NextNodeInfo nninfo;
 				nninfo.node = n;
 				nninfo.action = ActionFire;
 				nninfo.data.fire.process_id = it->process;
 				nninfo.data.fire.transition_id = it->data.fire.transition_def->get_id();
 				if (core->generate_binding_in_nni(it->data.fire.transition_def->get_id())) {
-					nninfo.data.fire.binding = core->hash_packer(packer);
+					nninfo.data.fire.binding = core->store_digest(core->hash_packer(packer));
 				} else {
 					nninfo.data.fire.binding = NULL;
 				}
-				nexts.push_back(nninfo);
+				successors.push_back(nninfo);
 				packer.free();
 				break;
 			}
@@ -277,21 +477,46 @@ void Node::generate(Core *core)
 			case ActionReceive:
 			{
 				s->receive(it->process, it->data.receive.source, true);
-				Node *n = core->add_state(s, this);
+				Node *n = core->add_state(s, this, created);
 				NextNodeInfo nninfo;
 				nninfo.node = n;
 				nninfo.action = ActionReceive;
 				nninfo.data.receive.process_id = it->process;
 				nninfo.data.receive.source_id = it->data.receive.source;
-				nexts.push_back(nninfo);
+				successors.push_back(nninfo);
 				break;
 			}
 		}
+		if (created) {
+			// The last successor reuses the state of this node, in the parallel generation
+			// it is expanded next by this thread; the disk store keeps no states at all
+			if (cfg::hash_only_states &&
+				(s != state || frontier == NULL || core->has_store())) {
+				delete s;
+				successors.back().node->state = NULL;
+			}
+			created_nodes.push_back(successors.back().node);
+		}
+	}
+
+	if (!ws.empty()) {
+		state = NULL;
+	}
+
+	nexts = core->store_nexts(successors);
+	nexts_count = successors.size();
+
+	// Successors are published after "nexts" is complete, so they can be replayed
+	for (size_t i = 0; i < created_nodes.size(); i++) {
+		core->push_node(created_nodes[i], frontier);
 	}
 }
 
 Core::Core(VerifConfiguration &verif_configuration, std::vector<ca::Parameter*> &parameters):
-	nodes(10000, HashDigestHash(MHASH_MD5), HashDigestEq(MHASH_MD5)),
+	nodes(10000),
+	store(NULL),
+	pending(0),
+	processed(0),
 	initial_node(NULL),
 	net_def(NULL),
 	verif_configuration(verif_configuration)
@@ -301,6 +526,30 @@ Core::Core(VerifConfiguration &verif_configuration, std::vector<ca::Parameter*>
 	} else {
 		generate_binging_in_nni = false;
 	}
+	for (size_t i = 0; i < cfg::symmetries.size(); i++) {
+		if (cfg::symmetries[i].second >= ca::process_count) {
+			fprintf(stderr, "Symmetric processes %i-%i do not exist\n",
+				cfg::symmetries[i].first, cfg::symmetries[i].second);
+			exit(1);
+		}
+	}
+	if (!cfg::symmetries.empty() && cfg::analyse_transition_occurence) {
+		// Characteristic vectors contain process ids, so they differ between symmetric paths
+		fprintf(stderr, "Symmetry reduction cannot be used with the analysis of characteristic vectors\n");
+		exit(1);
+	}
+	if (!cfg::symmetries.empty() && cfg::threads > 1) {
+		// Prev links of the symmetry reduction are links of the generation, they form
+		// shortest paths only when nodes are created in BFS order (see generate),
+		// but parallel workers create nodes in an arbitrary order
+		fprintf(stderr, "Symmetry reduction cannot be used with more threads\n");
+		exit(1);
+	}
+	if (!cfg::disk_store.empty()) {
+		store = new DiskStore(cfg::disk_store, mhash_get_block_size(MHASH_MD5));
+		nodes.set_store(store);
+		not_processed.set_store(store);
+	}
 	if (cfg::debug) {
 		debug_output.open((cfg::project_name + "_debug_out.txt").c_str(), std::ios::out | std::ios::trunc);
 		debug_output << "Project: " << cfg::project_name << "\n";
@@ -318,34 +567,109 @@ Core::Core(VerifConfiguration &verif_configuration, std::vector<ca::Parameter*>
 
 Core::~Core()
 {
-	NodeMap::iterator it;
-	for (it = nodes.begin(); it != nodes.end(); it++) {
-		delete it->second;
+	// Nodes in the disk store own no memory outside of the store
+	if (store == NULL) {
+		NodeIndex::const_iterator it;
+		for (it = nodes.begin(); it != nodes.end(); it++) {
+			Node *node = *it;
+			free(node->get_hash());
+			delete node;
+		}
 	}
+	delete store;
 	if (cfg::debug) {
 		debug_output.close();
 	}
 }
 
-Node * Core::add_state(State *state, Node *prev)
+Node * Core::add_state(State *state, Node *prev, bool &created)
 {
 	HashDigest hash = state->compute_hash(MHASH_MD5);
+	Node *node;
 
-	Node *node = get_node(hash);
-	if (node == NULL) {
-		node = new Node(hash, state, prev);
-		node->set_quit_flag(state->get_quit_flag());
-		nodes[hash] = node;
-		not_processed.push(node);
-		return node;
+	if (!shards.empty()) {
+		// The first bytes are used by HashDigestHash, the shard is chosen by the last one
+		size_t size = mhash_get_block_size(MHASH_MD5);
+		NodeMapShard *shard = shards[((unsigned char*) hash)[size - 1] % SHARDS_COUNT];
+		pthread_mutex_lock(&shard->lock);
+		node = NULL;
+		if (store == NULL || store->may_contain(hash)) {
+			node = shard->nodes.find(hash);
+		}
+		if (node == NULL) {
+			node = create_node(hash, state, prev);
+			shard->nodes.insert(node);
+			created = true;
+		} else {
+			created = false;
+		}
+		pthread_mutex_unlock(&shard->lock);
 	} else {
+		node = NULL;
+		if (store == NULL || store->may_contain(hash)) {
+			node = get_node(hash);
+		}
+		if (node == NULL) {
+			node = create_node(hash, state, prev);
+			nodes.insert(node);
+			created = true;
+		} else {
+			created = false;
+		}
+	}
+
+	if (!created) {
 		free(hash);
 		delete state;
-		if (prev) {
-			node->set_prev(prev);
-		}
-		return node;
 	}
+	return node;
+}
+
+Node * Core::create_node(HashDigest hash, State *state, Node *prev)
+{
+	Node *node;
+	if (store != NULL) {
+		HashDigest digest = store_digest(hash);
+		store->add(digest);
+		node = new (store->allocate(sizeof(Node))) Node(digest, state, prev);
+	} else {
+		node = new Node(hash, state, prev);
+	}
+	node->set_quit_flag(state->get_quit_flag());
+	return node;
+}
+
+HashDigest Core::store_digest(HashDigest hash)
+{
+	if (store == NULL) {
+		return hash;
+	}
+	HashDigest digest = store->copy_digest(hash);
+	free(hash);
+	return digest;
+}
+
+NextNodeInfo * Core::store_nexts(const std::vector<NextNodeInfo> &nexts)
+{
+	if (nexts.empty()) {
+		return NULL;
+	}
+	size_t size = nexts.size() * sizeof(NextNodeInfo);
+	void *mem = store != NULL ? store->allocate(size) : malloc(size);
+	memcpy(mem, &nexts[0], size);
+	return static_cast<NextNodeInfo*>(mem);
+}
+
+void Core::push_node(Node *node, Frontier *frontier)
+{
+	if (frontier == NULL) {
+		not_processed.push_back(node);
+		return;
+	}
+	__sync_fetch_and_add(&pending, 1);
+	pthread_mutex_lock(&frontier->lock);
+	frontier->nodes.push_back(node);
+	pthread_mutex_unlock(&frontier->lock);
 }
 
 void Core::generate()
@@ -354,23 +678,214 @@ void Core::generate()
 
 	net_def = ca::defs[0]; // Take first definition
 	State *initial_state = new State(net_def);
-	initial_node = add_state(initial_state, NULL);
-	int count = 0;
-	do {
-		count++;
-		if (count % 1000 == 0 && !cfg::silent) {
-			fprintf(stderr, "==KAIRA== Nodes %i\n", count);
+
+	// Debug output is written from the exploration, so it runs in one thread
+	int threads = cfg::debug ? 1 : cfg::threads;
+	if (threads > 1) {
+		generate_parallel(initial_state, threads);
+	} else {
+		bool created;
+		initial_node = add_state(initial_state, NULL, created);
+		push_node(initial_node, NULL);
+		do {
+			Node *node = not_processed.front();
+			not_processed.pop_front();
+			process_node(node, NULL);
+		} while (!not_processed.empty());
+	}
+	// With the symmetry reduction, an arc can lead to a permutation of the stored state,
+	// so prev links are kept from the generation where they can be replayed exactly;
+	// nodes are expanded in BFS order, hence these links form shortest paths
+	if (cfg::symmetries.empty()) {
+		compute_distances();
+	}
+}
+
+void Core::process_node(Node *node, Frontier *frontier)
+{
+	long count = __sync_add_and_fetch(&processed, 1);
+	if (count % 1000 == 0 && !cfg::silent) {
+		fprintf(stderr, "==KAIRA== Nodes %li\n", count);
+	}
+	if (node->get_state() == NULL) {
+		node->set_state(replay_state(node));
+	}
+	node->generate(this, frontier);
+
+	// The state was not passed to any successor
+	State *state = node->get_state();
+	if (state != NULL) {
+		if (cfg::analyse_final_marking) {
+			node->set_final_marking(store_digest(pack_marking(node)));
+		}
+		delete state;
+		node->set_state(NULL);
+	}
+}
+
+State * Core::replay_state(Node *node)
+{
+	std::vector<Node*> path;
+	for (Node *n = node; n->get_prev() != NULL; n = n->get_prev()) {
+		path.push_back(n);
+	}
+
+	State *state = new State(net_def);
+	Node *prev = initial_node;
+	std::vector<Node*>::reverse_iterator i;
+	for (i = path.rbegin(); i != path.rend(); ++i) {
+		const NextNodeInfo &nninfo = prev->get_next_node_info(*i);
+		switch (nninfo.action) {
+			case ActionFire:
+			{
+				int transition_id = nninfo.data.fire.transition_id;
+				ca::TransitionDef *transition_def = net_def->get_transition_def(transition_id);
+				if (generate_binding_in_nni(transition_id)) {
+					ca::Packer packer;
+					state->fire_transition_full_with_binding(
+						nninfo.data.fire.process_id, transition_def, packer);
+					packer.free();
+				} else {
+					state->fire_transition_full(nninfo.data.fire.process_id, transition_def);
+				}
+				break;
+			}
+			case ActionReceive:
+				state->receive(nninfo.data.receive.process_id, nninfo.data.receive.source_id, true);
+				break;
+			default:
+				break;
+		}
+		prev = *i;
+	}
+	return state;
+}
+
+void Core::generate_parallel(State *initial_state, int threads)
+{
+	shards.resize(SHARDS_COUNT);
+	for (size_t i = 0; i < SHARDS_COUNT; i++) {
+		shards[i] = new NodeMapShard();
+		if (store != NULL) {
+			shards[i]->nodes.set_store(store);
+		}
+	}
+	frontiers.resize(threads);
+	for (int i = 0; i < threads; i++) {
+		frontiers[i] = new Frontier();
+		frontiers[i]->nodes.set_store(store);
+	}
+
+	bool created;
+	initial_node = add_state(initial_state, NULL, created);
+	push_node(initial_node, frontiers[0]);
+
+	std::vector<pthread_t> ids(threads);
+	std::vector<WorkerArgs> args(threads);
+	for (int i = 0; i < threads; i++) {
+		args[i].core = this;
+		args[i].id = i;
+		if (pthread_create(&ids[i], NULL, run_worker, &args[i])) {
+			fprintf(stderr, "Cannot create a thread\n");
+			exit(1);
+		}
+	}
+	for (int i = 0; i < threads; i++) {
+		pthread_join(ids[i], NULL);
+	}
+
+	for (int i = 0; i < threads; i++) {
+		delete frontiers[i];
+	}
+	frontiers.clear();
+	merge_shards();
+}
+
+void Core::generate_worker(int id)
+{
+	Frontier *frontier = frontiers[id];
+	for (;;) {
+		Node *node = NULL;
+		pthread_mutex_lock(&frontier->lock);
+		if (!frontier->nodes.empty()) {
+			node = frontier->nodes.back();
+			frontier->nodes.pop_back();
+		}
+		pthread_mutex_unlock(&frontier->lock);
+
+		if (node == NULL) {
+			node = steal_node(id);
+		}
+		if (node == NULL) {
+			// Nodes are counted as pending until their successors are added
+			if (__sync_fetch_and_add(&pending, 0) == 0) {
+				return;
+			}
+			sched_yield();
+			continue;
 		}
-		Node *node = not_processed.top();
-		not_processed.pop();
-		node->generate(this);
-		if (node->get_nexts().size() == 0 && cfg::analyse_final_marking) {
-			node->set_final_marking(pack_marking(node));
+		process_node(node, frontier);
+		__sync_fetch_and_sub(&pending, 1);
+	}
+}
+
+Node * Core::steal_node(int id)
+{
+	for (size_t i = 1; i < frontiers.size(); i++) {
+		Frontier *frontier = frontiers[(id + i) % frontiers.size()];
+		pthread_mutex_lock(&frontier->lock);
+		if (!frontier->nodes.empty()) {
+			Node *node = frontier->nodes.front();
+			frontier->nodes.pop_front();
+			pthread_mutex_unlock(&frontier->lock);
+			return node;
+		}
+		pthread_mutex_unlock(&frontier->lock);
+	}
+	return NULL;
+}
+
+void Core::merge_shards()
+{
+	size_t size = 0;
+	for (size_t i = 0; i < shards.size(); i++) {
+		size += shards[i]->nodes.size();
+	}
+	nodes.reserve(size);
+	for (size_t i = 0; i < shards.size(); i++) {
+		NodeIndex::const_iterator it;
+		for (it = shards[i]->nodes.begin(); it != shards[i]->nodes.end(); it++) {
+			nodes.insert(*it);
 		}
-		if (node->get_quit_flag()) {
-			delete node->get_state();
+		delete shards[i];
+	}
+	shards.clear();
+}
+
+void Core::compute_distances()
+{
+	// Prev links and distances form a tree of shortest paths
+	// that does not depend on the order of generation
+	NodeIndex::const_iterator it;
+	for (it = nodes.begin(); it != nodes.end(); it++) {
+		(*it)->set_prev(NULL, -1);
+	}
+	initial_node->set_prev(NULL, 0);
+
+	std::queue<Node*> queue;
+	queue.push(initial_node);
+	while (!queue.empty()) {
+		Node *node = queue.front();
+		queue.pop();
+		NextNodes nexts = node->get_nexts();
+		for (size_t i = 0; i < nexts.size(); i++) {
+			Node *n = nexts[i].node;
+			if (n->get_distance() == -1) {
+				n->set_prev(node, node->get_distance() + 1);
+				queue.push(n);
+			}
 		}
-	} while (!not_processed.empty());
+	}
 }
 
 ActionSet Core::compute_ample_set(State *s, const ActionSet &enable)
@@ -379,7 +894,7 @@ ActionSet Core::compute_ample_set(State *s, const ActionSet &enable)
 
 	if (cfg::debug) {
 		debug_output << "\n" << Core::hashdigest_to_string(MHASH_MD5, s->compute_hash(MHASH_MD5));
-		debug_output << " states: " << nodes.size() << ", on stact: " << not_processed.size();
+		debug_output << " states: " << nodes.size() << ", not processed: " << not_processed.size();
 		debug_output.setf(std::ios::fixed, std::ios::floatfield);
 		debug_output.precision(2);
 		debug_output << " " << not_processed.size() / (double)nodes.size() << "%\n";
@@ -496,26 +1011,22 @@ bool Core::check_C3(State *s)
 
 void Core::set_tags(int tag)
 {
-	NodeMap::const_iterator it;
+	NodeIndex::const_iterator it;
 	for (it = nodes.begin(); it != nodes.end(); it++)
 	{
-		Node *node = it->second;
+		Node *node = *it;
 		node->set_tag(tag);
 	}
 }
 
 Node * Core::get_node(HashDigest digest) const
 {
-	NodeMap::const_iterator it = nodes.find(digest);
-	if (it == nodes.end())
-		return NULL;
-	else
-		return it->second;
+	return nodes.find(digest);
 }
 
 const NextNodeInfo& Node::get_next_node_info(Node *node) const
 {
-	for (int i = 0; nexts.size(); i++) {
+	for (size_t i = 0; i < nexts_count; i++) {
 		if (nexts[i].node == node) {
 			return nexts[i];
 		}
@@ -526,7 +1037,7 @@ const NextNodeInfo& Node::get_next_node_info(Node *node) const
 
 bool Core::is_known_node(Node *node) const
 {
-	return nodes.find(node) != nodes.end();
+	return nodes.find(node->get_hash()) == node;
 }
 
 bool Core::generate_binding_in_nni(int transition_id)
@@ -538,3 +1049,221 @@ bool Core::generate_binding_in_nni(int transition_id)
 	}
 
 }
+
+NodeIndex::const_iterator::const_iterator(
+	NodeMap::const_iterator it, const Slot *slot, const Slot *end)
+	: it(it), slot(slot), end(end)
+{
+	skip_empty();
+}
+
+void NodeIndex::const_iterator::skip_empty()
+{
+	while (slot != end && slot->node == NULL) {
+		slot++;
+	}
+}
+
+NodeIndex::const_iterator & NodeIndex::const_iterator::operator++()
+{
+	if (slot != NULL) {
+		slot++;
+		skip_empty();
+	} else {
+		++it;
+	}
+	return *this;
+}
+
+NodeIndex::const_iterator NodeIndex::const_iterator::operator++(int)
+{
+	const_iterator i = *this;
+	++(*this);
+	return i;
+}
+
+NodeIndex::NodeIndex(size_t size)
+	: map(size, HashDigestHash(MHASH_MD5), HashDigestEq(MHASH_MD5)),
+	  hash(MHASH_MD5),
+	  eq(MHASH_MD5),
+	  initial_size(size),
+	  store(NULL),
+	  table(NULL),
+	  capacity(0),
+	  count(0)
+{
+}
+
+NodeIndex::~NodeIndex()
+{
+	if (table != NULL) {
+		DiskStore::unmap(table, capacity * sizeof(Slot));
+	}
+}
+
+void NodeIndex::set_store(DiskStore *store)
+{
+	this->store = store;
+	reserve(initial_size);
+}
+
+void NodeIndex::reserve(size_t size)
+{
+	if (store == NULL) {
+		map.rehash(size);
+		return;
+	}
+	// The table is kept at most 3/4 full
+	size_t c = 1024;
+	while (c * 3 < size * 4) {
+		c *= 2;
+	}
+	if (c > capacity) {
+		resize_table(c);
+	}
+}
+
+void NodeIndex::resize_table(size_t capacity)
+{
+	// A new mapping is filled with zeros, so all its slots are empty
+	Slot *old_table = table;
+	size_t old_capacity = this->capacity;
+	table = static_cast<Slot*>(store->map(capacity * sizeof(Slot)));
+	this->capacity = capacity;
+	count = 0;
+	for (size_t i = 0; i < old_capacity; i++) {
+		if (old_table[i].node != NULL) {
+			insert(old_table[i].node);
+		}
+	}
+	if (old_table != NULL) {
+		DiskStore::unmap(old_table, old_capacity * sizeof(Slot));
+	}
+}
+
+Node * NodeIndex::find(HashDigest digest) const
+{
+	if (table == NULL) {
+		NodeMap::const_iterator it = map.find(digest);
+		return it != map.end() ? it->second : NULL;
+	}
+	// Keys are compared first, so other nodes in the probe sequence are not read
+	size_t key = hash(digest);
+	for (size_t i = key & (capacity - 1); table[i].node != NULL; i = (i + 1) & (capacity - 1)) {
+		if (table[i].key == key && eq(table[i].node->get_hash(), digest)) {
+			return table[i].node;
+		}
+	}
+	return NULL;
+}
+
+void NodeIndex::insert(Node *node)
+{
+	if (table == NULL) {
+		map[node->get_hash()] = node;
+		return;
+	}
+	if ((count + 1) * 4 > capacity * 3) {
+		resize_table(capacity * 2);
+	}
+	size_t key = hash(node->get_hash());
+	size_t i = key & (capacity - 1);
+	while (table[i].node != NULL) {
+		i = (i + 1) & (capacity - 1);
+	}
+	table[i].key = key;
+	table[i].node = node;
+	count++;
+}
+
+NodeIndex::const_iterator NodeIndex::begin() const
+{
+	if (table == NULL) {
+		return const_iterator(map.begin(), NULL, NULL);
+	}
+	return const_iterator(map.end(), table, table + capacity);
+}
+
+NodeIndex::const_iterator NodeIndex::end() const
+{
+	if (table == NULL) {
+		return const_iterator(map.end(), NULL, NULL);
+	}
+	return const_iterator(map.end(), table + capacity, table + capacity);
+}
+
+NodeQueue::~NodeQueue()
+{
+	// Blocks in the store are released with the store
+	if (store == NULL) {
+		for (size_t i = 0; i < blocks.size(); i++) {
+			free(blocks[i]);
+		}
+	}
+}
+
+Node ** NodeQueue::new_block()
+{
+	if (!spare_blocks.empty()) {
+		Node **block = spare_blocks.back();
+		spare_blocks.pop_back();
+		return block;
+	}
+	size_t size = BLOCK_SIZE * sizeof(Node*);
+	return static_cast<Node**>(store != NULL ? store->allocate(size) : malloc(size));
+}
+
+void NodeQueue::release_block(Node **block)
+{
+	if (store != NULL) {
+		spare_blocks.push_back(block);
+	} else {
+		free(block);
+	}
+}
+
+void NodeQueue::clear()
+{
+	for (size_t i = 0; i < blocks.size(); i++) {
+		release_block(blocks[i]);
+	}
+	blocks.clear();
+	first = 0;
+	last = BLOCK_SIZE;
+}
+
+void NodeQueue::push_back(Node *node)
+{
+	if (last == BLOCK_SIZE) {
+		blocks.push_back(new_block());
+		last = 0;
+	}
+	blocks.back()[last++] = node;
+	count++;
+}
+
+void NodeQueue::pop_front()
+{
+	first++;
+	count--;
+	if (count == 0) {
+		clear();
+	} else if (first == BLOCK_SIZE) {
+		release_block(blocks.front());
+		blocks.pop_front();
+		first = 0;
+	}
+}
+
+void NodeQueue::pop_back()
+{
+	last--;
+	count--;
+	if (count == 0) {
+		clear();
+	} else if (last == 0) {
+		release_block(blocks.back());
+		blocks.pop_back();
+		last = BLOCK_SIZE;
+	}
+}
@@ -3,14 +3,19 @@
 #define CAVERIF_STATESPACE_H
 
 #include <stack>
+#include <queue>
+#include <deque>
+#include <pthread.h>
 #include <google/sparse_hash_map>
 #include <mhash.h>
 #include "cailie.h"
 #include "basictypes.h"
 #include "state.h"
 #include "verifconfiguration.h"
+#include "diskstore.h"
 
 #include <set>
+#include <map>
 #include <list>
 #include <vector>
 #include <iostream>
@@ -28,28 +33,68 @@ namespace cass {
 		extern bool partial_order_reduction;
 		extern bool silent;
 		extern bool debug;
+		extern int threads;
+		extern bool hash_only_states;
+		extern bool hash_cache;
+		extern std::string disk_store;
+		extern std::vector<std::pair<int, int> > symmetries;
 		extern std::string project_name;
 	};
 
 	class Core;
 	class Node;
+	struct Frontier;
 	class VerifConfiguration;
 	typedef void* HashDigest;
 	struct Arc;
 	struct ArcCompare;
 	typedef std::map<Arc, int, ArcCompare> ParikhVector;
 
+	/* MD5 digest of one part of a state */
+	struct SubDigest {
+		unsigned char bytes[16];
+	};
+
+	/* Digests of processes (activation and net) and of non-empty packet queues
+	   are cached in the state, only parts touched by an action are rehashed */
 	class State  : public ca::StateBase<Net, Activation, ca::Packet>
 	{
 		public:
-			State(ca::NetDef *net_def) { spawn(net_def); }
-			State(State &state) : StateBase(state) {}
+			State(ca::NetDef *net_def) :
+				process_digests(ca::process_count),
+				dirty_processes(ca::process_count, true),
+				all_dirty(true) { spawn(net_def); }
+			State(State &state) :
+				StateBase(state),
+				process_digests(state.process_digests),
+				queue_digests(state.queue_digests),
+				dirty_processes(state.dirty_processes),
+				dirty_queues(state.dirty_queues),
+				all_dirty(state.all_dirty) {}
 			void pack_state(ca::Packer &packer);
 			HashDigest compute_hash(hashid hash_id);
-			void hash_activations(MHASH hash_thread);
-			void hash_packets(MHASH hash_thread);
+			std::vector<int> canonical_order();
+			void hash_packets(MHASH hash_thread, const std::vector<int> &order);
 			void pack_activations(ca::Packer &packer);
 			void pack_packets(ca::Packer &packer);
+
+			bool fire_transition_full(int process_id, ca::TransitionDef *transition_def);
+			bool fire_transition_full_with_binding(
+				int process_id, ca::TransitionDef *transition_def, ca::Packer &packer);
+			bool receive(int process_id, int origin_id, bool free_data = true);
+		protected:
+			void touch_process(int process_id);
+			void touch_transition(int process_id, ca::TransitionDef *transition_def);
+			void update_digests();
+			void check_digests();
+			void hash_process(int process_id, ca::Packer &packer, SubDigest &digest);
+			void hash_queue(int queue_id, SubDigest &digest);
+
+			std::vector<SubDigest> process_digests;
+			std::map<int, SubDigest> queue_digests;
+			std::vector<bool> dirty_processes;
+			std::vector<int> dirty_queues;
+			bool all_dirty;
 	};
 
 	struct NextNodeInfo {
@@ -71,6 +116,17 @@ namespace cass {
 		} data;
 	};
 
+	/* Successors of a node, the array is on the heap or in the disk store */
+	struct NextNodes
+	{
+		NextNodes(const NextNodeInfo *nexts, size_t count) : nexts(nexts), count(count) {}
+		size_t size() const { return count; }
+		const NextNodeInfo & operator[](size_t i) const { return nexts[i]; }
+
+		const NextNodeInfo *nexts;
+		size_t count;
+	};
+
 	struct Arc
 	{
 		Arc(Node *node, const NextNodeInfo *nni): node(node), nni(nni) {};
@@ -96,16 +152,17 @@ namespace cass {
 		public:
 			Node(HashDigest hash, State *state, Node *prev);
 			~Node();
-			const std::vector<NextNodeInfo> & get_nexts() const { return nexts; }
-			void generate(Core *statespace);
+			NextNodes get_nexts() const { return NextNodes(nexts, nexts_count); }
+			void generate(Core *statespace, Frontier *frontier = NULL);
 			HashDigest get_hash() const { return hash; }
 
 			State* get_state() const { return state; }
+			void set_state(State *state) { this->state = state; }
 			Node* get_prev() const { return prev; }
 			int get_distance() const { return distance; }
 			void* get_data() const { return data; };
 			void set_data(void* data) { this->data = data; };
-			void set_prev(Node *prev);
+			void set_prev(Node *prev, int distance) { this->prev = prev; this->distance = distance; }
 			const NextNodeInfo& get_next_node_info(Node *node) const;
 
 			bool get_quit_flag() { return quit; }
@@ -118,7 +175,8 @@ namespace cass {
 			ActionSet compute_enable_set(Core *core);
 			HashDigest hash;
 			State* state;
-			std::vector<NextNodeInfo> nexts;
+			NextNodeInfo *nexts;
+			size_t nexts_count;
 			Node* prev;
 			int distance;
 			bool quit;
@@ -153,15 +211,120 @@ namespace cass {
 	typedef google::sparse_hash_map<HashDigest, Node*, HashDigestHash, HashDigestEq>
 		NodeMap;
 
+	/* Set of visited nodes; a hash map on the heap, or with the disk store,
+	   an open addressing table in a mapped file */
+	class NodeIndex
+	{
+		public:
+			struct Slot {
+				size_t key;
+				Node *node;
+			};
+
+			class const_iterator
+			{
+				public:
+					const_iterator() : slot(NULL), end(NULL) {}
+					const_iterator(NodeMap::const_iterator it, const Slot *slot, const Slot *end);
+					Node * operator*() const { return slot != NULL ? slot->node : it->second; }
+					const_iterator & operator++();
+					const_iterator operator++(int);
+					bool operator==(const const_iterator &other) const {
+						return it == other.it && slot == other.slot;
+					}
+					bool operator!=(const const_iterator &other) const { return !(*this == other); }
+				protected:
+					void skip_empty();
+					NodeMap::const_iterator it;
+					const Slot *slot;
+					const Slot *end;
+			};
+
+			NodeIndex(size_t size);
+			~NodeIndex();
+			void set_store(DiskStore *store);
+			Node * find(HashDigest hash) const;
+			void insert(Node *node);
+			void reserve(size_t size);
+			size_t size() const { return table != NULL ? count : map.size(); }
+			const_iterator begin() const;
+			const_iterator end() const;
+		protected:
+			void resize_table(size_t capacity);
+			NodeMap map;
+			HashDigestHash hash;
+			HashDigestEq eq;
+			size_t initial_size;
+			DiskStore *store;
+			Slot *table;
+			size_t capacity;
+			size_t count;
+	};
+
+	/* Queue of nodes kept in blocks; with the disk store, blocks are allocated
+	   in the store and emptied blocks are reused, as the store never frees memory */
+	class NodeQueue
+	{
+		public:
+			NodeQueue() : store(NULL), first(0), last(BLOCK_SIZE), count(0) {}
+			~NodeQueue();
+			void set_store(DiskStore *store) { this->store = store; }
+			bool empty() const { return count == 0; }
+			size_t size() const { return count; }
+			Node * front() const { return blocks.front()[first]; }
+			Node * back() const { return blocks.back()[last - 1]; }
+			void push_back(Node *node);
+			void pop_front();
+			void pop_back();
+		protected:
+			static const size_t BLOCK_SIZE = 4096;
+			Node ** new_block();
+			void release_block(Node **block);
+			void clear();
+			DiskStore *store;
+			std::deque<Node**> blocks;
+			std::vector<Node**> spare_blocks;
+			size_t first; // Position of the front in the first block
+			size_t last; // Position after the back in the last block
+			size_t count;
+	};
+
+	/* Unprocessed nodes of one thread of the parallel generation;
+	   the owner takes nodes from the back, idle threads steal from the front */
+	struct Frontier
+	{
+		Frontier() { pthread_mutex_init(&lock, NULL); }
+		~Frontier() { pthread_mutex_destroy(&lock); }
+		pthread_mutex_t lock;
+		NodeQueue nodes;
+	};
+
+	/* One part of the set of visited states during the parallel generation */
+	struct NodeMapShard
+	{
+		NodeMapShard() : nodes(1000) { pthread_mutex_init(&lock, NULL); }
+		~NodeMapShard() { pthread_mutex_destroy(&lock); }
+		pthread_mutex_t lock;
+		NodeIndex nodes;
+	};
+
+	bool is_closer(const Node *node1, const Node *node2);
+
 	class Core
 	{
 		public:
 			Core(VerifConfiguration &verif_configuration, std::vector<ca::Parameter*> &parameters);
 			~Core();
 			void generate();
+			void generate_worker(int id);
 			void postprocess();
 			void write_dot_file(const std::string &filename);
-			Node * add_state(State *state, Node *prev);
+			Node * add_state(State *state, Node *prev, bool &created);
+			void push_node(Node *node, Frontier *frontier);
+			Node * create_node(HashDigest hash, State *state, Node *prev);
+			HashDigest store_digest(HashDigest hash);
+			NextNodeInfo * store_nexts(const std::vector<NextNodeInfo> &nexts);
+			bool has_store() const { return store != NULL; }
 			HashDigest hash_packer(ca::Packer &packer);
 			HashDigest pack_marking(Node *node);
 			ca::NetDef * get_net_def() { return net_def; }
@@ -172,6 +335,13 @@ namespace cass {
 			static void hashdigest_to_string(hashid hash_id, HashDigest hash, char *out);
 			static std::string hashdigest_to_string(hashid hash_id, HashDigest hash);
 		protected:
+			void process_node(Node *node, Frontier *frontier);
+			void generate_parallel(State *initial_state, int threads);
+			Node * steal_node(int id);
+			State * replay_state(Node *node);
+			void merge_shards();
+			void compute_distances();
+
 			void write_report();
 			void write_control_sequence(std::vector<Node*> &nodes, ca::Output &report);
 			void write_state(const std::string &name, Node *node, ca::Output &report);
@@ -189,8 +359,13 @@ namespace cass {
 			bool check_C1(const ActionSet &enabled, const ActionSet &ample, State *s);
 			bool check_C2(const ActionSet &ws);
 			bool check_C3(State *s);
-			std::stack<Node*> not_processed;
-			NodeMap nodes;
+			NodeQueue not_processed;
+			NodeIndex nodes;
+			std::vector<NodeMapShard*> shards;
+			std::vector<Frontier*> frontiers;
+			DiskStore *store;
+			volatile long pending;
+			volatile long processed;
 			Node *initial_node;
 			ca::NetDef *net_def;
 			VerifConfiguration &verif_configuration;
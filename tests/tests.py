@@ -1,7 +1,11 @@
 # -*- coding: utf-8 -*-
 
-from testutils import Project
+from testutils import Project, RunProgram, CMDUTILS, runinstance_state, import_gui
+from testutils import run_control_sequence, simulation_state
 import unittest
+import os
+import csv
+import numpy as np
 
 class BuildTest(unittest.TestCase):
 
@@ -138,6 +142,109 @@ class BuildTest(unittest.TestCase):
         p.quick_test(processes=2, extra_args=["-T100K"])
         p.check_tracelog("14\n")
 
+    def test_tracelog_seek(self):
+        p = Project("tracelog", trace=True)
+        p.quick_test(processes=2, extra_args=["-T100K"])
+        for interval in (1, 3, 5):
+            t = p.open_tracelog(checkpoint_interval=interval, use_cache=False)
+            for i in xrange(t.get_runinstances_count()):
+                ri = t.execute_visible_events(t.first_runinstance.copy(), 0, i)
+                self.assertEquals(runinstance_state(t.get_event_runinstance(i)),
+                                  runinstance_state(ri))
+
+    def test_tracelog_cache(self):
+        p = Project("tracelog", trace=True)
+        p.quick_test(processes=2, extra_args=["-T100K"])
+        t1 = p.open_tracelog(checkpoint_interval=3)
+        self.assertTrue(os.path.isfile(os.path.join(p.get_directory(), "trace.kti")))
+        # All checkpoints are created by indexing
+        self.assertEquals(len(t1.checkpoints), (len(t1.timeline) - 1) // 3 + 1)
+        t2 = p.open_tracelog(checkpoint_interval=3)
+        self.assertEquals(t1.timeline.data.tolist(), t2.timeline.data.tolist())
+        self.assertEquals(t1.get_runinstances_count(), t2.get_runinstances_count())
+        self.assertEquals(map(runinstance_state, t1.checkpoints),
+                          map(runinstance_state, t2.checkpoints))
+        for i in xrange(t1.get_runinstances_count()):
+            self.assertEquals(runinstance_state(t1.get_event_runinstance(i)),
+                              runinstance_state(t2.get_event_runinstance(i)))
+        # Checkpoints are created again for another interval
+        t3 = p.open_tracelog(checkpoint_interval=2)
+        self.assertEquals(len(t3.checkpoints), (len(t3.timeline) - 1) // 2 + 1)
+        for i in xrange(t1.get_runinstances_count()):
+            self.assertEquals(runinstance_state(t1.get_event_runinstance(i)),
+                              runinstance_state(t3.get_event_runinstance(i)))
+
+    def test_tracelog_decode_processes(self):
+        p = Project("tracelog", trace=True)
+        p.quick_test(processes=2, extra_args=["-T100K"])
+        t1 = p.open_tracelog(use_cache=False)
+        t2 = p.open_tracelog(use_cache=False, decode_processes=2)
+        self.assertEquals(t1.full_timeline.data.tolist(),
+                          t2.full_timeline.data.tolist())
+        self.assertEquals(t1.timeline.data.tolist(), t2.timeline.data.tolist())
+        self.assertEquals(t1.missed_receives, t2.missed_receives)
+        for trace1, trace2 in zip(t1.traces, t2.traces):
+            self.assertEquals(trace1.events.tolist(), trace2.events.tolist())
+            self.assertEquals(trace1.sends.tolist(), trace2.sends.tolist())
+
+    def test_tracelog_data(self):
+        p = Project("tracelog", trace=True)
+        p.quick_test(processes=2, extra_args=["-T100K"])
+        t = p.open_tracelog(export_data=True, use_cache=False)
+        self.assertTrue(t.data is None)
+        self.assertTrue(t.get_data(lambda: True) is None)
+        self.assertTrue(t.data is None)
+        data = t.get_data()
+        self.assertTrue(data is t.get_data())
+        t2 = p.open_tracelog(export_data=True, use_cache=False)
+        self.assertEquals(t2.get_data().data.tolist(), data.data.tolist())
+        self.assertEquals(t.get_runinstances_count(), t2.get_runinstances_count())
+
+    def test_tracelog_export_table(self):
+        p = Project("tracelog", trace=True)
+        p.quick_test(processes=2, extra_args=["-T100K"])
+        data = p.open_tracelog(export_data=True, use_cache=False).get_data()
+        self.assertTrue(len(data) > 0)
+        tracelog = os.path.join(p.get_directory(), "trace.kth")
+        exportri = import_gui("exportri")
+
+        filename = os.path.join(p.get_directory(), "trace.ktb")
+        RunProgram("python", [ CMDUTILS, "--tracelog", tracelog,
+                               "--export-table", filename ]).run("")
+        table = exportri.load_binary_table(filename)
+        self.assertEquals(zip(table.header, table.types),
+                          zip(data.header, data.types))
+        self.assertEquals(list(table), list(data))
+        # More chunks
+        writer = exportri.BinaryTableWriter(filename, zip(data.header, data.types),
+                                            chunk_size=7)
+        for row in data:
+            writer.add_row(row)
+        writer.close()
+        self.assertEquals(list(exportri.load_binary_table(filename)), list(data))
+
+        filename = os.path.join(p.get_directory(), "trace.csv")
+        RunProgram("python", [ CMDUTILS, "--tracelog", tracelog,
+                               "--export-table", filename ]).run("")
+        with open(filename, "rb") as f:
+            rows = list(csv.reader(f))
+        filename2 = os.path.join(p.get_directory(), "trace2.csv")
+        writer = exportri.CsvTableWriter(filename2, zip(data.header, data.types),
+                                         chunk_size=7)
+        for row in data:
+            writer.add_row(row)
+        writer.close()
+        with open(filename2, "rb") as f:
+            self.assertEquals(list(csv.reader(f)), rows)
+        self.assertEquals(rows[0], data.types)
+        self.assertEquals(rows[1], data.header)
+        # Types are converted as in the loading of CSV files by the gui
+        types = [ np.dtype(t).type for t in data.types ]
+        self.assertEquals([ [ None if value == "" else t(value)
+                              for t, value in zip(types, row) ]
+                            for row in rows[2:] ],
+                          list(data))
+
     def test_scatter1(self):
         Project("scatter1").quick_test("1941\n", processes=5)
 
@@ -160,6 +267,102 @@ class BuildTest(unittest.TestCase):
 	result = " 441 462 483 504 525 546\n 1017 1074 1131 1188 1245 1302\n 1593 1686 1779 1872 1965 2058\n 2169 2298 2427 2556 2685 2814\n 2745 2910 3075 3240 3405 3570\n 3321 3522 3723 3924 4125 4326\n"
 	Project("matmult_cc").quick_test(result, processes=4)
 
+# Workers with LIMIT=20 and SIZE=5 on 3 processes, the sequence
+# fires, starts, finishes and receives until the program quits
+WORKERS_SEQUENCE = [
+    "0 T #107", "0 T #107", "1 R 0", "2 R 0", "1 S #108", "2 T #108",
+    "0 R 2", "0 R 2", "1 F", "0 R 1", "0 R 1", "0 T #107", "0 T #107",
+    "1 R 0", "2 R 0", "1 T #108", "2 T #108", "0 R 1", "0 R 1",
+    "0 R 2", "0 R 2", "0 T #109" ]
+
+class SimulationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.project = Project("workers")
+        self.project.build()
+
+    def simulate(self, commands, batch_size=None, binary=False, delta=True):
+        simulation = import_gui("simulation")
+        controlseq = import_gui("controlseq")
+
+        class FullReportsSimulation(simulation.Simulation):
+            def read_header(self, stream):
+                simulation.Simulation.read_header(self, stream)
+                self.delta_reports = False
+
+        if delta:
+            s = simulation.Simulation()
+        else:
+            s = FullReportsSimulation()
+        s.use_binary_protocol = binary
+        program = self.project.start_simulation(
+            s, processes=3, params={ "LIMIT" : "20", "SIZE" : "5" })
+        try:
+            self.assertEquals(binary, s.controller.binary)
+            self.assertEquals(delta, s.delta_reports)
+            sequence = controlseq.ControlSequence(commands=commands)
+            failed = run_control_sequence(s, sequence, batch_size)
+        finally:
+            s.quit_on_shutdown = True
+            s.shutdown()
+            program.communicate()
+        return s, failed
+
+    def history(self, s):
+        return map(simulation_state, s.history_instances)
+
+    def test_simulation_text(self):
+        s, failed = self.simulate(WORKERS_SEQUENCE)
+        self.assertEquals(None, failed)
+        self.assertEquals("finished", s.state)
+        self.assertEquals(len(WORKERS_SEQUENCE), s.sequence.get_commands_size())
+        # the initial report, a report per command and the last query
+        self.assertEquals(len(WORKERS_SEQUENCE) + 2, len(s.history_instances))
+        tokens, activities, packets = simulation_state(s.runinstance)
+        self.assertEquals({ 104: [ (0, "1", None), (0, "2", None) ] }, tokens[0][0])
+        self.assertEquals({}, tokens[1][0])
+        self.assertEquals({}, packets)
+
+    def test_simulation_binary_protocol(self):
+        # names of binary reports are decoded from the table of libs/cailie/output.cpp,
+        # every step has to be the same as with the text protocol
+        text, failed = self.simulate(WORKERS_SEQUENCE)
+        binary, failed = self.simulate(WORKERS_SEQUENCE, binary=True)
+        self.assertEquals(None, failed)
+        self.assertEquals(text.sequence.commands, binary.sequence.commands)
+        self.assertEquals(self.history(text), self.history(binary))
+
+        text, failed = self.simulate(WORKERS_SEQUENCE, delta=False)
+        binary, failed = self.simulate(WORKERS_SEQUENCE, binary=True, delta=False)
+        self.assertEquals(self.history(text), self.history(binary))
+
+    def test_simulation_delta_reports(self):
+        for binary in (False, True):
+            delta, failed = self.simulate(WORKERS_SEQUENCE, binary=binary)
+            full, failed = self.simulate(WORKERS_SEQUENCE, binary=binary, delta=False)
+            self.assertEquals(None, failed)
+            self.assertEquals(self.history(full), self.history(delta))
+
+    def test_simulation_batches(self):
+        stepwise, failed = self.simulate(WORKERS_SEQUENCE)
+        for batch_size in (5, 1000):
+            batch, failed = self.simulate(WORKERS_SEQUENCE, batch_size=batch_size)
+            self.assertEquals(None, failed)
+            self.assertEquals(stepwise.sequence.commands, batch.sequence.commands)
+            self.assertEquals(simulation_state(stepwise.runinstance),
+                              simulation_state(batch.runinstance))
+
+        # the second finish fails, previous commands are recorded
+        commands = WORKERS_SEQUENCE[:9] + [ "1 F" ] + WORKERS_SEQUENCE[9:]
+        stepwise, failed = self.simulate(commands)
+        self.assertEquals(9, failed)
+        for batch_size in (4, 1000):
+            batch, failed = self.simulate(commands, batch_size=batch_size)
+            self.assertEquals(9, failed)
+            self.assertEquals(stepwise.sequence.commands, batch.sequence.commands)
+            self.assertEquals(simulation_state(stepwise.runinstance),
+                              simulation_state(batch.runinstance))
+
 class LibTest(unittest.TestCase):
     def test_lib_parameters(self):
         result = "1 1 1 1 \n2 1 1 1 \n4 4 1 1 \n8 8 8 1 \n16 16 16 16 \n"
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+
+from testutils import import_gui
+import unittest
+import copy
+
+runinstance = import_gui("runinstance")
+
+
+class TokenStoreTest(unittest.TestCase):
+
+    def make_store(self, tokens):
+        store = runinstance.TokenStore()
+        store.extend(tokens)
+        return store
+
+    def test_append_remove(self):
+        store = self.make_store([ (1, "a", None), (2, "b", None), (3, "c", None) ])
+        self.assertEquals(3, len(store))
+        self.assertEquals((2, "b", None), store.remove(2))
+        self.assertEquals(None, store.remove(2))
+        self.assertEquals(None, store.remove(10))
+        self.assertEquals(2, len(store))
+        self.assertEquals([ (1, "a", None), (3, "c", None) ], list(store))
+
+    def test_duplicate_pointers(self):
+        # tokens with the same pointer are removed in the order of insertion
+        store = self.make_store([ (1, "a", None), (2, "b", None),
+                                  (1, "c", None), (1, "d", None) ])
+        self.assertEquals((1, "a", None), store.remove(1))
+        self.assertEquals([ (2, "b", None), (1, "c", None), (1, "d", None) ],
+                          list(store))
+        store.append((1, "e", None))
+        self.assertEquals((1, "c", None), store.remove(1))
+        self.assertEquals((1, "d", None), store.remove(1))
+        self.assertEquals((1, "e", None), store.remove(1))
+        self.assertEquals(None, store.remove(1))
+        self.assertEquals([ (2, "b", None) ], list(store))
+        self.assertEquals({}, store.duplicates)
+
+    def test_compaction(self):
+        tokens = [ (i % 7, str(i), None) for i in xrange(40) ]
+        store = self.make_store(tokens)
+        expected = list(tokens)
+        for i in range(0, 40, 3) + range(1, 40, 3):
+            pointer = i % 7
+            token = store.remove(pointer)
+            first = [ t for t in expected if t[0] == pointer ][0]
+            self.assertEquals(first, token)
+            expected.remove(first)
+            self.assertEquals(expected, list(store))
+            self.assertEquals(len(expected), len(store))
+            # holes never prevail over tokens
+            self.assertTrue(len(store.tokens) <= 2 * len(store))
+        # positions are valid after compactions
+        for token in list(expected):
+            self.assertEquals(token, store.remove(token[0]))
+        self.assertEquals(0, len(store))
+        self.assertEquals([], list(store))
+
+    def test_copy(self):
+        store = self.make_store([ (1, "a", None), (1, "b", None), (2, "c", None) ])
+        store2 = store.copy()
+        store2.remove(1)
+        store2.append((3, "d", None))
+        self.assertEquals([ (1, "a", None), (1, "b", None), (2, "c", None) ],
+                          list(store))
+        self.assertEquals([ (1, "b", None), (2, "c", None), (3, "d", None) ],
+                          list(store2))
+        self.assertEquals((1, "a", None), store.remove(1))
+        self.assertEquals((1, "b", None), store.remove(1))
+        self.assertEquals((1, "b", None), store2.remove(1))
+
+
+class Transition:
+
+    def __init__(self, id):
+        self.id = id
+        self.collective = False
+
+    def has_code(self):
+        return True
+
+
+class Net:
+
+    def item_by_id(self, id):
+        return Transition(id)
+
+
+def make_runinstance(process_count=2):
+    ri = runinstance.RunInstance(None, process_count)
+    ri.net = Net()
+    for i in xrange(process_count):
+        ri.net_instances[i] = runinstance.NetInstance(i)
+    return ri
+
+def add_tokens(ri, process_id, place_id, tokens):
+    ri.net_instances[process_id].new_tokens[place_id] = tokens
+    ri.net_instances[process_id].clear_removed_and_new_tokens()
+
+def tokens(ri, process_id, place_id):
+    store = ri.net_instances[process_id].tokens.get(place_id)
+    return list(store) if store is not None else []
+
+def packets(ri, origin_id, target_id):
+    queue = ri.packets.get(target_id * ri.process_count + origin_id, ())
+    return [ (p.time, p.size, p.edge_id) for p in queue ]
+
+
+class CopyTest(unittest.TestCase):
+
+    def test_copy_tokens(self):
+        ri = make_runinstance()
+        add_tokens(ri, 0, 10, [ (1, "a", None), (2, "b", None) ])
+        snapshot = ri.copy()
+        snapshot.net_instances[0].remove_token(10, 1)
+        self.assertEquals([ (1, "a", None), (2, "b", None) ], tokens(ri, 0, 10))
+        self.assertEquals([ (2, "b", None) ], tokens(snapshot, 0, 10))
+
+        snapshot2 = ri.copy()
+        ri.net_instances[0].remove_token(10, 2)
+        add_tokens(ri, 0, 11, [ (3, "c", None) ])
+        self.assertEquals([ (1, "a", None), (2, "b", None) ], tokens(snapshot2, 0, 10))
+        self.assertEquals([ (1, "a", None) ], tokens(ri, 0, 10))
+        self.assertEquals([ (2, "b", None) ], tokens(snapshot, 0, 10))
+        self.assertEquals([], tokens(snapshot, 0, 11))
+
+        # a store is copied only once, next changes are made in place
+        store = snapshot.net_instances[0].tokens[10]
+        add_tokens(snapshot, 0, 10, [ (4, "d", None) ])
+        self.assertTrue(store is snapshot.net_instances[0].tokens[10])
+        self.assertEquals([ (1, "a", None) ], tokens(ri, 0, 10))
+
+    def test_copy_of_copy(self):
+        ri = make_runinstance()
+        add_tokens(ri, 1, 10, [ (1, "a", None) ])
+        snapshot = ri.copy()
+        snapshot2 = snapshot.copy()
+        add_tokens(snapshot, 1, 10, [ (2, "b", None) ])
+        self.assertEquals([ (1, "a", None) ], tokens(ri, 1, 10))
+        self.assertEquals([ (1, "a", None), (2, "b", None) ], tokens(snapshot, 1, 10))
+        self.assertEquals([ (1, "a", None) ], tokens(snapshot2, 1, 10))
+        add_tokens(ri, 1, 10, [ (3, "c", None) ])
+        self.assertEquals([ (1, "a", None) ], tokens(snapshot2, 1, 10))
+
+    def test_copy_activities(self):
+        ri = make_runinstance()
+        ri.transition_fired(0, 10, 5, [])
+        ri.transition_fired(1, 10, 6, [])
+        snapshot = ri.copy()
+        snapshot.transition_blocked(0)
+        snapshot.event_quit(1, 20)
+        self.assertFalse(ri.activites[0].blocked)
+        self.assertFalse(ri.activites[1].quit)
+        self.assertTrue(snapshot.activites[0].blocked)
+        self.assertTrue(snapshot.activites[1].quit)
+        self.assertTrue(snapshot.last_event_activity is snapshot.activites[1])
+
+        snapshot2 = ri.copy()
+        ri.transition_blocked(1)
+        ri.transition_finished(0, 30)
+        self.assertFalse(snapshot2.activites[1].blocked)
+        self.assertTrue(ri.activites[1].blocked)
+        self.assertFalse(snapshot.activites[1].blocked)
+        self.assertEquals(None, ri.activites[0])
+        self.assertEquals(5, snapshot.activites[0].transition.id)
+
+    def test_copy_packets(self):
+        ri = make_runinstance()
+        ri.event_send(0, 1, 1, 10, 100)
+        ri.event_send(0, 2, 1, 20, 100)
+        snapshot = ri.copy()
+        snapshot.event_receive(1, 5, 0)
+        snapshot.event_send(1, 6, 0, 30, 101)
+        self.assertEquals([ (1, 10, 100), (2, 20, 100) ], packets(ri, 0, 1))
+        self.assertEquals([ (2, 20, 100) ], packets(snapshot, 0, 1))
+        self.assertEquals([], packets(ri, 1, 0))
+        self.assertEquals([ (6, 30, 101) ], packets(snapshot, 1, 0))
+
+        ri.event_receive(1, 5, 0)
+        ri.event_receive(1, 6, 0)
+        self.assertEquals([], packets(ri, 0, 1))
+        self.assertEquals([ (2, 20, 100) ], packets(snapshot, 0, 1))
+
+        snapshot.clear_packets(0, 1)
+        ri.event_send(0, 7, 1, 40, 100)
+        self.assertEquals([], packets(snapshot, 0, 1))
+        self.assertEquals([ (7, 40, 100) ], packets(ri, 0, 1))
+
+        # the original changes a shared queue first
+        snapshot = ri.copy()
+        ri.event_send(0, 8, 1, 50, 100)
+        ri.event_receive(1, 9, 0)
+        self.assertEquals([ (8, 50, 100) ], packets(ri, 0, 1))
+        self.assertEquals([ (7, 40, 100) ], packets(snapshot, 0, 1))
+
+    def test_copy_debt_receives(self):
+        ri = make_runinstance()
+        ri.event_receive(1, 1, 0)
+        ri.event_receive(1, 2, 0)
+        snapshot = ri.copy()
+        snapshot.event_send(0, 3, 1, 10, 100)
+        self.assertEquals(2, len(ri.debt_receives[2]))
+        self.assertEquals(1, len(snapshot.debt_receives[2]))
+        self.assertEquals(0, ri.missed_receives)
+        self.assertEquals(1, snapshot.missed_receives)
+
+        ri.event_receive(1, 3, 0)
+        snapshot2 = ri.copy()
+        ri.event_send(0, 4, 1, 10, 100)
+        self.assertEquals(3, len(snapshot2.debt_receives[2]))
+        ri.event_send(0, 5, 1, 10, 100)
+        ri.event_send(0, 6, 1, 10, 100)
+        self.assertFalse(2 in ri.debt_receives)
+        self.assertEquals(1, len(snapshot.debt_receives[2]))
+        self.assertEquals(3, len(snapshot2.debt_receives[2]))
+        self.assertEquals([], packets(ri, 0, 1))
+
+
+class PacketQueueTest(unittest.TestCase):
+
+    def test_queue(self):
+        queue = runinstance.PacketQueue()
+        for time, size, edge_id in [ (1, 10, 100), (2, 20, 101),
+                                     (3, 30, 100), (4, 40, 100) ]:
+            queue.append(runinstance.Packet(time, size, edge_id))
+        self.assertEquals(4, len(queue))
+        self.assertEquals(1, queue.first().time)
+        first, count, size = queue.get_edge_info(100)
+        self.assertEquals((1, 3, 80), (first.time, count, size))
+        first, count, size = queue.get_edge_info(101)
+        self.assertEquals((2, 1, 20), (first.time, count, size))
+        self.assertEquals(None, queue.get_edge_info(102))
+
+        self.assertEquals(1, queue.popleft().time)
+        first, count, size = queue.get_edge_info(100)
+        self.assertEquals((3, 2, 70), (first.time, count, size))
+        self.assertEquals(2, queue.popleft().time)
+        self.assertEquals(None, queue.get_edge_info(101))
+        self.assertEquals([ 3, 4 ], [ p.time for p in queue ])
+        self.assertEquals({ 100: 70 }, queue.sizes)
+
+    def test_copy(self):
+        queue = runinstance.PacketQueue()
+        queue.append(runinstance.Packet(1, 10, 100))
+        queue2 = copy.copy(queue)
+        queue2.append(runinstance.Packet(2, 20, 100))
+        queue.popleft()
+        self.assertEquals(0, len(queue))
+        self.assertEquals({}, queue.sizes)
+        first, count, size = queue2.get_edge_info(100)
+        self.assertEquals((1, 2, 30), (first.time, count, size))
+
+    def test_receive(self):
+        ri = make_runinstance(3)
+        ri.event_send(0, 1, 2, 10, 100)
+        ri.event_send(1, 2, 2, 20, 100)
+        ri.event_send(0, 3, 2, 30, 101)
+        ri.event_send(0, 4, 2, 40, 100)
+        self.assertEquals(3, ri.get_packets_count(0, 2))
+        self.assertEquals(1, ri.get_packets_count(1, 2))
+        self.assertEquals(0, ri.get_packets_count(2, 0))
+        self.assertEquals([ (2, 0, True, "0 -> 2 | 10 (1, 40)"),
+                            (2, 1, True, "1 -> 2 | 20") ],
+                          ri.get_packets_info(100, 2))
+        self.assertEquals([ (2, 0, False, "0 -> 2 | 30 *") ],
+                          ri.get_packets_info(101, 2))
+
+        self.assertEquals(4, ri.event_receive(2, 5, 0))
+        self.assertEquals([ (2, 0, True, "0 -> 2 | 30") ],
+                          ri.get_packets_info(101, 2))
+        self.assertEquals([ (2, 0, False, "0 -> 2 | 40 *"),
+                            (2, 1, True, "1 -> 2 | 20") ],
+                          ri.get_packets_info(100, 2))
+        ri.event_receive(2, 6, 0)
+        ri.event_receive(2, 7, 0)
+        self.assertEquals(0, ri.get_packets_count(0, 2))
+        self.assertEquals([ (2, 1, True, "1 -> 2 | 20") ],
+                          ri.get_packets_info(100, 2))
+
+        # a receive on debt consumes the next sent packet
+        ri.event_receive(2, 8, 0)
+        ri.event_send(0, 9, 2, 50, 100)
+        ri.event_send(0, 10, 2, 60, 100)
+        self.assertEquals(1, ri.missed_receives)
+        self.assertEquals(1, ri.get_packets_count(0, 2))
+        self.assertEquals([ (2, 0, True, "0 -> 2 | 60"),
+                            (2, 1, True, "1 -> 2 | 20") ],
+                          ri.get_packets_info(100, 2))
+
+if __name__ == '__main__':
+    unittest.main()
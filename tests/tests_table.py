@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+
+from testutils import import_gui
+import unittest
+import operator
+import numpy as np
+
+table = import_gui("table")
+
+COLUMNS = [("a", "<i4"), ("b", "<i4"), ("v", "<f8")]
+
+ROWS = [(1, 1, 1.0),
+        (2, 1, None),
+        (1, 2, 3.0),
+        (None, 1, 4.0),
+        (1, 1, 5.0),
+        (2, None, None),
+        (None, 1, 2.0),
+        (2, 1, None),
+        (1, 2, -1.0)]
+
+def make_table(rows=ROWS):
+    t = table.Table(COLUMNS, 2)
+    for row in rows:
+        t.add_row(row)
+    return t
+
+def select_group(t, columns, key, filters=[]):
+    """ Rows of a group selected by filters, masked keys are selected by masks """
+    if len(columns) == 1:
+        key = (key,)
+    filters = filters + [ (column, operator.eq, value)
+                          for column, value in zip(columns, key)
+                          if value is not None ]
+    data = t.select(filters=filters)
+    for column, value in zip(columns, key):
+        if value is None:
+            data = data[np.ma.getmaskarray(data[column])]
+    return data
+
+def valid_values(data, column):
+    return [ value for value in data[column].tolist() if value is not None ]
+
+
+class GroupByTest(unittest.TestCase):
+
+    def check_groups(self, t, columns, filters=[]):
+        groups = t.group_by(columns, filters)
+        counts = groups.count()
+        sums = groups.sum("v")
+        mins = groups.min("v")
+        maxs = groups.max("v")
+        rows = 0
+        for key in groups.keys:
+            self.assertTrue(key in groups)
+            data = select_group(t, columns, key, filters)
+            self.assertEquals(groups.get(key).tolist(), data.tolist())
+            self.assertEquals(counts[key], len(data))
+            values = valid_values(data, "v")
+            self.assertEquals(sums[key], sum(values))
+            self.assertEquals(mins[key], min(values) if values else None)
+            self.assertEquals(maxs[key], max(values) if values else None)
+            rows += len(data)
+        self.assertEquals(rows, len(t.select(filters=filters)))
+        return groups
+
+    def test_one_column(self):
+        groups = self.check_groups(make_table(), ["a"])
+        self.assertEquals(sorted(groups.keys), [None, 1, 2])
+        self.assertEquals(groups.count(), { None: 2, 1: 4, 2: 3 })
+
+    def test_more_columns(self):
+        groups = self.check_groups(make_table(), ["a", "b"])
+        self.assertEquals(sorted(groups.keys),
+                          [(None, 1), (1, 1), (1, 2), (2, None), (2, 1)])
+        self.assertEquals(groups.get((1, 2), ["v"]).tolist(), [3.0, -1.0])
+
+    def test_masked_values(self):
+        groups = make_table().group_by(["a", "b"])
+        # All values of these groups are masked
+        self.assertEquals(groups.min("v")[(2, 1)], None)
+        self.assertEquals(groups.max("v")[(2, None)], None)
+        self.assertEquals(groups.sum("v")[(2, 1)], 0)
+        self.assertEquals(groups.count()[(2, 1)], 2)
+
+    def test_unknown_group(self):
+        groups = make_table().group_by("a")
+        self.assertFalse(3 in groups)
+        self.assertEquals(len(groups.get(3)), 0)
+        self.assertEquals(groups.get(3, ["v"]).tolist(), [])
+
+    def test_filters(self):
+        groups = self.check_groups(make_table(), ["a"], [("v", operator.gt, 1.5)])
+        self.assertEquals(groups.count(), { None: 2, 1: 2 })
+        groups = self.check_groups(make_table(), ["a", "b"],
+                                   [("v", operator.ne, 3.0), ("b", operator.eq, 1)])
+        self.assertEquals(groups.count(), { (None, 1): 2, (1, 1): 2 })
+
+    def check_empty(self, groups):
+        self.assertEquals(len(groups), 0)
+        self.assertEquals(groups.count(), {})
+        self.assertEquals(groups.sum("v"), {})
+        self.assertEquals(groups.min("v"), {})
+        self.assertEquals(groups.max("v"), {})
+        edges, counts = groups.histogram("v", bins=2)
+        self.assertEquals(edges.tolist(), [0.0, 0.5, 1.0])
+        self.assertEquals(counts, {})
+
+    def test_empty_filter_result(self):
+        self.check_empty(make_table().group_by(["a", "b"],
+                                               [("a", operator.gt, 100)]))
+
+    def test_empty_table(self):
+        self.check_empty(make_table([]).group_by("a"))
+
+    def test_histogram(self):
+        t = make_table()
+        groups = t.group_by("a")
+        edges, counts = groups.histogram("v", bins=4)
+        self.assertEquals(edges.tolist(), [-1.0, 0.5, 2.0, 3.5, 5.0])
+        for key in groups.keys:
+            values = valid_values(select_group(t, ["a"], key), "v")
+            expected, _ = np.histogram(values, bins=edges)
+            self.assertEquals(counts[key].tolist(), expected.tolist())
+        # The maximum is counted in the last bin
+        self.assertEquals(counts[1].tolist(), [1, 1, 1, 1])
+        self.assertEquals(counts[2].tolist(), [0, 0, 0, 0])
+
+    def test_histogram_range(self):
+        groups = make_table().group_by("a")
+        edges, counts = groups.histogram("v", bins=2, range=(1.0, 4.0))
+        self.assertEquals(edges.tolist(), [1.0, 2.5, 4.0])
+        # Values outside of the range are not counted, the last bin is closed
+        self.assertEquals(counts[None].tolist(), [1, 1])
+        self.assertEquals(counts[1].tolist(), [1, 1])
+        self.assertEquals(counts[2].tolist(), [0, 0])
+
+
+COMPARE_FUNCTIONS = (operator.eq, operator.ne, operator.lt,
+                     operator.le, operator.gt, operator.ge)
+
+class IndexTest(unittest.TestCase):
+
+    def check_select(self, filters):
+        t = make_table()
+        expected = t.select(filters=filters).tolist()
+        t.create_index("a")
+        t.create_index("v")
+        self.assertEquals(t.select(filters=filters).tolist(), expected)
+        return expected
+
+    def test_compare_functions(self):
+        for f_cmp in COMPARE_FUNCTIONS:
+            for value in (0, 1, 2, 3):
+                self.check_select([("a", f_cmp, value)])
+            for value in (-2.0, 1.0, 2.5, 5.0, 6.0):
+                self.check_select([("v", f_cmp, value)])
+
+    def test_more_filters(self):
+        for f_cmp in COMPARE_FUNCTIONS:
+            self.check_select([("a", f_cmp, 1), ("v", operator.ge, 1.0)])
+            self.check_select([("v", f_cmp, 3.0), ("b", operator.eq, 1)])
+            self.check_select([("b", f_cmp, 1), ("a", operator.ne, 2),
+                               ("v", operator.lt, 4.5)])
+
+    def test_masked_cells(self):
+        # Masked cells pass no filter
+        self.assertEquals(self.check_select([("a", operator.ne, 1)]),
+                          [(2, 1, None), (2, None, None), (2, 1, None)])
+        self.assertEquals(self.check_select([("v", operator.le, 1.0)]),
+                          [(1, 1, 1.0), (1, 2, -1.0)])
+
+    def test_index(self):
+        t = make_table()
+        index = t.create_index("a")
+        self.assertTrue(t.create_index(0) is index)
+        self.assertEquals(index.rows.tolist(), [0, 2, 4, 8, 1, 5, 7])
+        self.assertEquals(index.values.tolist(), [1, 1, 1, 1, 2, 2, 2])
+        self.assertEquals(sorted(index.find(operator.ne, 2).tolist()), [0, 2, 4, 8])
+        self.assertTrue(index.supports(operator.le))
+        self.assertFalse(index.supports(lambda x, y: x == y))
+
+    def test_filtered_columns(self):
+        t = make_table()
+        t.create_index("v")
+        t.select(filters=[("a", operator.eq, 1), ("v", operator.eq, 1.0)])
+        self.assertEquals(t.filtered_columns, set(["a"]))
+
+    def test_drop_indexes(self):
+        t = make_table()
+        filters = [("a", operator.eq, 1)]
+        t.create_index("a")
+        t.add_row((1, 3, 7.0))
+        self.assertEquals(t.indexes, {})
+        t.create_index("a")
+        t.add_rows([(1, 4, 8.0), (None, 4, None)])
+        self.assertEquals(t.indexes, {})
+        t.create_index("a")
+        t.add_columns([[1], [5], [9.0]])
+        self.assertEquals(t.indexes, {})
+        t.create_index("a")
+        self.assertEquals(t.select(["v"], filters).tolist(),
+                          [1.0, 3.0, 5.0, -1.0, 7.0, 8.0, 9.0])
+
+
+class BuilderTest(unittest.TestCase):
+
+    def check_table(self, t, rows=ROWS):
+        self.assertEquals(len(t), len(rows))
+        self.assertEquals(list(t), map(list, rows))
+        self.assertEquals(t.select().tolist(), make_table(rows).select().tolist())
+
+    def test_rows_to_array(self):
+        data = table.rows_to_array(ROWS, COLUMNS)
+        self.assertEquals(data.tolist(), ROWS)
+        self.assertEquals(np.ma.getmaskarray(data["v"]).tolist(),
+                          [ row[2] is None for row in ROWS ])
+        data = table.rows_to_array([], COLUMNS)
+        self.assertEquals(len(data), 0)
+        self.assertEquals(data.dtype, np.dtype(COLUMNS))
+
+    def test_add_rows(self):
+        t = table.Table(COLUMNS, 2)
+        t.add_rows(ROWS[:3])
+        t.add_rows([])
+        t.add_rows(table.rows_to_array(ROWS[3:], COLUMNS))
+        self.check_table(t)
+
+    def test_add_columns(self):
+        t = table.Table(COLUMNS, 2)
+        t.add_row(ROWS[0])
+        rows = ROWS[1:]
+        columns = [ [ 0 if value is None else value for value in column ]
+                    for column in zip(*rows) ]
+        masks = [ None, [ row[1] is None for row in rows ],
+                  [ row[2] is None for row in rows ] ]
+        # A masked cell in a column without a mask is not masked
+        t.add_columns(columns, masks)
+        self.assertEquals(t[3].tolist(), (0, 1, 4.0))
+        t = table.Table(COLUMNS, 2)
+        t.add_row(ROWS[0])
+        masks[0] = [ row[0] is None for row in rows ]
+        t.add_columns(columns, masks)
+        self.check_table(t)
+
+    def test_builder(self):
+        for chunk_size in (1, 3, len(ROWS), 100):
+            builder = table.TableBuilder(COLUMNS, chunk_size)
+            builder.add_rows(ROWS[:2])
+            for row in ROWS[2:]:
+                builder.add_row(row)
+            self.check_table(builder.build())
+
+    def test_empty_builder(self):
+        t = table.TableBuilder(COLUMNS).build()
+        self.check_table(t, [])
+        self.assertEquals(t.header, ["a", "b", "v"])
+        t.add_row(ROWS[0])
+        self.check_table(t, ROWS[:1])
+
+    def test_add_after_build(self):
+        builder = table.TableBuilder(COLUMNS, 3)
+        builder.add_rows(ROWS[:4])
+        t = builder.build()
+        t.add_row(ROWS[4])
+        t.add_rows(ROWS[5:])
+        self.check_table(t)
+        # The builder starts again with no rows
+        builder.add_row(ROWS[0])
+        self.check_table(builder.build(), ROWS[:1])
+
+
+if __name__ == '__main__':
+    unittest.main()
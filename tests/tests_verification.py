@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 
 from verifutils import Project
+import xml.etree.ElementTree as xml
 import unittest
+import tempfile
+import os
 
 
 class StateSpaceTest(unittest.TestCase):
@@ -36,6 +39,45 @@ class StateSpaceTest(unittest.TestCase):
         self.assertEquals(result.get("value"), "1")
         self.assertEquals(result.get("status"), "fail")
 
+    def test_statespace2_symmetry(self):
+        report = Project("statespace2").statespace(analyses=["deadlock"],
+                                                   por=False,
+                                                   symmetries=["0-3"],
+                                                   processes=4)
+        result = self.get_result(report, "Overall statistics", "Number of states")
+        self.assertEquals(result.get("value"), "36")
+        result = self.get_result(report, "Quit analysis", "Number of deadlock states")
+        self.assertEquals(result.get("value"), "1")
+        self.assertEquals(result.get("status"), "fail")
+
+    def test_statespace3_symmetry_distance(self):
+        # Each process reaches the final state by 2 or by 3 steps
+        for symmetries, states in (((), "25"), (["0-1"], "15")):
+            report = Project("statespace3").statespace(analyses=["deadlock"],
+                                                       por=False,
+                                                       symmetries=symmetries,
+                                                       processes=2)
+            result = self.get_result(report, "Overall statistics", "Number of states")
+            self.assertEquals(result.get("value"), states)
+            result = self.get_result(report, "Quit analysis", "Number of deadlock states")
+            state = result.find("states/state")
+            self.assertEquals(state.get("distance"), "4")
+            self.assertEquals(len(state.find("control-sequence").text.split()), 4 * 3)
+
+    def test_statespace2_symmetry_invalid(self):
+        p = Project("statespace2")
+        p.statespace(report=False,
+                     symmetries=["0-2", "2-3"],
+                     processes=4,
+                     fail=True,
+                     result="Ranges of symmetric processes overlap\n")
+        p.statespace(report=False,
+                     symmetries=["0-3"],
+                     threads=2,
+                     processes=4,
+                     fail=True,
+                     result="Symmetry reduction cannot be used with more threads\n")
+
     def test_por1(self):
         Project("por1").check_por(processes=2)
 
@@ -58,6 +100,55 @@ class StateSpaceTest(unittest.TestCase):
     def test_por_cycles(self):
         Project("por_cycles").check_por(processes=2)
 
+    def workers_statespace(self, **kw):
+        report = Project("workers").statespace(
+            analyses=["deadlock", "fmarking", "cycle", "tchv"],
+            write_statespace=True,
+            processes=3,
+            params={ "LIMIT" : "20", "SIZE" : "5" },
+            **kw)
+        states = report.find("statespace")
+        report.remove(states)
+        return (xml.tostring(report),
+                sorted(xml.tostring(e) for e in states.findall("state")))
+
+    def test_threads(self):
+        self.assertEquals(self.workers_statespace(),
+                          self.workers_statespace(threads=4))
+
+    def test_hash_only(self):
+        self.assertEquals(self.workers_statespace(),
+                          self.workers_statespace(hash_only=True))
+        self.assertEquals(self.workers_statespace(),
+                          self.workers_statespace(hash_only=True, threads=4))
+
+    def test_hash_cache(self):
+        self.assertEquals(self.workers_statespace(),
+                          self.workers_statespace(hash_cache=False))
+        self.assertEquals(self.workers_statespace(threads=4),
+                          self.workers_statespace(hash_cache=False, threads=4))
+        def statespace(**kw):
+            report = Project("statespace2").statespace(write_statespace=True,
+                                                       symmetries=["0-3"],
+                                                       processes=4,
+                                                       **kw)
+            return sorted(e.get("hash") for e in report.find("statespace").findall("state"))
+        self.assertEquals(statespace(), statespace(hash_cache=False))
+        full = statespace(por=False)
+        self.assertEquals(len(full), 36)
+        self.assertEquals(full, statespace(por=False, hash_cache=False))
+
+    def test_disk_store(self):
+        directory = tempfile.mkdtemp()
+        try:
+            self.assertEquals(self.workers_statespace(),
+                              self.workers_statespace(disk_store=directory))
+            self.assertEquals(self.workers_statespace(),
+                              self.workers_statespace(disk_store=directory,
+                                                      threads=4))
+            self.assertEquals(os.listdir(directory), [])
+        finally:
+            os.rmdir(directory)
 
 if __name__ == '__main__':
     unittest.main()
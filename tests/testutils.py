@@ -2,6 +2,8 @@
 import subprocess
 import os
 import time
+import sys
+import threading
 
 KAIRA_TESTS = os.path.dirname(os.path.abspath(__file__))
 KAIRA_ROOT = os.path.dirname(KAIRA_TESTS)
@@ -193,11 +195,32 @@ class Project:
         self.build()
         self.run(result, **kw)
 
+    def start_simulation(self, simulation, processes=1, params={}):
+        """ Starts the program in the simulation mode and connects the simulation
+            to it. Returns the started program when the simulation is inited """
+        args = [ self.get_executable(), "-s", "auto", "-b", "-r{0}".format(processes) ]
+        for name in params:
+            args.append("-p{0}={1}".format(name, params[name]))
+        program = subprocess.Popen(args, stdout=subprocess.PIPE, cwd=self.get_directory())
+        port = int(program.stdout.readline())
+        inited = threading.Event()
+        simulation.set_callback("inited", inited.set)
+        simulation.connect("localhost", port)
+        if not inited.wait(10):
+            program.kill()
+            raise Exception("Simulation of '{0}' is not inited".format(self.name))
+        return program
+
     def check_tracelog(self, output):
         filename = os.path.join(self.get_directory(), "trace.kth")
         args = [ CMDUTILS, "--tracelog", filename ]
         RunProgram("python", args).run(output)
 
+    def open_tracelog(self, **kw):
+        tracelog = import_gui("tracelog")
+        filename = os.path.join(self.get_directory(), "trace.kth")
+        return tracelog.TraceLog(filename, **kw)
+
     def build_main(self):
         self.build("lib")
         if self.mpi and not self.rpc:
@@ -249,3 +272,62 @@ class Project:
 
     def stop_server(self):
         self.server.kill()
+
+def runinstance_state(ri):
+    """ Tokens (including changes of the last event) of all processes """
+    def tokens(stores):
+        return dict((place_id, list(store))
+                    for place_id, store in stores.items() if store)
+    return dict((process_id,
+                 (tokens(ni.tokens), tokens(ni.new_tokens), tokens(ni.removed_tokens)))
+                for process_id, ni in ri.net_instances.items())
+
+def import_gui(name):
+    """ Import a module of the gui """
+    # cmdutils fakes gui libraries, modules can be then imported without gtk
+    if KAIRA_GUI not in sys.path:
+        sys.path.insert(0, KAIRA_GUI)
+    import cmdutils
+    return __import__(name)
+
+def run_control_sequence(simulation, sequence, batch_size=None):
+    """ Runs the control sequence in the simulation and waits until all commands
+        are recorded (or a command fails) and all replies are processed.
+        Returns the index of the failed command or None """
+    done = threading.Event()
+    failed = []
+
+    def check():
+        if (failed or simulation.sequence.get_commands_size() ==
+                      sequence.get_commands_size()) \
+           and not simulation.controller.callbacks:
+            done.set()
+
+    def command_failed(sequence, index):
+        failed.append(index)
+        check()
+
+    callbacks = [ simulation.set_callback("changed", lambda *args: check()),
+                  simulation.set_callback("command-failed", command_failed) ]
+    simulation.run_sequence(sequence, batch_size)
+    finished = done.wait(10)
+    for callback in callbacks:
+        callback.remove()
+    if not finished:
+        raise Exception("Control sequence is not finished")
+    return failed[0] if failed else None
+
+def simulation_state(runinstance):
+    """ Tokens, enabled transitions, activities and packets of a simulation """
+    def activity(a):
+        if a is None:
+            return None
+        return (a.name, a.process_id, a.transition.id, a.blocked)
+    return (dict((process_id,
+                  (dict((place_id, list(store))
+                        for place_id, store in ni.tokens.items() if store),
+                   ni.enabled_transitions))
+                 for process_id, ni in runinstance.net_instances.items()),
+            map(activity, runinstance.activites),
+            dict((index, [ (p.size, p.edge_id) for p in queue ])
+                 for index, queue in runinstance.packets.items() if queue))
@@ -10,6 +10,12 @@ class Project(testutils.Project):
                    analyses=None,
                    por=True,
                    write_statespace=False,
+                   threads=1,
+                   hash_only=False,
+                   disk_store=None,
+                   hash_cache=True,
+                   symmetries=(),
+                   result=None,
                    **kw):
         self.build("statespace")
         extra_args = [ "-Vsilent" ]
@@ -17,9 +23,18 @@ class Project(testutils.Project):
             extra_args.append("-Vdisable-por")
         if write_statespace:
             extra_args.append("-Vwrite-statespace")
+        if threads != 1:
+            extra_args.append("-Vthreads={0}".format(threads))
+        if hash_only:
+            extra_args.append("-Vhash-only")
+        if disk_store:
+            extra_args.append("-Vdisk-store={0}".format(disk_store))
+        if not hash_cache:
+            extra_args.append("-Vdisable-hash-cache")
+        extra_args += [ "-Vsymmetry={0}".format(s) for s in symmetries ]
         if analyses:
             extra_args += [ "-V" + a for a in analyses ]
-        self.run(None, extra_args=extra_args, **kw)
+        self.run(result, extra_args=extra_args, **kw)
 
         if report:
             kreport = os.path.join(self.get_directory(), self.name + ".kreport")